@@ -1,13 +1,353 @@
 import json
 import os
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import base64
+import hashlib
+import csv
+import tempfile
+import uuid
+import openpyxl
+import boto3
+from botocore.config import Config
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class InvalidQuery(ValueError):
+    pass
+
+def parse_limit(value: Optional[str]) -> int:
+    try:
+        return min(max(int(value or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        raise InvalidQuery('Invalid limit')
+
+def parse_filters(params: dict) -> dict:
+    """Фильтры строк: period, release_id, min_amount, max_amount"""
+    filters = {}
+    try:
+        if params.get('period'):
+            filters['period'] = params['period']
+        if params.get('release_id'):
+            filters['release_id'] = int(params['release_id'])
+        if params.get('min_amount'):
+            filters['min_amount'] = str(Decimal(params['min_amount']))
+        if params.get('max_amount'):
+            filters['max_amount'] = str(Decimal(params['max_amount']))
+    except (ValueError, InvalidOperation):
+        raise InvalidQuery('Invalid filter value')
+    return filters
+
+def filters_fingerprint(filters: dict, group_by: Optional[str]) -> str:
+    """Отпечаток запроса: курсор действителен только с теми же фильтрами и группировкой"""
+    payload = json.dumps({'filters': filters, 'group_by': group_by}, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+def encode_page_cursor(key: list, fingerprint: str) -> str:
+    """Непрозрачный курсор: ключ последней отданной строки и отпечаток фильтров"""
+    payload = json.dumps({'k': key, 'f': fingerprint}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_page_cursor(token: Optional[str], fingerprint: str) -> Optional[list]:
+    if not token:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        key = payload['k']
+        if not isinstance(key, list) or len(key) != 2:
+            raise ValueError(key)
+    except (ValueError, KeyError, TypeError):
+        raise InvalidQuery('Invalid cursor')
+    if payload.get('f') != fingerprint:
+        raise InvalidQuery('Cursor does not match current filters')
+    return key
+
+def filter_conditions(filters: dict, amount_column: str = 'amount') -> Tuple[List[str], list]:
+    conditions = []
+    values = []
+    if 'period' in filters:
+        conditions.append('period = %s')
+        values.append(filters['period'])
+    if 'release_id' in filters:
+        conditions.append('release_id = %s')
+        values.append(filters['release_id'])
+    if 'min_amount' in filters:
+        conditions.append(f'{amount_column} >= %s')
+        values.append(Decimal(filters['min_amount']))
+    if 'max_amount' in filters:
+        conditions.append(f'{amount_column} <= %s')
+        values.append(Decimal(filters['max_amount']))
+    return conditions, values
+
+def fetch_report_page(cursor, user_id: str, filters: dict, limit: int, token: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+    """
+    Страница строк отчётов артиста по ключу (uploaded_at, id), от новых к старым.
+    Идёт по индексу (user_id, status, uploaded_at, id), поэтому стоимость не зависит от номера страницы.
+    Возвращает строки и курсор следующей страницы (None, если это последняя)
+    """
+    fingerprint = filters_fingerprint(filters, None)
+    before = decode_page_cursor(token, fingerprint)
+    
+    conditions, values = filter_conditions(filters)
+    if before:
+        try:
+            values.extend([datetime.fromisoformat(before[0]), int(before[1])])
+        except (ValueError, TypeError):
+            raise InvalidQuery('Invalid cursor')
+        conditions.append('(uploaded_at, id) < (%s, %s)')
+    extra = ''.join(f'\n          AND {condition}' for condition in conditions)
+    
+    cursor.execute(f"""
+        SELECT 
+            id,
+            period,
+            artist_name,
+            album_name,
+            amount,
+            release_id,
+            uploaded_at,
+            status
+        FROM financial_reports
+        WHERE user_id = %s 
+          AND status = 'matched'
+          AND id > 2{extra}
+        ORDER BY uploaded_at DESC, id DESC
+        LIMIT %s
+    """, [user_id, *values, limit + 1])
+    rows = cursor.fetchall()
+    
+    reports = []
+    for row in rows[:limit]:
+        reports.append({
+            'id': row[0],
+            'period': row[1],
+            'artist_name': row[2],
+            'album_name': row[3],
+            'amount': float(row[4]),
+            'release_id': row[5],
+            'uploaded_at': row[6].isoformat() if row[6] else None,
+            'status': row[7]
+        })
+    
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        # uploaded_at NOT NULL с V0130; старые строки без даты там же получили начало эпохи
+        uploaded_at = last[6] or datetime(1970, 1, 1)
+        next_cursor = encode_page_cursor([uploaded_at.isoformat(), last[0]], fingerprint)
+    
+    return reports, next_cursor
+
+def fetch_release_page(cursor, user_id: str, filters: dict, limit: int, token: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+    """
+    Агрегация по релизам, от самых доходных.
+    Без фильтра по сумме строки не читаются вовсе — итоги берутся из artist_earnings_rollup
+    """
+    fingerprint = filters_fingerprint(filters, 'release')
+    after = decode_page_cursor(token, fingerprint)
+    
+    if 'min_amount' in filters or 'max_amount' in filters:
+        conditions, values = filter_conditions(filters)
+        source = f"""
+            SELECT release_id, SUM(amount) AS total, COUNT(*) AS rows_count
+            FROM financial_reports
+            WHERE user_id = %s AND status = 'matched' AND id > 2
+              {''.join(f' AND {condition}' for condition in conditions)}
+            GROUP BY release_id
+        """
+    else:
+        rollup_filters = {k: v for k, v in filters.items() if k in ('period', 'release_id')}
+        conditions, values = filter_conditions(rollup_filters)
+        source = f"""
+            SELECT NULLIF(release_id, 0) AS release_id, SUM(total_amount) AS total, SUM(rows_count) AS rows_count
+            FROM artist_earnings_rollup
+            WHERE user_id = %s
+              {''.join(f' AND {condition}' for condition in conditions)}
+            GROUP BY release_id
+        """
+    
+    keyset = ''
+    keyset_values = []
+    if after:
+        try:
+            keyset_values = [Decimal(after[0]), int(after[1])]
+        except (InvalidOperation, ValueError, TypeError):
+            raise InvalidQuery('Invalid cursor')
+        keyset = 'WHERE (t.total, COALESCE(t.release_id, 0)) < (%s, %s)'
+    
+    cursor.execute(f"""
+        SELECT t.release_id, r.release_name, t.total, t.rows_count
+        FROM ({source}) t
+        LEFT JOIN releases r ON r.id = t.release_id
+        {keyset}
+        ORDER BY t.total DESC, COALESCE(t.release_id, 0) DESC
+        LIMIT %s
+    """, [user_id, *values, *keyset_values, limit + 1])
+    rows = cursor.fetchall()
+    
+    releases = []
+    for row in rows[:limit]:
+        releases.append({
+            'release_id': row[0],
+            'release_name': row[1],
+            'total': float(row[2]),
+            'rows_count': int(row[3])
+        })
+    
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_page_cursor([str(last[2]), last[0] or 0], fingerprint)
+    
+    return releases, next_cursor
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+EXPORT_FETCH_SIZE = 2000
+INLINE_EXPORT_LIMIT = 3 * 1024 * 1024
+EXPORT_LINK_TTL = 3600
+EXPORT_HEADER = ['Период', 'Исполнитель', 'Альбом', 'ID релиза', 'Дата загрузки', 'Сумма']
+
+def statement_rows(conn, user_id: str, filters: dict):
+    """
+    Строки выписки через именованный (серверный) курсор: в память попадает только текущая порция.
+    После каждого периода и в конце отдаёт строку итога
+    """
+    conditions, values = filter_conditions(filters)
+    extra = ''.join(f' AND {condition}' for condition in conditions)
+    
+    with conn.cursor(name=f"statement_{uuid.uuid4().hex}") as export_cursor:
+        export_cursor.itersize = EXPORT_FETCH_SIZE
+        export_cursor.execute(f"""
+            SELECT period, artist_name, album_name, release_id, uploaded_at, amount
+            FROM financial_reports
+            WHERE user_id = %s AND status = 'matched' AND id > 2{extra}
+            ORDER BY period DESC, uploaded_at, id
+        """, [user_id, *values])
+        
+        current_period = None
+        period_total = Decimal(0)
+        grand_total = Decimal(0)
+        
+        for period, artist_name, album_name, release_id, uploaded_at, amount in export_cursor:
+            if current_period is not None and period != current_period:
+                yield [f'Итого за {current_period}', None, None, None, None, period_total]
+                period_total = Decimal(0)
+            current_period = period
+            period_total += amount
+            grand_total += amount
+            yield [period, artist_name, album_name, release_id, uploaded_at.strftime('%Y-%m-%d') if uploaded_at else None, amount]
+        
+        if current_period is not None:
+            yield [f'Итого за {current_period}', None, None, None, None, period_total]
+        yield ['Итого', None, None, None, None, grand_total]
+
+def write_statement(rows, export_format: str, path: str):
+    """Пишет выписку в файл построчно: csv.writer или openpyxl в режиме write_only"""
+    if export_format == 'csv':
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(EXPORT_HEADER)
+            for row in rows:
+                writer.writerow(['' if value is None else value for value in row])
+        return
+    
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Выписка')
+    sheet.append(EXPORT_HEADER)
+    for row in rows:
+        row[5] = float(row[5])
+        sheet.append(row)
+    workbook.save(path)
+
+_s3_client = None
+
+def get_s3_client():
+    """S3-клиент для выгрузок: собирается при первой выгрузке и живёт вместе с экземпляром функции"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url='https://storage.yandexcloud.net',
+            aws_access_key_id=os.environ.get('YC_S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('YC_S3_SECRET_ACCESS_KEY'),
+            region_name='ru-central1',
+            config=Config(retries={'max_attempts': 3, 'mode': 'standard'}, connect_timeout=5, read_timeout=60)
+        )
+    return _s3_client
+
+def upload_export(path: str, file_name: str) -> str:
+    """Кладёт большую выписку в бакет и возвращает временную ссылку на скачивание"""
+    s3_client = get_s3_client()
+    bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
+    s3_key = f"exports/{datetime.now().strftime('%Y/%m/%d')}/{uuid.uuid4()}/{file_name}"
+    
+    s3_client.upload_file(path, bucket_name, s3_key)
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': bucket_name,
+            'Key': s3_key,
+            'ResponseContentDisposition': f'attachment; filename="{file_name}"'
+        },
+        ExpiresIn=EXPORT_LINK_TTL
+    )
+
+def export_statement(conn, user_id: str, filters: dict, export_format: str, delivery: Optional[str]) -> Dict[str, Any]:
+    """
+    Выписка артиста в CSV или XLSX.
+    Файл собирается во временном файле; небольшой отдаётся в ответе,
+    большой (или при delivery=link) загружается в бакет и возвращается ссылкой
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise InvalidQuery('export must be "csv" or "xlsx"')
+    if delivery not in (None, '', 'inline', 'link'):
+        raise InvalidQuery('delivery must be "inline" or "link"')
+    
+    file_name = f"statement_{user_id}_{datetime.now().strftime('%Y%m%d')}.{export_format}"
+    fd, path = tempfile.mkstemp(suffix=f'.{export_format}', dir='/tmp')
+    os.close(fd)
+    
+    try:
+        write_statement(statement_rows(conn, user_id, filters), export_format, path)
+        size = os.path.getsize(path)
+        print(f"[EXPORT] user {user_id}: {file_name}, {size} bytes")
+        
+        if delivery == 'link' or size > INLINE_EXPORT_LIMIT:
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({
+                    'url': upload_export(path, file_name),
+                    'file_name': file_name,
+                    'size': size,
+                    'expires_in': EXPORT_LINK_TTL
+                })
+            }
+        
+        with open(path, 'rb') as f:
+            content = f.read()
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                'Access-Control-Allow-Origin': '*',
+                'Content-Disposition': f'attachment; filename="{file_name}"'
+            },
+            'body': base64.b64encode(content).decode('ascii'),
+            'isBase64Encoded': True
+        }
+    finally:
+        os.remove(path)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Business: Получение финансовых отчётов артиста с детальной статистикой
-    Args: event с httpMethod, headers (X-User-Id)
-    Returns: HTTP response со списком отчётов и статистикой
+    Args: event с httpMethod, headers (X-User-Id), queryStringParameters (limit, cursor, period, release_id, min_amount, max_amount, group_by=release, export=csv|xlsx, delivery=inline|link)
+    Returns: HTTP response со списком отчётов и статистикой или файл выписки (ссылка на бакет для больших выписок)
     """
     method = event.get('httpMethod', 'GET')
     
@@ -39,66 +379,77 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             conn = psycopg2.connect(dsn)
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT 
-                    id,
-                    period,
-                    artist_name,
-                    album_name,
-                    amount,
-                    release_id,
-                    uploaded_at,
-                    status
-                FROM financial_reports
-                WHERE user_id = %s 
-                  AND status = 'matched'
-                  AND id > 2
-                ORDER BY uploaded_at DESC, period DESC
-            """, (user_id,))
-            
-            reports = []
-            for row in cursor.fetchall():
-                reports.append({
-                    'id': row[0],
-                    'period': row[1],
-                    'artist_name': row[2],
-                    'album_name': row[3],
-                    'amount': float(row[4]),
-                    'release_id': row[5],
-                    'uploaded_at': row[6].isoformat() if row[6] else None,
-                    'status': row[7]
-                })
-            
-            cursor.execute("""
-                SELECT 
-                    COALESCE(SUM(amount), 0) as total,
-                    COUNT(*) as count
-                FROM financial_reports
-                WHERE user_id = %s 
-                  AND status = 'matched'
-                  AND id > 2
-            """, (user_id,))
+            params = event.get('queryStringParameters') or {}
             
-            stats_row = cursor.fetchone()
-            total_earned = float(stats_row[0]) if stats_row else 0.0
-            reports_count = stats_row[1] if stats_row else 0
+            if params.get('export'):
+                try:
+                    return export_statement(conn, user_id, parse_filters(params), params['export'], params.get('delivery'))
+                except InvalidQuery as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)})
+                    }
+                finally:
+                    cursor.close()
+                    conn.close()
             
-            cursor.execute("""
-                SELECT period, SUM(amount) as period_total
-                FROM financial_reports
-                WHERE user_id = %s 
-                  AND status = 'matched'
-                  AND id > 2
-                GROUP BY period
-                ORDER BY period DESC
-            """, (user_id,))
+            try:
+                limit = parse_limit(params.get('limit'))
+                filters = parse_filters(params)
+                group_by = params.get('group_by')
+                if group_by not in (None, '', 'release'):
+                    raise InvalidQuery('group_by must be "release"')
+                
+                if group_by == 'release':
+                    items_key = 'releases'
+                    items, next_cursor = fetch_release_page(cursor, user_id, filters, limit, params.get('cursor'))
+                else:
+                    items_key = 'reports'
+                    items, next_cursor = fetch_report_page(cursor, user_id, filters, limit, params.get('cursor'))
+            except InvalidQuery as e:
+                cursor.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': str(e)})
+                }
             
-            by_period = []
-            for row in cursor.fetchall():
-                by_period.append({
-                    'period': row[0],
-                    'total': float(row[1])
-                })
+            stats = None
+            if not params.get('cursor'):
+                cursor.execute("""
+                    SELECT 
+                        COALESCE(SUM(total_amount), 0) as total,
+                        COALESCE(SUM(rows_count), 0) as count
+                    FROM artist_earnings_rollup
+                    WHERE user_id = %s
+                """, (user_id,))
+                
+                stats_row = cursor.fetchone()
+                total_earned = float(stats_row[0]) if stats_row else 0.0
+                reports_count = int(stats_row[1]) if stats_row else 0
+                
+                cursor.execute("""
+                    SELECT period, SUM(total_amount) as period_total
+                    FROM artist_earnings_rollup
+                    WHERE user_id = %s
+                    GROUP BY period
+                    ORDER BY period DESC
+                """, (user_id,))
+                
+                by_period = []
+                for row in cursor.fetchall():
+                    by_period.append({
+                        'period': row[0],
+                        'total': float(row[1])
+                    })
+                
+                stats = {
+                    'total_earned': total_earned,
+                    'reports_count': reports_count,
+                    'by_period': by_period
+                }
             
             cursor.close()
             conn.close()
@@ -107,12 +458,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({
-                    'reports': reports,
-                    'stats': {
-                        'total_earned': total_earned,
-                        'reports_count': reports_count,
-                        'by_period': by_period
-                    }
+                    items_key: items,
+                    'next_cursor': next_cursor,
+                    'stats': stats
                 })
             }
             
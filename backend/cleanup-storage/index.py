@@ -2,9 +2,31 @@ import json
 import os
 from typing import Dict, Any
 import boto3
+from botocore.config import Config
 from collections import defaultdict
 from datetime import datetime, timedelta
 
+_s3_client = None
+
+def get_s3_client():
+    """Клиент S3 собирается лениво и живёт, пока жив экземпляр функции"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url='https://storage.yandexcloud.net',
+            aws_access_key_id=os.environ.get('YC_S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('YC_S3_SECRET_ACCESS_KEY'),
+            region_name='ru-central1',
+            config=Config(
+                max_pool_connections=10,
+                retries={'max_attempts': 3, 'mode': 'standard'},
+                connect_timeout=5,
+                read_timeout=60
+            )
+        )
+    return _s3_client
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Aggressive cleanup - remove old files, duplicates, and specific patterns
@@ -42,17 +64,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         print(f"Cleanup mode: {mode}, keeping files newer than {cutoff_date.isoformat()}")
         
-        access_key = os.environ.get('YC_S3_ACCESS_KEY_ID')
-        secret_key = os.environ.get('YC_S3_SECRET_ACCESS_KEY')
         bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
-        
-        s3_client = boto3.client(
-            's3',
-            endpoint_url='https://storage.yandexcloud.net',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name='ru-central1'
-        )
+        s3_client = get_s3_client()
         
         paginator = s3_client.get_paginator('list_objects_v2')
         pages = paginator.paginate(Bucket=bucket_name, Prefix='uploads/')
@@ -1,10 +1,26 @@
 import json
 import os
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List
 import openpyxl
-from io import BytesIO
+from io import BytesIO, StringIO
+import csv
+import re
+from collections import Counter
+from itertools import chain
+from decimal import Decimal, ROUND_HALF_UP
 import urllib.request
+import time
+import sys
+import uuid
+import base64
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import zlib
+from array import array
+import boto3
 
 def normalize_string(s: str) -> str:
     if not s:
@@ -15,6 +31,17 @@ def normalize_string(s: str) -> str:
     s = ' '.join(s.split())
     return s
 
+def normalize_column(values: List[str]) -> List[str]:
+    """Пакетная normalize_string: в отчётах значения сильно повторяются, поэтому каждое уникальное нормализуется один раз"""
+    normalized = {value: normalize_string(value) for value in set(values)}
+    return [normalized[value] for value in values]
+
+def release_match_key(normalized_artist: str, normalized_album: str):
+    """Ключ точного сопоставления 'артист||альбом'; None, если одной из частей нет"""
+    if normalized_artist and normalized_album:
+        return f"{normalized_artist}||{normalized_album}"
+    return None
+
 def load_all_releases(cursor) -> Dict[str, tuple]:
     cursor.execute("""
         SELECT r.id, r.artist_id, r.artist_name, r.release_name
@@ -28,115 +55,553 @@ def load_all_releases(cursor) -> Dict[str, tuple]:
         normalized_artist = normalize_string(artist_name or "")
         normalized_album = normalize_string(release_name or "")
         
-        if normalized_artist and normalized_album:
-            key = f"{normalized_artist}||{normalized_album}"
+        key = release_match_key(normalized_artist, normalized_album)
+        if key:
             releases_map[key] = (artist_id, release_id, artist_name)
     
     return releases_map
 
-def match_report_to_releases(artist_name: str, album_name: str, releases_map: Dict[str, tuple]) -> tuple:
-    normalized_artist = normalize_string(artist_name)
-    normalized_album = normalize_string(album_name)
-    
-    if not normalized_artist or not normalized_album:
-        return (None, None)
-    
-    key = f"{normalized_artist}||{normalized_album}"
-    
-    if key in releases_map:
-        user_id, release_id, _ = releases_map[key]
-        return (user_id, release_id)
-    
-    return (None, None)
+EXACT_MATCH_CONFIDENCE = 1.0
+TOKEN_MATCH_CONFIDENCE = 0.95
+FUZZY_MIN_CONFIDENCE = 0.85
+FUZZY_MAX_CANDIDATES = 5
+MATCH_CACHE_LIMIT = 200000
 
-def process_chunk(chunk_id: int, job_id: int, start_row: int, end_row: int, 
-                  file_data: bytes, period: str, admin_user_id: int, 
-                  releases_map: Dict[str, tuple], cursor, conn) -> dict:
-    """Обрабатывает один чанк файла"""
-    print(f"[CHUNK {chunk_id}] Processing rows {start_row}-{end_row}")
-    
-    workbook = openpyxl.load_workbook(BytesIO(file_data), read_only=True, data_only=True)
-    sheet = workbook.active
+TRANSLIT_TABLE = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya'
+})
+ARTIST_SEPARATORS = re.compile(r'\s*(?:,|&|/|;|\+|\bfeat\b\.?|\bft\b\.?|\bfeaturing\b|\bwith\b|\bx\b|\bи\b)\s*')
+ALBUM_FEAT = re.compile(r'[\(\[]?\s*\b(?:feat|ft|featuring)\b\.?.*$')
+WORD = re.compile(r'\w+')
+
+def tokenize(s: str) -> str:
+    """Транслитерирует кириллицу и оставляет только слова: «Имбро (Live)» -> «imbro live»"""
+    return ' '.join(WORD.findall(s.lower().translate(TRANSLIT_TABLE)))
+
+def artist_tokens(artist_name: str) -> List[str]:
+    """Разбивает строку исполнителей (feat., &, запятые) на отдельных артистов"""
+    parts = [tokenize(part) for part in ARTIST_SEPARATORS.split(artist_name.lower())]
+    return [part for part in parts if part]
+
+def album_tokens(album_name: str) -> str:
+    return tokenize(ALBUM_FEAT.sub('', album_name.lower()))
+
+def trigrams(s: str) -> set:
+    padded = f"  {s} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна с ранним выходом: если больше limit, возвращает limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
     
-    matched_count = 0
-    batch_reports = []
-    batch_updates = {}
-    processed_rows = 0
-    current_row = 0
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            row_min = min(row_min, current[j])
+        if row_min > limit:
+            return limit + 1
+        previous = current
     
-    for row in sheet.iter_rows(min_row=2, values_only=True):
-        current_row += 1
-        
-        if current_row < start_row:
-            continue
-        if current_row > end_row:
-            break
+    return previous[-1]
+
+class ReleaseMatcher:
+    """
+    Многоуровневое сопоставление строк отчёта с релизами:
+    1) точный ключ normalize_string(artist)||normalize_string(album), уверенность 1.0;
+    2) полный набор артистов токенами с транслитерацией и разбором feat./&, уверенность TOKEN_MATCH_CONFIDENCE;
+    3) ограниченное расстояние Левенштейна среди кандидатов из триграммного индекса.
+    Начисляется только уровень 1; уровни 2 и 3 — лишь подсказка для проверки администратором.
+    Результаты кешируются по паре (артист, альбом) — в отчётах пары сильно повторяются.
+    """
+
+    def __init__(self, releases_map: Dict[str, tuple]):
+        self.releases_map = releases_map
+        self.token_index = {}
+        self.fuzzy_keys = []
+        self.trigram_index = {}
+        self.cache = {}
         
-        if not row or len(row) < 14:
-            continue
+        for key, (user_id, release_id, artist_name) in releases_map.items():
+            normalized_artist, normalized_album = key.split('||', 1)
+            artists = artist_tokens(normalized_artist)
+            album = album_tokens(normalized_album)
+            if not artists or not album:
+                continue
+            
+            token_key = f"{' '.join(sorted(artists))}||{album}"
+            existing = self.token_index.get(token_key)
+            if existing is None:
+                self.token_index[token_key] = (user_id, release_id)
+            elif existing != (user_id, release_id):
+                self.token_index[token_key] = None
+            
+            fuzzy_key = f"{' '.join(sorted(artists))} {album}"
+            position = len(self.fuzzy_keys)
+            self.fuzzy_keys.append((fuzzy_key, user_id, release_id))
+            for gram in trigrams(fuzzy_key):
+                self.trigram_index.setdefault(gram, []).append(position)
+
+    def match(self, artist_name: str, album_name: str) -> tuple:
+        """Возвращает (user_id, release_id, confidence) или (None, None, None)"""
+        return self.match_column([artist_name], [album_name])[0]
+
+    def match_column(self, artists: List[str], albums: List[str]) -> List[tuple]:
+        """
+        Сопоставляет целые колонки: нормализует только ещё не встречавшиеся пары,
+        одним пакетом, и раздаёт результаты из кеша
+        """
+        pairs = list(zip(artists, albums))
+        missing = [pair for pair in set(pairs) if pair not in self.cache]
         
-        artist_name = str(row[6]) if row[6] else ""
-        album_name = str(row[8]) if row[8] else ""
-        amount_str = str(row[13]) if row[13] else "0"
+        if missing:
+            if len(self.cache) + len(missing) > MATCH_CACHE_LIMIT:
+                self.cache.clear()
+                missing = list(set(pairs))
+            
+            normalized_artists = normalize_column([artist for artist, _ in missing])
+            normalized_albums = normalize_column([album for _, album in missing])
+            for pair, normalized_artist, normalized_album in zip(missing, normalized_artists, normalized_albums):
+                self.cache[pair] = self._match(pair[0], pair[1], normalized_artist, normalized_album)
         
-        if not artist_name:
-            continue
+        cache = self.cache
+        return [cache[pair] for pair in pairs]
+
+    def _match(self, artist_name: str, album_name: str, normalized_artist: str, normalized_album: str) -> tuple:
+        if normalized_artist and normalized_album:
+            found = self.releases_map.get(f"{normalized_artist}||{normalized_album}")
+            if found:
+                return (found[0], found[1], EXACT_MATCH_CONFIDENCE)
         
-        try:
-            amount = float(amount_str.replace(',', '.').replace(' ', ''))
-        except (ValueError, AttributeError):
-            amount = 0.0
+        artists = artist_tokens(artist_name)
+        album = album_tokens(album_name)
+        if not artists or not album:
+            return (None, None, None)
         
-        user_id, release_id = match_report_to_releases(artist_name, album_name, releases_map)
+        found = self.token_index.get(f"{' '.join(sorted(artists))}||{album}")
+        if found:
+            return (found[0], found[1], TOKEN_MATCH_CONFIDENCE)
         
-        processed_rows += 1
+        return self._fuzzy_match(f"{' '.join(sorted(artists))} {album}")
+
+    def _fuzzy_match(self, query: str) -> tuple:
+        postings = sorted((self.trigram_index[gram] for gram in trigrams(query) if gram in self.trigram_index), key=len)
+        common_limit = max(100, len(self.fuzzy_keys) // 20)
+        selective = [posting for posting in postings if len(posting) <= common_limit]
+        if len(selective) < 3:
+            selective = postings
         
-        if user_id:
-            matched_count += 1
-            batch_reports.append((period, artist_name, album_name, amount, user_id, release_id, admin_user_id, True))
-            
-            if user_id not in batch_updates:
-                batch_updates[user_id] = 0
-            batch_updates[user_id] += amount
-        else:
-            batch_reports.append((period, artist_name, album_name, amount, None, None, admin_user_id, False))
-    
-    if batch_reports:
-        matched_batch = [r[:7] for r in batch_reports if r[7]]
-        unmatched_batch = [(r[0], r[1], r[2], r[3], r[6]) for r in batch_reports if not r[7]]
+        shared = Counter(chain.from_iterable(selective))
+        candidates = [position for position, _ in shared.most_common(FUZZY_MAX_CANDIDATES)]
+        limit = int(len(query) * (1 - FUZZY_MIN_CONFIDENCE))
         
-        if matched_batch:
-            values_str = ','.join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,'matched')", row).decode('utf-8')
-                for row in matched_batch
-            )
-            cursor.execute(f"""
-                INSERT INTO financial_reports 
-                (period, artist_name, album_name, amount, user_id, release_id, uploaded_by, status)
-                VALUES {values_str}
-            """)
+        best = None
+        runner_up = None
+        for position in candidates:
+            fuzzy_key, user_id, release_id = self.fuzzy_keys[position]
+            distance = bounded_levenshtein(query, fuzzy_key, limit)
+            if distance > limit:
+                continue
+            confidence = 1 - distance / max(len(query), len(fuzzy_key))
+            if best is None or confidence > best[2]:
+                runner_up = best
+                best = (user_id, release_id, confidence)
+            elif runner_up is None or confidence > runner_up[2]:
+                runner_up = (user_id, release_id, confidence)
         
-        if unmatched_batch:
-            values_str = ','.join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,'pending')", row).decode('utf-8')
-                for row in unmatched_batch
-            )
-            cursor.execute(f"""
-                INSERT INTO financial_reports 
-                (period, artist_name, album_name, amount, uploaded_by, status)
-                VALUES {values_str}
-            """)
+        if best is None or best[2] < FUZZY_MIN_CONFIDENCE:
+            return (None, None, None)
+        if runner_up and runner_up[2] == best[2] and runner_up[:2] != best[:2]:
+            return (None, None, None)
         
+        return (best[0], best[1], round(best[2], 3))
+
+_release_matcher_cache = {'version': None, 'matcher': None}
+
+def get_release_matcher(cursor, conn) -> ReleaseMatcher:
+    """
+    Возвращает сопоставитель релизов, не перечитывая releases без необходимости.
+    Версия индекса увеличивается триггером при любом изменении releases:
+    - версия совпадает с закешированной в тёплом воркере — используем кеш;
+    - сохранённый в БД снимок нормализованных ключей актуален — читаем его;
+    - иначе строим ключи из releases и сохраняем снимок для следующих воркеров.
+    """
+    cursor.execute("SELECT version, data_version FROM release_match_index WHERE id = 1")
+    version, data_version = cursor.fetchone()
+    
+    if _release_matcher_cache['version'] == version:
+        print(f"[INDEX] Using warm release index v{version}")
+        return _release_matcher_cache['matcher']
+    
+    if data_version == version:
+        cursor.execute("SELECT data FROM release_match_index WHERE id = 1")
+        snapshot = json.loads(zlib.decompress(bytes(cursor.fetchone()[0])))
+        releases_map = {key: tuple(value) for key, value in snapshot.items()}
+        print(f"[INDEX] Loaded release index snapshot v{version}")
+    else:
+        releases_map = load_all_releases(cursor)
+        snapshot = zlib.compress(json.dumps(releases_map, ensure_ascii=False).encode('utf-8'))
+        cursor.execute("""
+            UPDATE release_match_index
+            SET data = %s, data_version = %s, built_at = NOW()
+            WHERE id = 1 AND (data_version IS NULL OR data_version < %s)
+        """, (psycopg2.Binary(snapshot), version, version))
         conn.commit()
+        print(f"[INDEX] Rebuilt release index snapshot v{version}")
+    
+    matcher = ReleaseMatcher(releases_map)
+    _release_matcher_cache['version'] = version
+    _release_matcher_cache['matcher'] = matcher
+    return matcher
+
+CHUNKS_PER_INVOCATION = 10
+TIME_BUDGET_SECONDS = 20
+LEASE_SECONDS = 120
+CENT = Decimal('0.01')
+SEGMENT_MAGIC = b'FRC1'
+
+def parse_amount(value) -> float:
+    """Приводит значение суммы из Excel к float"""
+    amount_str = str(value) if value else "0"
+    try:
+        return float(amount_str.replace(',', '.').replace(' ', ''))
+    except (ValueError, AttributeError):
+        return 0.0
+
+def parse_amount_column(values: list) -> array:
+    """
+    Пакетно приводит колонку сумм к float64.
+    Обычно Excel отдаёт числа, и вся колонка конвертируется одним вызовом;
+    если встретились строки с запятыми или пустые ячейки — разбираем по одной через parse_amount
+    """
+    try:
+        return array('d', map(float, values))
+    except (TypeError, ValueError):
+        return array('d', map(parse_amount, values))
+
+def decode_segment(segment: bytes):
+    """
+    Читает колоночный сегмент чанка, подготовленный при загрузке.
+    Возвращает колонки (artists, albums, amounts)
+    """
+    data = memoryview(zlib.decompress(segment))
+    magic, row_count = struct.unpack_from('<4sI', data, 0)
+    if magic != SEGMENT_MAGIC:
+        raise ValueError('Unknown chunk segment format')
+    
+    pos = 8
+    amounts = array('d')
+    amounts.frombytes(data[pos:pos + 8 * row_count])
+    pos += 8 * row_count
+    
+    columns = []
+    for _ in range(2):
+        offsets = array('I')
+        offsets.frombytes(data[pos:pos + 4 * (row_count + 1)])
+        pos += 4 * (row_count + 1)
+        blob = data[pos:pos + offsets[-1]]
+        pos += offsets[-1]
+        columns.append([str(blob[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(row_count)])
+    
+    return columns[0], columns[1], amounts
+
+def sheet_rows_to_columns(rows) -> tuple:
+    """Раскладывает сырые строки Excel (старые задачи без сегментов) в колонки (artists, albums, amounts)"""
+    artists, albums, raw_amounts = [], [], []
+    for _, row in rows:
+        if not row or len(row) < 14 or not row[6]:
+            continue
+        artists.append(str(row[6]))
+        albums.append(str(row[8]) if row[8] else "")
+        raw_amounts.append(row[13])
+    return artists, albums, parse_amount_column(raw_amounts)
+
+
+REPORT_CACHE_DIR = '/tmp/financial-reports'
+
+_s3_client = None
+
+def get_s3_client():
+    """S3-клиент создаётся один раз на экземпляр функции"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url='https://storage.yandexcloud.net',
+            aws_access_key_id=os.environ.get('YC_S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('YC_S3_SECRET_ACCESS_KEY'),
+            region_name='ru-central1'
+        )
+    return _s3_client
+
+def fetch_report_file(file_key: str) -> str:
+    """
+    Скачивает файл отчёта из бакета в /tmp и возвращает путь.
+    Тёплый экземпляр функции переиспользует уже скачанную копию
+    """
+    path = os.path.join(REPORT_CACHE_DIR, file_key.replace('/', '_'))
+    if os.path.exists(path):
+        return path
+    
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    partial_path = f"{path}.{uuid.uuid4().hex}.part"
+    started = time.monotonic()
+    get_s3_client().download_file(os.environ.get('YC_S3_BUCKET_NAME'), file_key, partial_path)
+    os.replace(partial_path, path)
+    print(f"[STORAGE] Downloaded {file_key} ({os.path.getsize(path)} bytes) in {time.monotonic() - started:.2f}s")
+    return path
+
+# Как в upload-financial-report: превью читает файлы только из этих папок бакета
+ALLOWED_FILE_KEY_PREFIXES = ('financial-reports/', 'uploads/')
+
+def is_allowed_file_key(file_key) -> bool:
+    return (
+        isinstance(file_key, str)
+        and file_key.startswith(ALLOWED_FILE_KEY_PREFIXES)
+        and '..' not in file_key.split('/')
+        and '//' not in file_key
+    )
+
+def download_private_file(file_key: str) -> str:
+    """
+    Скачивает файл во временный файл, видимый только этому запросу (mkstemp), и возвращает путь.
+    Общий кэш REPORT_CACHE_DIR не используется: его копии читают задачи, и удалять их из превью нельзя
+    """
+    fd, path = tempfile.mkstemp(prefix='preview-', suffix='.xlsx')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            get_s3_client().download_fileobj(os.environ.get('YC_S3_BUCKET_NAME'), file_key, f)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def load_job_file(job_id: int, file_key, cursor):
+    """Источник файла задачи: путь к локальной копии из бакета или байты старых задач из file_data"""
+    if file_key:
+        return fetch_report_file(file_key)
+    
+    cursor.execute("SELECT file_data FROM financial_upload_jobs WHERE id = %s", (job_id,))
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        raise ValueError('Файл задачи не найден')
+    return bytes(row[0])
+
+def delete_report_file(file_key: str, from_bucket: bool = True):
+    """Удаляет файл отчёта из локального кэша и, если from_bucket, из бакета, когда все чанки уже нарезаны"""
+    if from_bucket:
+        try:
+            get_s3_client().delete_object(Bucket=os.environ.get('YC_S3_BUCKET_NAME'), Key=file_key)
+        except Exception as e:
+            print(f"[STORAGE] Failed to delete {file_key}: {str(e)}")
+    
+    path = os.path.join(REPORT_CACHE_DIR, file_key.replace('/', '_'))
+    if os.path.exists(path):
+        os.remove(path)
+
+def open_workbook(source):
+    """Открывает лист в потоковом режиме: source — путь к файлу или байты"""
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    return openpyxl.load_workbook(source, read_only=True, data_only=True)
+
+class ReportRowStream:
+    """
+    Однопроходный поток строк отчёта.
+    Файл открывается один раз, строки выдаются по порядку для идущих подряд чанков.
+    Нумерация строк совпадает с job_chunks: строка 1 — первая строка после заголовка.
+    """
+
+    def __init__(self, source, cursor_row: int = 0):
+        self.source = source
+        self._open(cursor_row)
+
+    def _open(self, cursor_row: int):
+        workbook = open_workbook(self.source)
+        self.rows = workbook.active.iter_rows(min_row=cursor_row + 2, values_only=True)
+        self.position = cursor_row
+
+    def take(self, start_row: int, end_row: int):
+        """Отдаёт строки чанка [start_row, end_row], не перечитывая уже пройденные"""
+        if start_row <= self.position:
+            print(f"[STREAM] Rewinding from row {self.position} to {start_row - 1}")
+            self._open(start_row - 1)
+        
+        if self.position >= end_row:
+            return
+        
+        for row in self.rows:
+            self.position += 1
+            if self.position >= start_row:
+                yield self.position, row
+            if self.position >= end_row:
+                return
+
+FINANCIAL_REPORT_COLUMNS = ['period', 'artist_name', 'album_name', 'amount', 'user_id', 'release_id', 'uploaded_by', 'status', 'match_confidence', 'match_key']
+
+class CopyRowReader:
+    """
+    Файлоподобный источник для COPY FROM STDIN.
+    Строки сериализуются в CSV по мере чтения, весь пакет не собирается в памяти.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='\n')
+        self.exhausted = False
+        self.row_count = 0
+
+    def read(self, size: int = -1) -> str:
+        while not self.exhausted and (size < 0 or self.buffer.tell() < size):
+            row = next(self.rows, None)
+            if row is None:
+                self.exhausted = True
+            else:
+                self.writer.writerow(row)
+                self.row_count += 1
+        
+        data = self.buffer.getvalue()
+        chunk, rest = (data, '') if size < 0 else (data[:size], data[size:])
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffer.write(rest)
+        return chunk
+
+def copy_rows(cursor, table: str, columns: List[str], rows, not_null: tuple = ()) -> int:
+    """
+    Потоково записывает строки в таблицу через COPY FROM STDIN (CSV).
+    Пустые значения пишутся как NULL, кроме колонок из not_null (там это пустая строка).
+    Возвращает количество записанных строк
+    """
+    options = 'FORMAT csv'
+    if not_null:
+        options += f", FORCE_NOT_NULL ({', '.join(not_null)})"
+    
+    reader = CopyRowReader(rows)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH ({options})", reader)
+    return reader.row_count
+
+PROGRESS_CHANNEL = 'financial_job_progress'
+
+def record_progress(job_id: int, cursor, chunks: int = 0, rows: int = 0, matched: int = 0):
+    """
+    Обновляет строку прогресса задачи в текущей транзакции: статус и объёмы берутся из задачи,
+    счётчики чанков увеличиваются на переданные значения, version — следующее значение последовательности.
+    NOTIFY уходит подписчикам при коммите
+    """
+    cursor.execute("""
+        INSERT INTO financial_job_progress
+            (job_id, uploaded_by, status, total_rows, total_chunks, completed_chunks, processed_rows, matched_count, version)
+        SELECT j.id, j.uploaded_by, j.status, COALESCE(j.total_rows, 0), COALESCE(j.total_chunks, 0),
+               %s, %s, %s, nextval('financial_job_progress_version_seq')
+        FROM financial_upload_jobs j
+        WHERE j.id = %s
+        ON CONFLICT (job_id) DO UPDATE SET
+            status = EXCLUDED.status,
+            total_rows = EXCLUDED.total_rows,
+            total_chunks = EXCLUDED.total_chunks,
+            completed_chunks = financial_job_progress.completed_chunks + EXCLUDED.completed_chunks,
+            processed_rows = financial_job_progress.processed_rows + EXCLUDED.processed_rows,
+            matched_count = financial_job_progress.matched_count + EXCLUDED.matched_count,
+            version = EXCLUDED.version,
+            updated_at = NOW()
+    """, (chunks, rows, matched, job_id))
+    cursor.execute("SELECT pg_notify(%s, %s)", (PROGRESS_CHANNEL, str(job_id)))
+
+def process_chunk(chunk_id: int, job_id: int, start_row: int, end_row: int, 
+                  columns: tuple, period: str, admin_user_id: int, 
+                  matcher: ReleaseMatcher, worker_id: str, cursor, conn) -> dict:
+    """Обрабатывает один чанк: columns — колонки (artists, albums, amounts)"""
+    print(f"[CHUNK {chunk_id}] Processing rows {start_row}-{end_row}")
+    
+    matched_count = 0
+    batch_updates = {}
+    rollup_updates = {}
+    
+    artists, albums, amounts = columns
+    matches = matcher.match_column(artists, albums)
+    
+    def report_rows():
+        nonlocal matched_count
+        normalized_artists = normalized_albums = None
+        for index, (artist_name, album_name, amount, (user_id, release_id, confidence)) in enumerate(zip(artists, albums, amounts, matches)):
+            if user_id and confidence == EXACT_MATCH_CONFIDENCE:
+                matched_count += 1
+                cents = Decimal(repr(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+                batch_updates[user_id] = batch_updates.get(user_id, Decimal(0)) + cents
+                rollup = rollup_updates.setdefault((user_id, release_id or 0), [Decimal(0), 0])
+                rollup[0] += cents
+                rollup[1] += 1
+                yield (period, artist_name, album_name, amount, user_id, release_id, admin_user_id, 'matched', confidence, None)
+            else:
+                if normalized_artists is None:
+                    normalized_artists = normalize_column(artists)
+                    normalized_albums = normalize_column(albums)
+                match_key = release_match_key(normalized_artists[index], normalized_albums[index]) or ''
+                if user_id:
+                    # Неточное совпадение не начисляется: сохраняем подсказку до подтверждения администратором
+                    yield (period, artist_name, album_name, amount, user_id, release_id, admin_user_id, 'needs_review',
+                           confidence, match_key)
+                else:
+                    yield (period, artist_name, album_name, amount, None, None, admin_user_id, 'pending', None, match_key)
+    
+    processed_rows = copy_rows(
+        cursor, 'financial_reports', FINANCIAL_REPORT_COLUMNS, report_rows(),
+        not_null=('artist_name', 'album_name')
+    )
     
     cursor.execute("""
         UPDATE job_chunks
         SET status = 'completed',
             matched_count = %s,
             processed_rows = %s,
-            completed_at = NOW()
-        WHERE id = %s
-    """, (matched_count, processed_rows, chunk_id))
+            completed_at = NOW(),
+            lease_expires_at = NULL
+        WHERE id = %s AND claimed_by = %s AND status = 'processing'
+    """, (matched_count, processed_rows, chunk_id, worker_id))
+    
+    if cursor.rowcount == 0:
+        raise ChunkLeaseLost(f"Chunk {chunk_id} was reclaimed by another worker")
+    
+    if batch_updates:
+        cursor.execute("""
+            INSERT INTO financial_balance_ledger (job_id, user_id, amount)
+            SELECT %s, u.user_id, u.amount
+            FROM unnest(%s::int[], %s::numeric[]) AS u(user_id, amount)
+            ON CONFLICT (job_id, user_id)
+            DO UPDATE SET amount = financial_balance_ledger.amount + EXCLUDED.amount
+        """, (job_id, list(batch_updates.keys()), list(batch_updates.values())))
+    
+    if rollup_updates:
+        cursor.execute("""
+            INSERT INTO financial_rollup_ledger (job_id, user_id, release_id, amount, rows_count)
+            SELECT %s, u.user_id, u.release_id, u.amount, u.rows_count
+            FROM unnest(%s::int[], %s::int[], %s::numeric[], %s::int[]) AS u(user_id, release_id, amount, rows_count)
+            ON CONFLICT (job_id, user_id, release_id)
+            DO UPDATE SET amount = financial_rollup_ledger.amount + EXCLUDED.amount,
+                          rows_count = financial_rollup_ledger.rows_count + EXCLUDED.rows_count
+        """, (
+            job_id,
+            [user_id for user_id, _ in rollup_updates],
+            [release_id for _, release_id in rollup_updates],
+            [total for total, _ in rollup_updates.values()],
+            [count for _, count in rollup_updates.values()]
+        ))
+    
+    cursor.execute("""
+        UPDATE financial_upload_jobs
+        SET stream_cursor = GREATEST(stream_cursor, %s)
+        WHERE id = %s AND planned_by IS NULL
+    """, (end_row, job_id))
+    record_progress(job_id, cursor, chunks=1, rows=processed_rows, matched=matched_count)
     conn.commit()
     
     print(f"[CHUNK {chunk_id}] Completed: {processed_rows} rows, {matched_count} matched")
@@ -148,6 +613,488 @@ def process_chunk(chunk_id: int, job_id: int, start_row: int, end_row: int,
         'balance_updates': batch_updates
     }
 
+class ChunkLeaseLost(Exception):
+    """Аренда чанка истекла и его забрал другой воркер"""
+
+def claim_chunks(worker_id: str, limit: int, cursor, conn) -> List[tuple]:
+    """
+    Атомарно захватывает чанки: свободные или с истёкшей арендой.
+    FOR UPDATE SKIP LOCKED не даёт двум воркерам взять один и тот же чанк
+    """
+    cursor.execute("""
+        UPDATE job_chunks
+        SET status = 'processing',
+            started_at = NOW(),
+            claimed_by = %s,
+            lease_expires_at = NOW() + %s * INTERVAL '1 second'
+        WHERE id IN (
+            SELECT id FROM job_chunks
+            WHERE status = 'pending'
+               OR (status = 'processing'
+                   AND COALESCE(lease_expires_at, started_at + INTERVAL '15 minutes') < NOW())
+            ORDER BY job_id, chunk_number
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, job_id, start_row, end_row, segment
+    """, (worker_id, LEASE_SECONDS, limit))
+    chunks = sorted(cursor.fetchall(), key=lambda chunk: (chunk[1], chunk[2]))
+    conn.commit()
+    return chunks
+
+def extend_lease(worker_id: str, cursor, conn):
+    """Heartbeat: продлевает аренду ещё не обработанных чанков воркера"""
+    cursor.execute("""
+        UPDATE job_chunks
+        SET lease_expires_at = NOW() + %s * INTERVAL '1 second'
+        WHERE claimed_by = %s AND status = 'processing'
+    """, (LEASE_SECONDS, worker_id))
+    conn.commit()
+
+def release_chunks(worker_id: str, chunk_ids: tuple, cursor, conn):
+    """Возвращает необработанные чанки в очередь"""
+    cursor.execute("""
+        UPDATE job_chunks
+        SET status = 'pending', started_at = NULL, claimed_by = NULL, lease_expires_at = NULL
+        WHERE id IN %s AND claimed_by = %s AND status = 'processing'
+    """, (chunk_ids, worker_id))
+    conn.commit()
+
+def trigger_workers(count: int):
+    """Параллельно запускает ещё count воркеров (fire-and-forget)"""
+    function_url = os.environ.get('SELF_URL')
+    if not function_url or count <= 0:
+        return
+    
+    def trigger(_):
+        try:
+            req = urllib.request.Request(
+                function_url,
+                method='GET',
+                headers={'Content-Type': 'application/json'}
+            )
+            urllib.request.urlopen(req, timeout=2)
+        except Exception as e:
+            print(f"[WORKER] Auto-trigger sent (fire-and-forget): {str(e)}")
+    
+    print(f"[WORKER] 🔄 Auto-triggering {count} workers...")
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        list(executor.map(trigger, range(count)))
+
+DEFAULT_COLUMN_LAYOUT = {'artist': 6, 'album': 8, 'amount': 13}
+HEADER_KEYWORDS = {
+    'artist': ('исполнитель', 'артист', 'artist', 'performer'),
+    'album': ('альбом', 'релиз', 'album', 'release'),
+    'amount': ('вознаграждение', 'сумма', 'итого', 'amount', 'royalty', 'revenue'),
+}
+# Слова, при которых заголовок точно не та колонка, даже если в нём есть ключевое слово ("Дата релиза", "Итого прослушиваний")
+HEADER_EXCLUDED_KEYWORDS = {
+    'artist': ('дата', 'date'),
+    'album': ('дата', 'date', 'upc', 'код', 'code'),
+    'amount': ('прослушиван', 'стрим', 'stream', 'количеств', 'quantity', 'кол-во', 'play'),
+}
+
+def encode_segment(artists: List[str], albums: List[str], amounts: array) -> bytes:
+    """
+    Упаковывает строки чанка в колоночный сегмент:
+    заголовок (magic, число строк), суммы float64, затем артисты и альбомы как смещения uint32 + utf-8
+    """
+    parts = [struct.pack('<4sI', SEGMENT_MAGIC, len(amounts)), amounts.tobytes()]
+    
+    for column in (artists, albums):
+        encoded = [value.encode('utf-8') for value in column]
+        offsets = array('I', [0])
+        total = 0
+        for item in encoded:
+            total += len(item)
+            offsets.append(total)
+        parts.append(offsets.tobytes())
+        parts.append(b''.join(encoded))
+    
+    return zlib.compress(b''.join(parts), 6)
+
+def read_header(source) -> tuple:
+    """Читает только первую строку листа"""
+    workbook = open_workbook(source)
+    for row in workbook.active.iter_rows(min_row=1, max_row=1, values_only=True):
+        return row
+    return ()
+
+def validate_column_layout(header: tuple) -> dict:
+    """
+    Проверяет, что заголовок соответствует фиксированной раскладке DEFAULT_COLUMN_LAYOUT (артист, альбом, сумма).
+    Колонки не переназначаются. Заголовок явно чужой колонки (HEADER_EXCLUDED_KEYWORDS) отклоняет файл с понятной ошибкой;
+    заголовок без ключевого слова (пустой, на другом языке) лишь логируется — раскладка остаётся фиксированной
+    """
+    names = [str(cell).strip().lower() if cell is not None else '' for cell in header]
+    
+    required_columns = max(DEFAULT_COLUMN_LAYOUT.values()) + 1
+    if len(names) < required_columns:
+        raise ValueError(f'В файле {len(names)} колонок, ожидается не меньше {required_columns}')
+    
+    mismatched = []
+    for field, index in DEFAULT_COLUMN_LAYOUT.items():
+        name = names[index]
+        if any(word in name for word in HEADER_EXCLUDED_KEYWORDS[field]):
+            mismatched.append(f'колонка {index + 1} ({field}): "{header[index] or ""}"')
+        elif not any(keyword in name for keyword in HEADER_KEYWORDS[field]):
+            print(f'[LAYOUT] ⚠️ Unrecognized header for {field} in column {index + 1}: "{header[index] or ""}", keeping fixed layout')
+    
+    if mismatched:
+        raise ValueError('Заголовок файла не соответствует формату отчёта: ' + '; '.join(mismatched))
+    
+    return dict(DEFAULT_COLUMN_LAYOUT)
+
+def claim_planning_job(worker_id: str, cursor, conn):
+    """Захватывает задачу, для которой ещё не построены чанки (или планировщик которой пропал)"""
+    cursor.execute("""
+        UPDATE financial_upload_jobs
+        SET status = 'processing',
+            started_at = COALESCE(started_at, NOW()),
+            planned_by = %s,
+            plan_lease_expires_at = NOW() + %s * INTERVAL '1 second'
+        WHERE id = (
+            SELECT id FROM financial_upload_jobs
+            WHERE planned_at IS NULL
+              AND status IN ('pending', 'processing')
+              AND (plan_lease_expires_at IS NULL OR plan_lease_expires_at < NOW())
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, file_key, chunk_size, stream_cursor, total_rows, total_chunks, column_layout, period, content_sha256,
+                  file_owned
+    """, (worker_id, LEASE_SECONDS))
+    job = cursor.fetchone()
+    if job is not None:
+        record_progress(job[0], cursor)
+    conn.commit()
+    return job
+
+def file_sha256(source) -> str:
+    """SHA-256 файла, читаемого блоками по 1 МБ: путь к файлу или байты"""
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        view = memoryview(source)
+        for offset in range(0, len(view), 1 << 20):
+            digest.update(view[offset:offset + (1 << 20)])
+    else:
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def row_fingerprint(row: tuple) -> bytes:
+    """Отпечаток строки файла по всем ячейкам, а не только по трём нужным колонкам"""
+    return hashlib.blake2b(
+        '\x1f'.join('' if cell is None else str(cell) for cell in row).encode('utf-8'),
+        digest_size=16
+    ).digest()
+
+def select_new_rows(job_id: int, period: str, fingerprints: List[bytes], cursor) -> List[bool]:
+    """
+    Отмечает строки пачки, которых ещё не было в отчётах за этот период.
+    Одинаковые строки считаются по вхождениям: n-е вхождение новое, если другая задача периода
+    видела такую строку меньше n раз. Счётчики задачи хранятся в БД вместе с чанками,
+    поэтому нумерация не сбивается, когда планирование продолжает другой воркер.
+    Планировщики одного периода сериализуются advisory-блокировкой до конца транзакции
+    """
+    batch_counts = Counter(fingerprints)
+    keys = [psycopg2.Binary(fingerprint) for fingerprint in batch_counts]
+    
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f'financial_rows:{period}',))
+    cursor.execute("""
+        SELECT b.fingerprint,
+               COALESCE(MAX(f.occurrences) FILTER (WHERE f.job_id = %s), 0),
+               COALESCE(MAX(f.occurrences) FILTER (WHERE f.job_id <> %s), 0)
+        FROM unnest(%s::bytea[]) AS b(fingerprint)
+        LEFT JOIN financial_row_fingerprints f ON f.period = %s AND f.fingerprint = b.fingerprint
+        GROUP BY b.fingerprint
+    """, (job_id, job_id, keys, period))
+    seen = {bytes(fingerprint): [own, other] for fingerprint, own, other in cursor.fetchall()}
+    
+    cursor.execute("""
+        INSERT INTO financial_row_fingerprints (period, fingerprint, job_id, occurrences)
+        SELECT %s, b.fingerprint, %s, b.occurrences
+        FROM unnest(%s::bytea[], %s::int[]) AS b(fingerprint, occurrences)
+        ON CONFLICT (period, fingerprint, job_id)
+        DO UPDATE SET occurrences = financial_row_fingerprints.occurrences + EXCLUDED.occurrences
+    """, (period, job_id, keys, list(batch_counts.values())))
+    
+    keep = []
+    for fingerprint in fingerprints:
+        state = seen[fingerprint]
+        state[0] += 1
+        keep.append(state[0] > state[1])
+    return keep
+
+def save_planned_chunk(job_id: int, period: str, worker_id: str, chunk_number: int, start_row: int,
+                       columns: tuple, fingerprints: List[bytes], cursor_row: int, cursor, conn) -> int:
+    """
+    Отбрасывает уже загруженные за период строки, записывает чанк с сегментом
+    и сдвигает позицию чтения файла — одной транзакцией. Возвращает число строк в чанке
+    """
+    artists, albums, raw_amounts = columns
+    keep = select_new_rows(job_id, period, fingerprints, cursor)
+    duplicate_rows = len(keep) - sum(keep)
+    if duplicate_rows:
+        artists = [value for value, new in zip(artists, keep) if new]
+        albums = [value for value, new in zip(albums, keep) if new]
+        raw_amounts = [value for value, new in zip(raw_amounts, keep) if new]
+    
+    amounts = parse_amount_column(raw_amounts)
+    end_row = start_row + len(amounts) - 1
+    
+    if amounts:
+        cursor.execute("""
+            INSERT INTO job_chunks
+            (job_id, chunk_number, start_row, end_row, status, segment)
+            VALUES (%s, %s, %s, %s, 'pending', %s)
+        """, (job_id, chunk_number, start_row, end_row, psycopg2.Binary(encode_segment(artists, albums, amounts))))
+        chunk_number += 1
+    
+    cursor.execute("""
+        UPDATE financial_upload_jobs
+        SET stream_cursor = %s,
+            total_rows = %s,
+            total_chunks = %s,
+            duplicate_rows = duplicate_rows + %s,
+            plan_lease_expires_at = NOW() + %s * INTERVAL '1 second'
+        WHERE id = %s AND planned_by = %s
+    """, (cursor_row, end_row, chunk_number, duplicate_rows, LEASE_SECONDS, job_id, worker_id))
+    
+    if cursor.rowcount == 0:
+        raise ChunkLeaseLost(f"Planning of job {job_id} was taken over by another worker")
+    record_progress(job_id, cursor)
+    conn.commit()
+    
+    if duplicate_rows:
+        print(f"[PLAN {job_id}] Skipped {duplicate_rows} rows already uploaded for {period}")
+    return len(amounts)
+
+def claim_content_hash(job_id: int, source, cursor, conn):
+    """
+    Считает хэш файла, загруженного в бакет напрямую (у загрузок через тело запроса он уже есть).
+    Точный дубль уже загруженного файла упирается в уникальный индекс
+    """
+    content_sha256 = file_sha256(source)
+    try:
+        cursor.execute("""
+            UPDATE financial_upload_jobs SET content_sha256 = %s WHERE id = %s
+        """, (content_sha256, job_id))
+        conn.commit()
+    except psycopg2.IntegrityError:
+        conn.rollback()
+        raise ValueError('Этот файл уже был загружен')
+
+def plan_job(job: tuple, worker_id: str, started_at: float, cursor, conn) -> bool:
+    """
+    Стадия планирования: один потоковый проход по файлу.
+    Проверяет заголовок, запоминает раскладку колонок, считает строки и сразу пишет чанки с сегментами,
+    так что обработка первых чанков начинается, пока файл ещё дочитывается.
+    Строки, уже загруженные за тот же период другим файлом, в чанки не попадают.
+    Если время вышло — отпускает задачу, следующий воркер продолжит с stream_cursor.
+    Возвращает True, если планирование завершено
+    """
+    job_id, file_key, chunk_size, stream_cursor, total_rows, chunk_number, column_layout, period, content_sha256, file_owned = job
+    
+    source = load_job_file(job_id, file_key, cursor)
+    stream_cursor = stream_cursor or 0
+    total_rows = total_rows or 0
+    chunk_number = chunk_number or 0
+    
+    if content_sha256 is None:
+        claim_content_hash(job_id, source, cursor, conn)
+    
+    if column_layout is None:
+        column_layout = validate_column_layout(read_header(source))
+        cursor.execute("""
+            UPDATE financial_upload_jobs SET column_layout = %s WHERE id = %s
+        """, (json.dumps(column_layout), job_id))
+        conn.commit()
+        print(f"[PLAN {job_id}] Column layout: {column_layout}")
+    
+    artist_col = column_layout['artist']
+    album_col = column_layout['album']
+    amount_col = column_layout['amount']
+    min_length = max(column_layout.values()) + 1
+    
+    print(f"[PLAN {job_id}] Streaming from row {stream_cursor + 1}")
+    row_stream = ReportRowStream(source, stream_cursor)
+    artists, albums, raw_amounts, fingerprints = [], [], [], []
+    
+    for position, row in row_stream.take(stream_cursor + 1, sys.maxsize):
+        if not row or len(row) < min_length or not row[artist_col]:
+            continue
+        
+        artists.append(str(row[artist_col]))
+        albums.append(str(row[album_col]) if row[album_col] else "")
+        raw_amounts.append(row[amount_col])
+        fingerprints.append(row_fingerprint(row))
+        
+        if len(raw_amounts) >= chunk_size:
+            saved = save_planned_chunk(job_id, period, worker_id, chunk_number, total_rows + 1,
+                                       (artists, albums, raw_amounts), fingerprints, position, cursor, conn)
+            total_rows += saved
+            chunk_number += 1 if saved else 0
+            artists, albums, raw_amounts, fingerprints = [], [], [], []
+            
+            if time.monotonic() - started_at > TIME_BUDGET_SECONDS:
+                cursor.execute("""
+                    UPDATE financial_upload_jobs
+                    SET plan_lease_expires_at = NULL
+                    WHERE id = %s AND planned_by = %s
+                """, (job_id, worker_id))
+                conn.commit()
+                print(f"[PLAN {job_id}] Time budget exhausted at row {position}, {chunk_number} chunks so far")
+                return False
+    
+    if raw_amounts:
+        saved = save_planned_chunk(job_id, period, worker_id, chunk_number, total_rows + 1,
+                                   (artists, albums, raw_amounts), fingerprints, row_stream.position, cursor, conn)
+        total_rows += saved
+        chunk_number += 1 if saved else 0
+    
+    if total_rows == 0:
+        cursor.execute("SELECT duplicate_rows FROM financial_upload_jobs WHERE id = %s", (job_id,))
+        if cursor.fetchone()[0]:
+            raise ValueError(f'Все строки файла уже были загружены за период {period}')
+        raise ValueError('В файле нет строк с данными')
+    
+    cursor.execute("""
+        UPDATE financial_upload_jobs
+        SET planned_at = NOW(),
+            total_rows = %s,
+            total_chunks = %s,
+            file_data = NULL,
+            plan_lease_expires_at = NULL
+        WHERE id = %s AND planned_by = %s
+    """, (total_rows, chunk_number, job_id, worker_id))
+    
+    if cursor.rowcount == 0:
+        raise ChunkLeaseLost(f"Planning of job {job_id} was taken over by another worker")
+    record_progress(job_id, cursor)
+    conn.commit()
+    
+    if file_key:
+        # Файл, на который клиент сослался сам (fileKey), остаётся в бакете — удаляем только сохранённый загрузчиком
+        delete_report_file(file_key, from_bucket=file_owned)
+    
+    print(f"[PLAN {job_id}] ✅ {total_rows} rows in {chunk_number} chunks")
+    return True
+
+def plan_next_job(worker_id: str, started_at: float, cursor, conn):
+    """Планирует одну задачу, если такая есть. Возвращает id задачи или None"""
+    job = claim_planning_job(worker_id, cursor, conn)
+    if job is None:
+        return None
+    
+    job_id = job[0]
+    try:
+        plan_job(job, worker_id, started_at, cursor, conn)
+    except ChunkLeaseLost as e:
+        print(f"[PLAN {job_id}] ⚠️ {str(e)}")
+        conn.rollback()
+    except Exception as e:
+        print(f"[PLAN {job_id}] ❌ Error: {str(e)}")
+        conn.rollback()
+        cursor.execute("""
+            UPDATE financial_upload_jobs
+            SET status = 'failed', error_message = %s, plan_lease_expires_at = NULL
+            WHERE id = %s AND planned_by = %s
+        """, (str(e), job_id, worker_id))
+        cursor.execute("DELETE FROM financial_row_fingerprints WHERE job_id = %s", (job_id,))
+        record_progress(job_id, cursor)
+        conn.commit()
+    
+    return job_id
+
+PREVIEW_BATCH_ROWS = 5000
+PREVIEW_TOP_N = 20
+
+def preview_report(source, matcher: ReleaseMatcher, started_at: float, max_rows: int = 0, top_n: int = PREVIEW_TOP_N) -> dict:
+    """
+    Пробный прогон файла через тот же ReleaseMatcher, что и обработка чанков, без записи в БД.
+    Строки идут потоком пачками по PREVIEW_BATCH_ROWS; max_rows ограничивает выборку (0 — весь файл).
+    Возвращает долю точных совпадений (только они начисляются), объём строк на проверку,
+    топ несопоставленных пар по сумме и суммы по артистам
+    """
+    layout = validate_column_layout(read_header(source))
+    artist_col, album_col, amount_col = layout['artist'], layout['album'], layout['amount']
+    min_length = max(layout.values()) + 1
+    
+    artist_names = {user_id: artist_name for user_id, _, artist_name in matcher.releases_map.values()}
+    unmatched = {}
+    per_artist = {}
+    totals = {'rows': 0, 'matched_rows': 0, 'review_rows': 0, 'amount': Decimal(0), 'matched_amount': Decimal(0),
+              'review_amount': Decimal(0)}
+    complete = True
+    
+    def flush(artists, albums, raw_amounts):
+        amounts = parse_amount_column(raw_amounts)
+        for artist_name, album_name, amount, (user_id, _, confidence) in zip(artists, albums, amounts, matcher.match_column(artists, albums)):
+            cents = Decimal(repr(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+            totals['rows'] += 1
+            totals['amount'] += cents
+            if user_id and confidence != EXACT_MATCH_CONFIDENCE:
+                totals['review_rows'] += 1
+                totals['review_amount'] += cents
+                continue
+            if user_id:
+                totals['matched_rows'] += 1
+                totals['matched_amount'] += cents
+                entry = per_artist.setdefault(user_id, [Decimal(0), 0])
+            else:
+                entry = unmatched.setdefault((artist_name, album_name), [Decimal(0), 0])
+            entry[0] += cents
+            entry[1] += 1
+    
+    artists, albums, raw_amounts = [], [], []
+    for position, row in ReportRowStream(source).take(1, sys.maxsize):
+        if not row or len(row) < min_length or not row[artist_col]:
+            continue
+        # Выборка неполная, только если после max_rows нашлась ещё хотя бы одна строка
+        if max_rows and totals['rows'] + len(raw_amounts) >= max_rows:
+            complete = False
+            break
+        
+        artists.append(str(row[artist_col]))
+        albums.append(str(row[album_col]) if row[album_col] else "")
+        raw_amounts.append(row[amount_col])
+        if len(raw_amounts) >= PREVIEW_BATCH_ROWS:
+            flush(artists, albums, raw_amounts)
+            artists, albums, raw_amounts = [], [], []
+            if time.monotonic() - started_at > TIME_BUDGET_SECONDS:
+                complete = False
+                break
+    
+    if raw_amounts:
+        flush(artists, albums, raw_amounts)
+    
+    top_unmatched = sorted(unmatched.items(), key=lambda item: item[1][0], reverse=True)[:top_n]
+    artist_totals = sorted(per_artist.items(), key=lambda item: item[1][0], reverse=True)
+    
+    return {
+        'complete': complete,
+        'column_layout': layout,
+        'rows': totals['rows'],
+        'matched_rows': totals['matched_rows'],
+        'match_rate': round(totals['matched_rows'] / totals['rows'] * 100, 2) if totals['rows'] else 0.0,
+        'amount': float(totals['amount']),
+        'matched_amount': float(totals['matched_amount']),
+        'review_rows': totals['review_rows'],
+        'review_amount': float(totals['review_amount']),
+        'unmatched_amount': float(totals['amount'] - totals['matched_amount'] - totals['review_amount']),
+        'top_unmatched': [
+            {'artist_name': artist_name, 'album_name': album_name, 'amount': float(amount), 'rows': count}
+            for (artist_name, album_name), (amount, count) in top_unmatched
+        ],
+        'artists': [
+            {'user_id': user_id, 'artist_name': artist_names.get(user_id), 'amount': float(amount), 'rows': count}
+            for user_id, (amount, count) in artist_totals
+        ]
+    }
+
 def finalize_job(job_id: int, cursor, conn) -> bool:
     """Завершает обработку задачи и обновляет балансы. Возвращает True если остались чанки"""
     cursor.execute("""
@@ -158,58 +1105,306 @@ def finalize_job(job_id: int, cursor, conn) -> bool:
     completed_chunks, total_processed, total_matched = cursor.fetchone()
     
     cursor.execute("""
-        SELECT total_chunks FROM financial_upload_jobs WHERE id = %s
+        SELECT total_chunks, planned_at, status FROM financial_upload_jobs WHERE id = %s
     """, (job_id,))
-    total_chunks = cursor.fetchone()[0]
-    
-    cursor.execute("""
-        UPDATE financial_upload_jobs
-        SET completed_chunks = %s,
-            processed_rows = %s,
-            matched_count = %s,
-            unmatched_count = %s - %s
-        WHERE id = %s
-    """, (completed_chunks, total_processed, total_matched, total_processed, total_matched, job_id))
+    total_chunks, planned_at, status = cursor.fetchone()
     
-    has_more_chunks = completed_chunks < total_chunks
+    if status == 'failed':
+        conn.commit()
+        return False
     
-    if completed_chunks >= total_chunks:
+    if completed_chunks:
         cursor.execute("""
-            SELECT user_id, SUM(amount) as total_amount
-            FROM financial_reports
-            WHERE uploaded_by IN (SELECT uploaded_by FROM financial_upload_jobs WHERE id = %s)
-              AND period = (SELECT period FROM financial_upload_jobs WHERE id = %s)
-              AND status = 'matched'
-              AND uploaded_at >= (SELECT created_at FROM financial_upload_jobs WHERE id = %s)
-            GROUP BY user_id
-        """, (job_id, job_id, job_id))
-        
-        for user_id, total_amount in cursor.fetchall():
-            cursor.execute("""
-                UPDATE users
-                SET balance = balance + %s
-                WHERE id = %s
-            """, (total_amount, user_id))
-        
+            UPDATE financial_upload_jobs
+            SET completed_chunks = %s,
+                processed_rows = %s,
+                matched_count = %s,
+                unmatched_count = %s - %s
+            WHERE id = %s
+        """, (completed_chunks, total_processed, total_matched, total_processed, total_matched, job_id))
+    
+    is_planned = planned_at is not None
+    has_more_chunks = not is_planned or completed_chunks < total_chunks
+    
+    if is_planned and completed_chunks >= total_chunks:
         cursor.execute("""
             UPDATE financial_upload_jobs
             SET status = 'completed',
                 completed_at = NOW()
-            WHERE id = %s
+            WHERE id = %s AND status <> 'completed'
+            RETURNING id
         """, (job_id,))
         
-        print(f"[JOB {job_id}] ✅ Completed and balances updated")
+        if cursor.fetchone() is None:
+            conn.commit()
+            print(f"[JOB {job_id}] Already finalized by another worker")
+            return False
+        
+        cursor.execute("""
+            WITH applied AS (
+                UPDATE financial_balance_ledger
+                SET applied_at = NOW()
+                WHERE job_id = %s AND applied_at IS NULL
+                RETURNING user_id, amount
+            )
+            UPDATE users u
+            SET balance = u.balance + applied.amount
+            FROM applied
+            WHERE u.id = applied.user_id
+        """, (job_id,))
+        
+        cursor.execute("""
+            WITH applied AS (
+                UPDATE financial_rollup_ledger
+                SET applied_at = NOW()
+                WHERE job_id = %s AND applied_at IS NULL
+                RETURNING user_id, release_id, amount, rows_count
+            )
+            INSERT INTO artist_earnings_rollup (user_id, period, release_id, total_amount, rows_count)
+            SELECT applied.user_id, j.period, applied.release_id, SUM(applied.amount), SUM(applied.rows_count)
+            FROM applied
+            JOIN financial_upload_jobs j ON j.id = %s
+            GROUP BY applied.user_id, j.period, applied.release_id
+            ON CONFLICT (user_id, period, release_id)
+            DO UPDATE SET total_amount = artist_earnings_rollup.total_amount + EXCLUDED.total_amount,
+                          rows_count = artist_earnings_rollup.rows_count + EXCLUDED.rows_count,
+                          updated_at = NOW()
+        """, (job_id, job_id))
+        
+        record_progress(job_id, cursor)
+        print(f"[JOB {job_id}] ✅ Completed, balances and earnings rollup updated")
     else:
         print(f"[JOB {job_id}] Progress: {completed_chunks}/{total_chunks} chunks")
     
     conn.commit()
     return has_more_chunks
 
+REMATCH_BATCH_CHANGES = 500
+MATCH_KEY_BACKFILL_ROWS = 5000
+
+def backfill_match_keys(cursor, conn) -> bool:
+    """
+    Досчитывает match_key ожидающих строк, у которых его нет (строки до появления досопоставления).
+    Ключ считается той же normalize_string, что и при сопоставлении: SQL-аналог расходился с ней
+    (lower() зависит от локали БД, неразрывные пробелы). Строкам без ключа пишется '' — они больше не выбираются.
+    Возвращает True, если такие строки ещё остались
+    """
+    cursor.execute("""
+        SELECT id, artist_name, album_name FROM financial_reports
+        WHERE status = 'pending' AND match_key IS NULL
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (MATCH_KEY_BACKFILL_ROWS,))
+    rows = cursor.fetchall()
+    if not rows:
+        conn.commit()
+        return False
+    
+    normalized_artists = normalize_column([artist_name or '' for _, artist_name, _ in rows])
+    normalized_albums = normalize_column([album_name or '' for _, _, album_name in rows])
+    cursor.execute("""
+        UPDATE financial_reports f
+        SET match_key = k.match_key
+        FROM unnest(%s::int[], %s::text[]) AS k(id, match_key)
+        WHERE f.id = k.id
+    """, (
+        [row[0] for row in rows],
+        [release_match_key(artist, album) or '' for artist, album in zip(normalized_artists, normalized_albums)]
+    ))
+    conn.commit()
+    print(f"[REMATCH] Backfilled match_key for {len(rows)} pending rows")
+    return len(rows) == MATCH_KEY_BACKFILL_ROWS
+
+def run_rematch(cursor, conn) -> bool:
+    """
+    Инкрементальное досопоставление: берёт релизы, созданные или переименованные после отметки last_change_id,
+    и переводит ожидающие строки (pending и needs_review) с тем же ключом match_key в matched (через частичный индекс).
+    Исторические изменения (до history_through) меняют балансы за прошлые периоды разом, поэтому проходятся
+    только после явного одобрения администратором (history_approved_at), своей отметкой history_cursor.
+    Начисления идут через задачу kind='rematch' на каждый период и тот же finalize_job, что и у загрузок.
+    Всё, включая сдвиг отметки, — одна транзакция. Возвращает True, если изменения ещё остались
+    """
+    cursor.execute("""
+        SELECT id FROM financial_upload_jobs
+        WHERE kind = 'rematch' AND status = 'processing' AND planned_at IS NOT NULL
+    """)
+    for (job_id,) in cursor.fetchall():
+        finalize_job(job_id, cursor, conn)
+    
+    cursor.execute("""
+        SELECT last_change_id, history_cursor, history_through, history_approved_at IS NOT NULL
+        FROM release_rematch_state WHERE id = 1 FOR UPDATE SKIP LOCKED
+    """)
+    state = cursor.fetchone()
+    if state is None:
+        conn.commit()
+        return False
+    
+    last_change_id, history_cursor, history_through, history_approved = state
+    if history_approved and history_cursor < history_through:
+        after_id, upto_id, mark_column = history_cursor, history_through, 'history_cursor'
+    else:
+        after_id, upto_id, mark_column = last_change_id, None, 'last_change_id'
+    
+    cursor.execute("""
+        SELECT c.id, r.id, r.artist_id, r.artist_name, r.release_name
+        FROM release_changes c
+        JOIN releases r ON r.id = c.release_id
+        WHERE c.id > %s AND (%s::bigint IS NULL OR c.id <= %s)
+        ORDER BY c.id
+        LIMIT %s
+    """, (after_id, upto_id, upto_id, REMATCH_BATCH_CHANGES))
+    changes = cursor.fetchall()
+    if not changes:
+        if mark_column == 'history_cursor':
+            # Изменений в окне больше нет (релизы удалены) — закрываем историческое окно
+            cursor.execute("UPDATE release_rematch_state SET history_cursor = history_through WHERE id = 1")
+            conn.commit()
+            return True
+        conn.commit()
+        return False
+    
+    targets = {}
+    for _, release_id, artist_id, artist_name, release_name in changes:
+        key = release_match_key(normalize_string(artist_name or ""), normalize_string(release_name or ""))
+        if key and artist_id:
+            targets[key] = (artist_id, release_id)
+    
+    promoted = []
+    if targets:
+        cursor.execute("""
+            WITH promoted AS (
+                UPDATE financial_reports f
+                SET status = 'matched',
+                    user_id = k.user_id,
+                    release_id = k.release_id,
+                    match_confidence = 1.0,
+                    match_key = NULL
+                FROM unnest(%s::text[], %s::int[], %s::int[]) AS k(match_key, user_id, release_id)
+                WHERE f.status IN ('pending', 'needs_review') AND f.match_key = k.match_key
+                RETURNING f.period, f.user_id, f.release_id, f.amount
+            )
+            SELECT period, user_id, release_id, SUM(amount), COUNT(*)
+            FROM promoted
+            GROUP BY period, user_id, release_id
+        """, (
+            list(targets.keys()),
+            [user_id for user_id, _ in targets.values()],
+            [release_id for _, release_id in targets.values()]
+        ))
+        promoted = cursor.fetchall()
+    
+    cursor.execute(f"""
+        UPDATE release_rematch_state SET {mark_column} = %s, updated_at = NOW() WHERE id = 1
+    """, (changes[-1][0],))
+    
+    rematch_jobs = create_credit_jobs('rematch', promoted, cursor)
+    if not rematch_jobs:
+        conn.commit()
+        print(f"[REMATCH] {len(changes)} release changes, no pending rows matched")
+        return len(changes) == REMATCH_BATCH_CHANGES or mark_column == 'history_cursor'
+    
+    # Первый finalize_job фиксирует всю транзакцию; задачи, не завершённые из-за сбоя, добьёт следующий запуск
+    for job_id in rematch_jobs:
+        finalize_job(job_id, cursor, conn)
+    return len(changes) == REMATCH_BATCH_CHANGES or mark_column == 'history_cursor'
+
+def create_credit_jobs(kind: str, promoted: List[tuple], cursor) -> List[int]:
+    """
+    Оформляет начисление уже переведённых в matched строк (period, user_id, release_id, amount, count):
+    по задаче kind на период, с записями в журналы балансов и сводки. Применяет их finalize_job
+    """
+    by_period = {}
+    for period, user_id, release_id, amount, count in promoted:
+        by_period.setdefault(period, []).append((user_id, release_id, amount, count))
+    
+    job_ids = []
+    for period, groups in by_period.items():
+        rows_count = sum(count for _, _, _, count in groups)
+        cursor.execute("""
+            INSERT INTO financial_upload_jobs
+            (kind, period, filename, status, total_rows, processed_rows, matched_count, unmatched_count,
+             total_chunks, started_at, planned_at)
+            VALUES (%s, %s, %s, 'processing', %s, %s, %s, 0, 0, NOW(), NOW())
+            RETURNING id
+        """, (kind, period, kind, rows_count, rows_count, rows_count))
+        job_id = cursor.fetchone()[0]
+        
+        balances = {}
+        for user_id, _, amount, _ in groups:
+            balances[user_id] = balances.get(user_id, Decimal(0)) + amount
+        
+        cursor.execute("""
+            INSERT INTO financial_balance_ledger (job_id, user_id, amount)
+            SELECT %s, u.user_id, u.amount
+            FROM unnest(%s::int[], %s::numeric[]) AS u(user_id, amount)
+        """, (job_id, list(balances.keys()), list(balances.values())))
+        
+        cursor.execute("""
+            INSERT INTO financial_rollup_ledger (job_id, user_id, release_id, amount, rows_count)
+            SELECT %s, u.user_id, u.release_id, u.amount, u.rows_count
+            FROM unnest(%s::int[], %s::int[], %s::numeric[], %s::int[]) AS u(user_id, release_id, amount, rows_count)
+        """, (
+            job_id,
+            [user_id for user_id, _, _, _ in groups],
+            [release_id or 0 for _, release_id, _, _ in groups],
+            [amount for _, _, amount, _ in groups],
+            [count for _, _, _, count in groups]
+        ))
+        
+        job_ids.append(job_id)
+        print(f"[{kind.upper()}] Job {job_id}: credited {rows_count} rows for {period}")
+    return job_ids
+
+REVIEW_BATCH_ROWS = 5000
+
+def run_confirmed_matches(cursor, conn) -> bool:
+    """
+    Начисляет строки needs_review, подтверждённые администратором (status = 'confirmed'):
+    переводит их в matched и оформляет задачу kind='review' на период. Одна транзакция.
+    Возвращает True, если подтверждённые строки ещё остались
+    """
+    cursor.execute("""
+        SELECT id FROM financial_upload_jobs
+        WHERE kind = 'review' AND status = 'processing' AND planned_at IS NOT NULL
+    """)
+    for (job_id,) in cursor.fetchall():
+        finalize_job(job_id, cursor, conn)
+    
+    cursor.execute("""
+        WITH promoted AS (
+            UPDATE financial_reports f
+            SET status = 'matched', match_key = NULL
+            WHERE f.id IN (
+                SELECT id FROM financial_reports
+                WHERE status = 'confirmed'
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING f.period, f.user_id, f.release_id, f.amount
+        )
+        SELECT period, user_id, release_id, SUM(amount), COUNT(*)
+        FROM promoted
+        GROUP BY period, user_id, release_id
+    """, (REVIEW_BATCH_ROWS,))
+    promoted = cursor.fetchall()
+    
+    review_jobs = create_credit_jobs('review', promoted, cursor)
+    if not review_jobs:
+        conn.commit()
+        return False
+    
+    for job_id in review_jobs:
+        finalize_job(job_id, cursor, conn)
+    return sum(count for _, _, _, _, count in promoted) == REVIEW_BATCH_ROWS
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Business: Worker для обработки финансовых отчётов по чанкам
-    Args: event с httpMethod GET
-    Returns: Статус обработки чанков
+    Args: event с httpMethod GET (обработка чанков) или POST action=preview (file/fileKey, maxRows, topN)
+    Returns: Статус обработки чанков или статистика пробного сопоставления без записи в БД
     """
     method = event.get('httpMethod', 'GET')
     
@@ -219,7 +1414,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -231,21 +1426,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             conn = psycopg2.connect(dsn)
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT jc.id, jc.job_id, jc.start_row, jc.end_row,
-                       fuj.file_data, fuj.period, fuj.uploaded_by
-                FROM job_chunks jc
-                JOIN financial_upload_jobs fuj ON jc.job_id = fuj.id
-                WHERE jc.status = 'pending'
-                ORDER BY jc.job_id, jc.chunk_number
-                LIMIT 3
-            """)
+            worker_id = uuid.uuid4().hex
+            started_at = time.monotonic()
             
-            pending_chunks = cursor.fetchall()
+            try:
+                # Пока ключи не досчитаны, досопоставление не сдвигает отметку — иначе строки без ключа пропустятся
+                rematch_pending = backfill_match_keys(cursor, conn) or run_rematch(cursor, conn)
+            except Exception as e:
+                print(f"[REMATCH] ❌ Error: {str(e)}")
+                conn.rollback()
+                rematch_pending = False
             
-            if not pending_chunks:
+            try:
+                rematch_pending = run_confirmed_matches(cursor, conn) or rematch_pending
+            except Exception as e:
+                print(f"[REVIEW] ❌ Error: {str(e)}")
+                conn.rollback()
+            
+            planned_job_id = plan_next_job(worker_id, started_at, cursor, conn)
+            
+            pending_chunks = []
+            if time.monotonic() - started_at < TIME_BUDGET_SECONDS:
+                pending_chunks = claim_chunks(worker_id, CHUNKS_PER_INVOCATION, cursor, conn)
+            
+            if not pending_chunks and planned_job_id is None:
                 cursor.close()
                 conn.close()
+                if rematch_pending:
+                    trigger_workers(1)
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json'},
@@ -256,67 +1464,99 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     })
                 }
             
-            cursor.execute("""
-                UPDATE job_chunks
-                SET status = 'processing', started_at = NOW()
-                WHERE id IN %s
-            """, (tuple(chunk[0] for chunk in pending_chunks),))
-            conn.commit()
+            print(f"[WORKER {worker_id}] Claimed {len(pending_chunks)} chunks")
             
-            releases_map = load_all_releases(cursor)
-            print(f"[WORKER] Loaded {len(releases_map)} releases")
+            if pending_chunks:
+                matcher = get_release_matcher(cursor, conn)
+                print(f"[WORKER] Loaded {len(matcher.releases_map)} releases")
             
-            processed_jobs = set()
+            jobs = {}
+            row_streams = {}
+            processed_jobs = {planned_job_id} if planned_job_id else set()
             total_processed = 0
             
-            for chunk_id, job_id, start_row, end_row, file_data, period, admin_user_id in pending_chunks:
+            for index, (chunk_id, job_id, start_row, end_row, segment) in enumerate(pending_chunks):
+                if time.monotonic() - started_at > TIME_BUDGET_SECONDS:
+                    released = tuple(chunk[0] for chunk in pending_chunks[index:])
+                    release_chunks(worker_id, released, cursor, conn)
+                    print(f"[WORKER] Time budget exhausted, released {len(released)} chunks")
+                    break
+                
                 try:
-                    cursor.execute("""
-                        UPDATE financial_upload_jobs
-                        SET status = 'processing', started_at = COALESCE(started_at, NOW())
-                        WHERE id = %s AND status = 'pending'
-                    """, (job_id,))
-                    conn.commit()
+                    if job_id not in jobs:
+                        cursor.execute("""
+                            UPDATE financial_upload_jobs
+                            SET status = 'processing', started_at = COALESCE(started_at, NOW())
+                            WHERE id = %s AND status = 'pending'
+                        """, (job_id,))
+                        cursor.execute("""
+                            SELECT period, uploaded_by, stream_cursor, file_key
+                            FROM financial_upload_jobs
+                            WHERE id = %s
+                        """, (job_id,))
+                        jobs[job_id] = cursor.fetchone()
+                        conn.commit()
+                    
+                    period, admin_user_id, stream_cursor, file_key = jobs[job_id]
+                    
+                    if segment is not None:
+                        columns = decode_segment(bytes(segment))
+                    else:
+                        if job_id not in row_streams:
+                            print(f"[JOB {job_id}] Streaming from row {start_row} (cursor: {stream_cursor or 0})")
+                            source = load_job_file(job_id, file_key, cursor)
+                            row_streams[job_id] = ReportRowStream(source, start_row - 1)
+                        columns = sheet_rows_to_columns(row_streams[job_id].take(start_row, end_row))
                     
                     result = process_chunk(
                         chunk_id, job_id, start_row, end_row,
-                        bytes(file_data), period, admin_user_id,
-                        releases_map, cursor, conn
+                        columns, period, admin_user_id,
+                        matcher, worker_id, cursor, conn
                     )
                     
                     processed_jobs.add(job_id)
                     total_processed += 1
+                    extend_lease(worker_id, cursor, conn)
+                    
+                except ChunkLeaseLost as e:
+                    print(f"[CHUNK {chunk_id}] ⚠️ {str(e)}")
+                    conn.rollback()
+                    row_streams.pop(job_id, None)
                     
                 except Exception as e:
                     print(f"[CHUNK {chunk_id}] ❌ Error: {str(e)}")
+                    conn.rollback()
                     cursor.execute("""
                         UPDATE job_chunks
-                        SET status = 'failed', error_message = %s
-                        WHERE id = %s
-                    """, (str(e), chunk_id))
+                        SET status = 'failed', error_message = %s, lease_expires_at = NULL
+                        WHERE id = %s AND claimed_by = %s
+                    """, (str(e), chunk_id, worker_id))
                     conn.commit()
+                    row_streams.pop(job_id, None)
             
             has_more_chunks = False
             for job_id in processed_jobs:
                 if finalize_job(job_id, cursor, conn):
                     has_more_chunks = True
             
+            remaining_chunks = 0
+            if has_more_chunks:
+                cursor.execute("""
+                    SELECT
+                        (SELECT COUNT(*) FROM job_chunks WHERE status = 'pending'),
+                        (SELECT COUNT(*) FROM financial_upload_jobs
+                         WHERE planned_at IS NULL AND status IN ('pending', 'processing')
+                           AND (plan_lease_expires_at IS NULL OR plan_lease_expires_at < NOW()))
+                """)
+                pending_count, unplanned_count = cursor.fetchone()
+                remaining_chunks = pending_count + unplanned_count * CHUNKS_PER_INVOCATION
+            
             cursor.close()
             conn.close()
             
-            if has_more_chunks and total_processed > 0:
-                function_url = os.environ.get('SELF_URL')
-                if function_url:
-                    print(f"[WORKER] 🔄 Auto-triggering next batch...")
-                    try:
-                        req = urllib.request.Request(
-                            function_url,
-                            method='GET',
-                            headers={'Content-Type': 'application/json'}
-                        )
-                        urllib.request.urlopen(req, timeout=2)
-                    except Exception as e:
-                        print(f"[WORKER] Auto-trigger sent (fire-and-forget): {str(e)}")
+            if remaining_chunks or rematch_pending:
+                fanout = int(os.environ.get('WORKER_FANOUT', '3'))
+                trigger_workers(max(1, min(fanout, -(-remaining_chunks // CHUNKS_PER_INVOCATION))))
             
             return {
                 'statusCode': 200,
@@ -347,6 +1587,109 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': error_msg})
             }
     
+    if method == 'POST':
+        conn = None
+        cursor = None
+        downloaded_path = None
+        try:
+            body_data = json.loads(event.get('body') or '{}')
+            if body_data.get('action') != 'preview':
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Unknown action, expected "preview"'})
+                }
+            
+            headers = event.get('headers', {})
+            user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+            if not user_id:
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'X-User-Id required'})
+                }
+            
+            file_key = body_data.get('fileKey')
+            if file_key and not is_allowed_file_key(file_key):
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'fileKey must be inside {", ".join(ALLOWED_FILE_KEY_PREFIXES)}'})
+                }
+            
+            started_at = time.monotonic()
+            dsn = os.environ.get('DATABASE_URL')
+            conn = psycopg2.connect(dsn)
+            cursor = conn.cursor()
+            
+            # Превью раскрывает суммы по артистам — только для директора, как и загрузка отчётов
+            cursor.execute("SELECT role FROM users WHERE id = %s", (user_id,))
+            user = cursor.fetchone()
+            if not user or user[0] != 'director':
+                cursor.close()
+                conn.close()
+                return {
+                    'statusCode': 403,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Only director can preview financial reports'})
+                }
+            
+            if file_key:
+                downloaded_path = download_private_file(file_key)
+                source = downloaded_path
+            elif body_data.get('file'):
+                source = base64.b64decode(body_data['file'])
+            else:
+                cursor.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Missing required field: file or fileKey'})
+                }
+            
+            matcher = get_release_matcher(cursor, conn)
+            cursor.close()
+            conn.close()
+            
+            preview = preview_report(
+                source, matcher, started_at,
+                max_rows=int(body_data.get('maxRows') or 0),
+                top_n=int(body_data.get('topN') or PREVIEW_TOP_N)
+            )
+            print(f"[PREVIEW] {preview['rows']} rows, {preview['match_rate']}% matched in {time.monotonic() - started_at:.2f}s")
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'success': True, 'preview': preview}, ensure_ascii=False)
+            }
+            
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}, ensure_ascii=False)
+            }
+        except Exception as e:
+            print(f"[PREVIEW] Error: {str(e)}")
+            try:
+                if cursor:
+                    cursor.close()
+                if conn:
+                    conn.close()
+            except:
+                pass
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)})
+            }
+        finally:
+            # Временный файл превью не нужен после ответа — не оставляем его в /tmp экземпляра
+            if downloaded_path and os.path.exists(downloaded_path):
+                os.remove(downloaded_path)
+    
     return {
         'statusCode': 405,
         'headers': {'Content-Type': 'application/json'},
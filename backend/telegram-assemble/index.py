@@ -9,9 +9,75 @@ import json
 import os
 import requests
 import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 from io import BytesIO
 
+# Сколько upload_part_copy выполняется одновременно
+MAX_COPY_WORKERS = 8
+# Лимит ключей в одном запросе delete_objects
+DELETE_BATCH_SIZE = 1000
+
+_s3_client = None
+
+def get_s3_client():
+    """Общий S3-клиент экземпляра; пул соединений рассчитан на MAX_COPY_WORKERS одновременных копирований"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url='https://storage.yandexcloud.net',
+            aws_access_key_id=os.environ.get('YC_S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('YC_S3_SECRET_ACCESS_KEY'),
+            region_name='ru-central1',
+            config=Config(
+                max_pool_connections=MAX_COPY_WORKERS,
+                retries={'max_attempts': 3, 'mode': 'standard'},
+                connect_timeout=5,
+                read_timeout=60
+            )
+        )
+    return _s3_client
+
+def copy_parts(s3_client, bucket_name: str, final_key: str, upload_id: str, chunk_keys: List[str]) -> List[Dict[str, Any]]:
+    """Копирует чанки в части multipart-загрузки параллельно, части возвращаются по порядку номеров"""
+    def copy_part(numbered_key):
+        part_number, chunk_key = numbered_key
+        copy_response = s3_client.upload_part_copy(
+            Bucket=bucket_name,
+            Key=final_key,
+            PartNumber=part_number,
+            UploadId=upload_id,
+            CopySource={'Bucket': bucket_name, 'Key': chunk_key}
+        )
+        return {
+            'PartNumber': part_number,
+            'ETag': copy_response['CopyPartResult']['ETag']
+        }
+    
+    with ThreadPoolExecutor(max_workers=min(MAX_COPY_WORKERS, len(chunk_keys))) as pool:
+        return list(pool.map(copy_part, enumerate(chunk_keys, start=1)))
+
+def uploaded_size(s3_client, bucket_name: str, final_key: str, upload_id: str) -> int:
+    """Размер файла по метаданным загруженных частей (list_parts отдаёт до 1000 частей за запрос)"""
+    total_size = 0
+    marker = 0
+    while True:
+        response = s3_client.list_parts(Bucket=bucket_name, Key=final_key, UploadId=upload_id, PartNumberMarker=marker)
+        total_size += sum(part['Size'] for part in response.get('Parts', []))
+        if not response.get('IsTruncated'):
+            return total_size
+        marker = response['NextPartNumberMarker']
+
+def delete_chunks(s3_client, bucket_name: str, chunk_keys: List[str]):
+    for start in range(0, len(chunk_keys), DELETE_BATCH_SIZE):
+        batch = chunk_keys[start:start + DELETE_BATCH_SIZE]
+        s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+        )
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
     
@@ -50,17 +116,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         print(f'[Assemble] Assembling {len(chunk_keys)} chunks for {file_name}')
         
         # Download and assemble chunks from S3
-        access_key = os.environ.get('YC_S3_ACCESS_KEY_ID')
-        secret_key = os.environ.get('YC_S3_SECRET_ACCESS_KEY')
         bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
-        
-        s3_client = boto3.client(
-            's3',
-            endpoint_url='https://storage.yandexcloud.net',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name='ru-central1'
-        )
+        s3_client = get_s3_client()
         
         # Use S3 CopyObject to assemble chunks efficiently (no memory overhead)
         import uuid
@@ -80,40 +137,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         )
         
         upload_id = mpu['UploadId']
-        parts = []
         
-        # Copy each chunk as a part
-        for i, chunk_key in enumerate(chunk_keys):
-            part_number = i + 1
-            print(f'[Assemble] Copying chunk {part_number}/{len(chunk_keys)}: {chunk_key}')
+        try:
+            print(f'[Assemble] Copying {len(chunk_keys)} chunks with {MAX_COPY_WORKERS} workers')
+            parts = copy_parts(s3_client, bucket_name, final_key, upload_id, chunk_keys)
+            total_size = uploaded_size(s3_client, bucket_name, final_key, upload_id)
             
-            copy_response = s3_client.upload_part_copy(
+            s3_client.complete_multipart_upload(
                 Bucket=bucket_name,
                 Key=final_key,
-                PartNumber=part_number,
                 UploadId=upload_id,
-                CopySource={'Bucket': bucket_name, 'Key': chunk_key}
+                MultipartUpload={'Parts': parts}
             )
-            
-            parts.append({
-                'PartNumber': part_number,
-                'ETag': copy_response['CopyPartResult']['ETag']
-            })
-            
-            # Clean up chunk
-            s3_client.delete_object(Bucket=bucket_name, Key=chunk_key)
+        except Exception:
+            # Незавершённая загрузка продолжает занимать место в бакете; чанки остаются для повторной сборки
+            s3_client.abort_multipart_upload(Bucket=bucket_name, Key=final_key, UploadId=upload_id)
+            raise
         
-        # Complete multipart upload
-        s3_client.complete_multipart_upload(
-            Bucket=bucket_name,
-            Key=final_key,
-            UploadId=upload_id,
-            MultipartUpload={'Parts': parts}
-        )
+        # Чанки удаляем только после успешной сборки, пачками по DELETE_BATCH_SIZE
+        delete_chunks(s3_client, bucket_name, chunk_keys)
         
-        # Get final file info
-        head_response = s3_client.head_object(Bucket=bucket_name, Key=final_key)
-        total_size = head_response['ContentLength']
         file_url = f"https://storage.yandexcloud.net/{bucket_name}/{final_key}"
         
         print(f'[Assemble] ✅ Success! Assembled {total_size} bytes ({total_size / 1024 / 1024:.2f}MB) at {file_url}')
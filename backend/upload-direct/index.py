@@ -2,11 +2,360 @@ import json
 import os
 import base64
 import uuid
-from typing import Dict, Any
+import io
+import re
+from typing import Dict, Any, Optional
 import boto3
+import psycopg2
 from datetime import datetime
-import cgi
-from io import BytesIO
+from botocore.config import Config
+
+# Минимальный размер части S3 multipart (кроме последней)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+_s3_client = None
+
+def get_s3_client():
+    """S3-клиент создаётся один раз на экземпляр функции и переиспользуется между вызовами"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url='https://storage.yandexcloud.net',
+            aws_access_key_id=os.environ.get('YC_S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('YC_S3_SECRET_ACCESS_KEY'),
+            region_name='ru-central1',
+            config=Config(
+                max_pool_connections=10,
+                retries={'max_attempts': 3, 'mode': 'standard'},
+                connect_timeout=5,
+                read_timeout=60
+            )
+        )
+    return _s3_client
+
+MULTIPART_PARAM_RE = re.compile(r';\s*([\w*-]+)="([^"]*)"|;\s*([\w*-]+)=([^;\s]+)')
+
+class MultipartPart:
+    """Часть multipart-тела: заголовки разобраны, data — срез memoryview исходного тела без копирования"""
+    __slots__ = ('name', 'filename', 'content_type', 'data')
+
+    def __init__(self, name: str, filename: Optional[str], content_type: Optional[str], data: memoryview):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.data = data
+
+    def text(self) -> str:
+        return str(self.data, 'utf-8')
+
+class MemoryviewReader(io.RawIOBase):
+    """Файловый объект поверх memoryview: читает срезами, сам буфер не копирует"""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self.view) - self.position)
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+def multipart_boundary(content_type: str) -> bytes:
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        raise ValueError('multipart boundary not found')
+    return match.group(1).strip().encode('latin-1')
+
+def iter_multipart_parts(body: bytes, boundary: bytes):
+    """
+    Разбирает multipart/form-data поверх готового тела: поиск разделителей идёт по bytes,
+    а содержимое частей отдаётся срезами memoryview — тело не копируется ни целиком, ни по частям
+    """
+    view = memoryview(body)
+    delimiter = b'--' + boundary
+    position = body.find(delimiter)
+    if position < 0:
+        raise ValueError('multipart body has no boundary')
+    
+    while True:
+        position += len(delimiter)
+        if body[position:position + 2] == b'--':
+            return
+        headers_start = position + 2
+        headers_end = body.find(b'\r\n\r\n', headers_start)
+        if headers_end < 0:
+            raise ValueError('multipart part headers are not terminated')
+        data_start = headers_end + 4
+        data_end = body.find(b'\r\n' + delimiter, data_start)
+        if data_end < 0:
+            raise ValueError('multipart part is not terminated')
+        
+        disposition = {}
+        part_content_type = None
+        for line in str(body[headers_start:headers_end], 'utf-8', 'replace').split('\r\n'):
+            header, _, value = line.partition(':')
+            header = header.strip().lower()
+            if header == 'content-disposition':
+                for quoted_key, quoted_value, key, plain_value in MULTIPART_PARAM_RE.findall(value):
+                    disposition[(quoted_key or key).lower()] = quoted_value if quoted_key else plain_value
+            elif header == 'content-type':
+                part_content_type = value.strip()
+        
+        yield MultipartPart(disposition.get('name', ''), disposition.get('filename'), part_content_type, view[data_start:data_end])
+        position = data_end + 2
+
+def parse_multipart(body: bytes, content_type: str) -> Dict[str, MultipartPart]:
+    return {part.name: part for part in iter_multipart_parts(body, multipart_boundary(content_type))}
+
+def form_value(form: Dict[str, MultipartPart], name: str, default: Optional[str] = None) -> Optional[str]:
+    return form[name].text() if name in form else default
+
+def body_stream(data):
+    """Тело для boto3: memoryview из multipart оборачивается в файловый объект, bytes передаются как есть"""
+    return MemoryviewReader(data) if isinstance(data, memoryview) else data
+
+# Сессии загрузки: манифест полученных частей хранится в БД, чтобы клиент мог докачать только недостающие.
+# Запись сессии — вспомогательная: ошибка БД только логируется, источником истины по частям остаётся S3 (list_parts)
+UPLOAD_SESSION_TTL_DAYS = 7
+
+def create_upload_session(upload_id: str, s3_key: str, file_name: str, content_type: str,
+                          expected_size: Optional[int], part_size: Optional[int]) -> bool:
+    try:
+        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO upload_sessions
+                (upload_id, s3_key, file_name, content_type, expected_size, part_size, expires_at)
+                VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 day')
+            """, (upload_id, s3_key, file_name, content_type, expected_size, part_size, UPLOAD_SESSION_TTL_DAYS))
+            conn.commit()
+            return True
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Upload session {upload_id} not saved: {e}")
+        return False
+
+def record_uploaded_part(upload_id: str, part_number: int, etag: str, size: int) -> bool:
+    """
+    Записывает часть в манифест активной сессии; повторная отправка той же части перезаписывает ETag.
+    Каждая часть — отдельная строка, поэтому параллельные загрузки частей не конкурируют за одну запись.
+    Часть к этому моменту уже в S3, поэтому ошибка БД не должна отнимать у клиента ETag — только логируем
+    """
+    try:
+        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO upload_session_parts (upload_id, part_number, etag, size)
+                SELECT upload_id, %s, %s, %s FROM upload_sessions
+                WHERE upload_id = %s AND status = 'active'
+                ON CONFLICT (upload_id, part_number)
+                DO UPDATE SET etag = EXCLUDED.etag, size = EXCLUDED.size, uploaded_at = CURRENT_TIMESTAMP
+            """, (part_number, etag, size, upload_id))
+            recorded = cursor.rowcount > 0
+            conn.commit()
+            return recorded
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Part {part_number} of {upload_id} not recorded: {e}")
+        return False
+
+def load_upload_session(upload_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT s3_key, file_name, content_type, expected_size, part_size, status
+                FROM upload_sessions WHERE upload_id = %s
+            """, (upload_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            cursor.execute("""
+                SELECT part_number, etag, size FROM upload_session_parts
+                WHERE upload_id = %s ORDER BY part_number
+            """, (upload_id,))
+            parts = [{'PartNumber': number, 'ETag': etag, 'Size': size} for number, etag, size in cursor.fetchall()]
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Upload session {upload_id} not loaded: {e}")
+        return None
+    
+    return {
+        'uploadId': upload_id,
+        's3Key': row[0],
+        'fileName': row[1],
+        'contentType': row[2],
+        'expectedSize': row[3],
+        'partSize': row[4],
+        'status': row[5],
+        'parts': parts
+    }
+
+def upload_manifest(upload_id: str, s3_key: str, session: Optional[Dict[str, Any]], parts: list) -> Dict[str, Any]:
+    """Состояние загрузки для докачки: принятые части (из S3) и, если известен размер, недостающие номера"""
+    manifest = dict(session or {'uploadId': upload_id, 'status': 'active'})
+    manifest['s3Key'] = s3_key
+    manifest['parts'] = [{'PartNumber': p['PartNumber'], 'ETag': p['ETag'], 'Size': p['Size']} for p in parts]
+    manifest['receivedSize'] = sum(p['Size'] for p in parts)
+    if manifest.get('expectedSize') and manifest.get('partSize'):
+        received = {p['PartNumber'] for p in parts}
+        manifest['totalParts'] = -(-manifest['expectedSize'] // manifest['partSize'])
+        manifest['missingParts'] = [n for n in range(1, manifest['totalParts'] + 1) if n not in received]
+    return manifest
+
+def finish_upload_session(upload_id: str, status: str):
+    try:
+        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE upload_sessions SET status = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE upload_id = %s
+            """, (status, upload_id))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Upload session {upload_id} not marked {status}: {e}")
+
+class ChunkMissing(Exception):
+    """Чанк, нужный для сборки части, не был получен — клиент должен прислать его заново"""
+
+    def __init__(self, chunk_index: int):
+        super().__init__(f'Chunk {chunk_index} was not received')
+        self.chunk_index = chunk_index
+
+def staged_chunk_key(s3_key: str, chunk_index: int) -> str:
+    return f"temp-chunks/{s3_key}/chunk_{chunk_index:05d}"
+
+def chunk_layout_key(s3_key: str) -> str:
+    return f"temp-chunks/{s3_key}/layout.json"
+
+def save_chunk_layout(s3_client, bucket_name: str, s3_key: str, chunk_size: int, total_chunks: int) -> Dict[str, int]:
+    """
+    Раскладка чанков по частям фиксируется по первому чанку (все чанки, кроме последнего, одного размера):
+    часть S3 (кроме последней) не меньше MIN_PART_SIZE, поэтому в одну часть идут chunksPerPart подряд идущих чанков
+    """
+    layout = {
+        'chunkSize': chunk_size,
+        'chunksPerPart': max(1, -(-MIN_PART_SIZE // max(chunk_size, 1))),
+        'totalChunks': total_chunks
+    }
+    if total_chunks > 1:
+        s3_client.put_object(Bucket=bucket_name, Key=chunk_layout_key(s3_key), Body=json.dumps(layout).encode('utf-8'))
+    return layout
+
+def load_chunk_layout(s3_client, bucket_name: str, s3_key: str) -> Optional[Dict[str, int]]:
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=chunk_layout_key(s3_key))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(response['Body'].read())
+
+def chunk_part(layout: Dict[str, int], chunk_index: int):
+    """Номер части и диапазон чанков [first, last], из которых она собирается — зависит только от индекса"""
+    chunks_per_part = layout['chunksPerPart']
+    first_chunk = chunk_index // chunks_per_part * chunks_per_part
+    last_chunk = min(first_chunk + chunks_per_part, layout['totalChunks']) - 1
+    return chunk_index // chunks_per_part + 1, first_chunk, last_chunk
+
+def delete_staged_chunks(s3_client, bucket_name: str, s3_key: str):
+    """Удаляет всё из temp-chunks загрузки, включая чанки повторных отправок, уже вошедших в части"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"temp-chunks/{s3_key}/"):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': keys, 'Quiet': True})
+
+def find_multipart_upload(s3_client, bucket_name: str, s3_key: str):
+    """uploadId незавершённой загрузки по ключу — для клиентов, которые не передают uploadId"""
+    response = s3_client.list_multipart_uploads(Bucket=bucket_name, Prefix=s3_key)
+    for upload in response.get('Uploads', []):
+        if upload['Key'] == s3_key:
+            return upload['UploadId']
+    return None
+
+def list_uploaded_parts(s3_client, bucket_name: str, s3_key: str, upload_id: str) -> list:
+    parts = []
+    marker = 0
+    while True:
+        response = s3_client.list_parts(Bucket=bucket_name, Key=s3_key, UploadId=upload_id, PartNumberMarker=marker)
+        parts.extend(response.get('Parts', []))
+        if not response.get('IsTruncated'):
+            return parts
+        marker = response['NextPartNumberMarker']
+
+def upload_chunk(s3_client, bucket_name: str, s3_key: str, upload_id: str,
+                 layout: Dict[str, int], chunk_index: int, chunk_data) -> bool:
+    """
+    Кладёт чанк в multipart-загрузку. Состав части определяется только индексом чанка (chunk_part):
+    чанки, кроме последнего в своей части, лежат в temp-chunks под ключом своего индекса, и повтор перезаписывает тот же объект.
+    Последний чанк части собирает её из сохранённых чанков группы и загружает под тем же номером части,
+    поэтому повторная отправка заменяет часть, а не дописывается в следующую. Возвращает True, если загружена часть
+    """
+    part_number, first_chunk, last_chunk = chunk_part(layout, chunk_index)
+    
+    if chunk_index != last_chunk:
+        s3_client.put_object(Bucket=bucket_name, Key=staged_chunk_key(s3_key, chunk_index), Body=body_stream(chunk_data))
+        return False
+    
+    if first_chunk < chunk_index:
+        part_data = bytearray()
+        for index in range(first_chunk, chunk_index):
+            try:
+                response = s3_client.get_object(Bucket=bucket_name, Key=staged_chunk_key(s3_key, index))
+            except s3_client.exceptions.NoSuchKey:
+                # Повтор последнего чанка уже загруженной части: чанки группы удалены, часть на месте
+                if any(part['PartNumber'] == part_number for part in list_uploaded_parts(s3_client, bucket_name, s3_key, upload_id)):
+                    print(f"Part {part_number} already uploaded, duplicate chunk {chunk_index} skipped")
+                    return False
+                raise ChunkMissing(index)
+            part_data.extend(response['Body'].read())
+        part_data.extend(chunk_data)
+    else:
+        part_data = chunk_data
+    
+    s3_client.upload_part(
+        Bucket=bucket_name,
+        Key=s3_key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=body_stream(part_data) if isinstance(part_data, memoryview) else bytes(part_data)
+    )
+    
+    if first_chunk < chunk_index:
+        s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': staged_chunk_key(s3_key, index)} for index in range(first_chunk, chunk_index)], 'Quiet': True}
+        )
+    
+    print(f"Part {part_number} uploaded: {len(part_data)} bytes from chunks {first_chunk}-{chunk_index}")
+    return True
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -41,23 +390,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 file_name = params.get('fileName', 'unnamed')
                 content_type = params.get('contentType', 'application/octet-stream')
                 
-                access_key = os.environ.get('YC_S3_ACCESS_KEY_ID')
-                secret_key = os.environ.get('YC_S3_SECRET_ACCESS_KEY')
                 bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
-                
-                s3_client = boto3.client(
-                    's3',
-                    endpoint_url='https://storage.yandexcloud.net',
-                    aws_access_key_id=access_key,
-                    aws_secret_access_key=secret_key,
-                    region_name='ru-central1'
-                )
+                s3_client = get_s3_client()
                 
                 file_ext = file_name.split('.')[-1] if '.' in file_name else ''
                 unique_filename = f"{uuid.uuid4()}.{file_ext}" if file_ext else str(uuid.uuid4())
                 s3_key = f"uploads/{datetime.now().strftime('%Y/%m/%d')}/{unique_filename}"
                 
                 # Generate presigned POST (browser can upload directly to S3)
+                # Политика подписывается под точный ключ: подпись даёт право записать только этот объект
                 presigned_post = s3_client.generate_presigned_post(
                     Bucket=bucket_name,
                     Key=s3_key,
@@ -106,6 +447,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         chunk_index = None
         total_chunks = None
         existing_s3_key = None
+        existing_upload_id = None
         upload_content_type = None
         
         # Parse multipart or base64
@@ -118,24 +460,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             else:
                 body_bytes = body.encode('utf-8') if isinstance(body, str) else body
             
-            boundary = content_type.split('boundary=')[-1]
-            environ = {
-                'REQUEST_METHOD': 'POST',
-                'CONTENT_TYPE': content_type,
-                'CONTENT_LENGTH': str(len(body_bytes))
-            }
-            
-            fp = BytesIO(body_bytes)
-            form = cgi.FieldStorage(fp=fp, environ=environ, headers={'content-type': content_type})
+            form = parse_multipart(body_bytes, content_type)
             
             # Check if this is S3 multipart upload action
-            action = form.getvalue('action')
+            action = form_value(form, 'action')
             
             if action == 'upload-part':
                 # S3 multipart upload part
-                upload_id = form.getvalue('uploadId')
-                s3_key = form.getvalue('s3Key')
-                part_number = form.getvalue('partNumber')
+                upload_id = form_value(form, 'uploadId')
+                s3_key = form_value(form, 's3Key')
+                part_number = form_value(form, 'partNumber')
                 
                 if not all([upload_id, s3_key, part_number]):
                     return {
@@ -152,35 +486,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 part_item = form['part']
-                part_data = part_item.file.read()
+                part_data = part_item.data
                 
-                access_key = os.environ.get('YC_S3_ACCESS_KEY_ID')
-                secret_key = os.environ.get('YC_S3_SECRET_ACCESS_KEY')
                 bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
-                
-                s3_client = boto3.client(
-                    's3',
-                    endpoint_url='https://storage.yandexcloud.net',
-                    aws_access_key_id=access_key,
-                    aws_secret_access_key=secret_key,
-                    region_name='ru-central1'
-                )
+                s3_client = get_s3_client()
                 
                 response = s3_client.upload_part(
                     Bucket=bucket_name,
                     Key=s3_key,
                     UploadId=upload_id,
                     PartNumber=int(part_number),
-                    Body=part_data
+                    Body=body_stream(part_data)
                 )
                 
                 etag = response['ETag']
+                record_uploaded_part(upload_id, int(part_number), etag, len(part_data))
                 print(f"Part {part_number} uploaded: {len(part_data)} bytes, ETag={etag}")
                 
                 return {
                     'statusCode': 200,
                     'headers': cors_headers,
-                    'body': json.dumps({'ETag': etag})
+                    'body': json.dumps({'ETag': etag, 'PartNumber': int(part_number)})
                 }
             
             # Regular file upload
@@ -192,14 +518,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             file_item = form['file']
-            file_data = file_item.file.read()
-            file_name = form.getvalue('fileName', file_item.filename)
+            file_data = file_item.data
+            file_name = form_value(form, 'fileName', file_item.filename)
             
             # Check for chunked upload parameters in multipart
-            chunk_index = form.getvalue('chunkIndex')
-            total_chunks = form.getvalue('totalChunks')
-            existing_s3_key = form.getvalue('s3Key')
-            upload_content_type = form.getvalue('contentType', 'application/octet-stream')
+            chunk_index = form_value(form, 'chunkIndex')
+            total_chunks = form_value(form, 'totalChunks')
+            existing_s3_key = form_value(form, 's3Key')
+            existing_upload_id = form_value(form, 'uploadId')
+            upload_content_type = form_value(form, 'contentType', 'application/octet-stream')
             
             if chunk_index is not None:
                 chunk_index = int(chunk_index)
@@ -215,18 +542,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if action == 'init-multipart':
                 file_name = body_data.get('fileName', 'unnamed')
                 upload_content_type = body_data.get('contentType', 'application/octet-stream')
+                expected_size = body_data.get('fileSize')
+                part_size = body_data.get('partSize') or (MIN_PART_SIZE if expected_size else None)
+                
+                if expected_size and part_size:
+                    if part_size < MIN_PART_SIZE and part_size < expected_size:
+                        return {
+                            'statusCode': 400,
+                            'headers': cors_headers,
+                            'body': json.dumps({'error': f'partSize must be at least {MIN_PART_SIZE} bytes'})
+                        }
+                    # S3 принимает не больше 10000 частей
+                    part_size = max(part_size, -(-expected_size // 10000))
                 
-                access_key = os.environ.get('YC_S3_ACCESS_KEY_ID')
-                secret_key = os.environ.get('YC_S3_SECRET_ACCESS_KEY')
                 bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
-                
-                s3_client = boto3.client(
-                    's3',
-                    endpoint_url='https://storage.yandexcloud.net',
-                    aws_access_key_id=access_key,
-                    aws_secret_access_key=secret_key,
-                    region_name='ru-central1'
-                )
+                s3_client = get_s3_client()
                 
                 file_ext = file_name.split('.')[-1] if '.' in file_name else ''
                 unique_filename = f"{uuid.uuid4()}.{file_ext}" if file_ext else str(uuid.uuid4())
@@ -239,6 +569,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 )
                 
                 upload_id = response['UploadId']
+                create_upload_session(upload_id, s3_key, file_name, upload_content_type, expected_size, part_size)
                 file_url = f"https://storage.yandexcloud.net/{bucket_name}/{s3_key}"
                 
                 print(f"Multipart upload initialized: {upload_id} for {s3_key}")
@@ -249,10 +580,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({
                         'uploadId': upload_id,
                         's3Key': s3_key,
-                        'url': file_url
+                        'url': file_url,
+                        'partSize': part_size,
+                        'totalParts': -(-expected_size // part_size) if expected_size and part_size else None
                     })
                 }
             
+            elif action == 'list-parts':
+                # Возобновление: какие части уже приняты и какие нужно дослать.
+                # Части берутся из S3 — манифест в БД мог не записаться; сессия даёт ожидаемый размер
+                upload_id = body_data.get('uploadId')
+                session = load_upload_session(upload_id) if upload_id else None
+                s3_key = body_data.get('s3Key') or (session['s3Key'] if session else None)
+                
+                if not upload_id or not s3_key:
+                    return {
+                        'statusCode': 404,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Upload session not found, pass uploadId and s3Key'})
+                    }
+                
+                parts = list_uploaded_parts(get_s3_client(), os.environ.get('YC_S3_BUCKET_NAME'), s3_key, upload_id)
+                
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps(upload_manifest(upload_id, s3_key, session, parts))
+                }
+            
             elif action == 'upload-part':
                 upload_id = body_data.get('uploadId')
                 s3_key = body_data.get('s3Key')
@@ -266,17 +621,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Missing upload-part parameters'})
                     }
                 
-                access_key = os.environ.get('YC_S3_ACCESS_KEY_ID')
-                secret_key = os.environ.get('YC_S3_SECRET_ACCESS_KEY')
                 bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
-                
-                s3_client = boto3.client(
-                    's3',
-                    endpoint_url='https://storage.yandexcloud.net',
-                    aws_access_key_id=access_key,
-                    aws_secret_access_key=secret_key,
-                    region_name='ru-central1'
-                )
+                s3_client = get_s3_client()
                 
                 part_data = base64.b64decode(part_data_b64)
                 
@@ -284,23 +630,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     Bucket=bucket_name,
                     Key=s3_key,
                     UploadId=upload_id,
-                    PartNumber=part_number,
+                    PartNumber=int(part_number),
                     Body=part_data
                 )
                 
                 etag = response['ETag']
+                record_uploaded_part(upload_id, int(part_number), etag, len(part_data))
                 print(f"Part {part_number} uploaded: {len(part_data)} bytes, ETag={etag}")
                 
                 return {
                     'statusCode': 200,
                     'headers': cors_headers,
-                    'body': json.dumps({'ETag': etag})
+                    'body': json.dumps({'ETag': etag, 'PartNumber': int(part_number)})
                 }
             
             elif action == 'complete-multipart':
                 upload_id = body_data.get('uploadId')
                 s3_key = body_data.get('s3Key')
                 parts = body_data.get('parts', [])
+                session = load_upload_session(upload_id) if upload_id else None
+                s3_key = s3_key or (session['s3Key'] if session else None)
+                manifest = None
+                
+                # Без списка частей от клиента собираем по частям, которые есть в S3
+                if upload_id and s3_key and not parts:
+                    manifest = upload_manifest(upload_id, s3_key, session,
+                                               list_uploaded_parts(get_s3_client(), os.environ.get('YC_S3_BUCKET_NAME'), s3_key, upload_id))
+                    if manifest.get('missingParts'):
+                        return {
+                            'statusCode': 409,
+                            'headers': cors_headers,
+                            'body': json.dumps({'error': 'Upload is incomplete', 'missingParts': manifest['missingParts']})
+                        }
+                    parts = [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in manifest['parts']]
                 
                 if not all([upload_id, s3_key, parts]):
                     return {
@@ -309,17 +671,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'Missing complete-multipart parameters'})
                     }
                 
-                access_key = os.environ.get('YC_S3_ACCESS_KEY_ID')
-                secret_key = os.environ.get('YC_S3_SECRET_ACCESS_KEY')
                 bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
-                
-                s3_client = boto3.client(
-                    's3',
-                    endpoint_url='https://storage.yandexcloud.net',
-                    aws_access_key_id=access_key,
-                    aws_secret_access_key=secret_key,
-                    region_name='ru-central1'
-                )
+                s3_client = get_s3_client()
                 
                 s3_client.complete_multipart_upload(
                     Bucket=bucket_name,
@@ -328,13 +681,46 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     MultipartUpload={'Parts': parts}
                 )
                 
+                if session:
+                    finish_upload_session(upload_id, 'completed')
+                
                 file_url = f"https://storage.yandexcloud.net/{bucket_name}/{s3_key}"
                 print(f"Multipart upload completed: {file_url}")
                 
+                result = {'url': file_url, 's3Key': s3_key}
+                if manifest:
+                    result['fileSize'] = manifest['receivedSize']
+                
+                return {
+                    'statusCode': 200,
+                    'headers': cors_headers,
+                    'body': json.dumps(result)
+                }
+            
+            elif action == 'abort-multipart':
+                upload_id = body_data.get('uploadId')
+                session = load_upload_session(upload_id) if upload_id else None
+                s3_key = body_data.get('s3Key') or (session['s3Key'] if session else None)
+                
+                if not all([upload_id, s3_key]):
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Missing abort-multipart parameters'})
+                    }
+                
+                get_s3_client().abort_multipart_upload(
+                    Bucket=os.environ.get('YC_S3_BUCKET_NAME'),
+                    Key=s3_key,
+                    UploadId=upload_id
+                )
+                if session:
+                    finish_upload_session(upload_id, 'aborted')
+                
                 return {
                     'statusCode': 200,
                     'headers': cors_headers,
-                    'body': json.dumps({'url': file_url, 's3Key': s3_key})
+                    'body': json.dumps({'uploadId': upload_id, 'status': 'aborted'})
                 }
             
             # Legacy: JSON with base64 file data
@@ -351,6 +737,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             chunk_index = body_data.get('chunkIndex')
             total_chunks = body_data.get('totalChunks')
             existing_s3_key = body_data.get('s3Key')
+            existing_upload_id = body_data.get('uploadId')
             upload_content_type = body_data.get('contentType', 'application/octet-stream')
             
             if ',' in file_b64:
@@ -359,84 +746,116 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             file_data = base64.b64decode(file_b64)
         
         # S3 setup
-        access_key = os.environ.get('YC_S3_ACCESS_KEY_ID')
-        secret_key = os.environ.get('YC_S3_SECRET_ACCESS_KEY')
         bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
+        s3_client = get_s3_client()
         
-        s3_client = boto3.client(
-            's3',
-            endpoint_url='https://storage.yandexcloud.net',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name='ru-central1'
-        )
-        
-        # Handle chunked upload
+        # Handle chunked upload: чанки сразу уходят в S3 multipart, последний запрос только завершает загрузку
         if chunk_index is not None and total_chunks is not None:
-            # First chunk: create S3 key
             if chunk_index == 0:
                 file_ext = file_name.split('.')[-1] if '.' in file_name else ''
                 unique_filename = f"{uuid.uuid4()}.{file_ext}" if file_ext else str(uuid.uuid4())
                 s3_key = f"uploads/{datetime.now().strftime('%Y/%m/%d')}/{unique_filename}"
+                upload_id = s3_client.create_multipart_upload(
+                    Bucket=bucket_name,
+                    Key=s3_key,
+                    ContentType=upload_content_type
+                )['UploadId']
             else:
                 s3_key = existing_s3_key
+                upload_id = existing_upload_id or find_multipart_upload(s3_client, bucket_name, s3_key)
+                if not upload_id:
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Multipart upload not found for s3Key'})
+                    }
             
-            # Store chunk in temp location
-            temp_key = f"temp-chunks/{s3_key}/chunk_{chunk_index}"
-            s3_client.put_object(
-                Bucket=bucket_name,
-                Key=temp_key,
-                Body=file_data
-            )
+            if chunk_index == 0:
+                layout = save_chunk_layout(s3_client, bucket_name, s3_key, len(file_data), total_chunks)
+            else:
+                layout = load_chunk_layout(s3_client, bucket_name, s3_key)
+                if not layout or layout['totalChunks'] != total_chunks:
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Chunk layout not found for s3Key, restart the upload'})
+                    }
             
-            print(f"Chunk {chunk_index + 1}/{total_chunks} stored: {len(file_data)} bytes")
+            is_last = chunk_index == total_chunks - 1
             
-            # Last chunk: assemble file
-            if chunk_index == total_chunks - 1:
-                print(f"Assembling {total_chunks} chunks into {s3_key}")
-                
-                assembled_data = bytearray()
-                for i in range(total_chunks):
-                    chunk_key = f"temp-chunks/{s3_key}/chunk_{i}"
-                    chunk_obj = s3_client.get_object(Bucket=bucket_name, Key=chunk_key)
-                    assembled_data.extend(chunk_obj['Body'].read())
-                
-                # Upload final file
-                s3_client.put_object(
-                    Bucket=bucket_name,
-                    Key=s3_key,
-                    Body=bytes(assembled_data),
-                    ContentType=upload_content_type
-                )
-                
-                # Cleanup temp chunks
-                for i in range(total_chunks):
-                    s3_client.delete_object(Bucket=bucket_name, Key=f"temp-chunks/{s3_key}/chunk_{i}")
-                
-                file_url = f"https://storage.yandexcloud.net/{bucket_name}/{s3_key}"
-                print(f"Chunked upload complete: {file_url}, size: {len(assembled_data)} bytes")
+            if not is_last:
+                try:
+                    upload_chunk(s3_client, bucket_name, s3_key, upload_id, layout, chunk_index, file_data)
+                except ChunkMissing as e:
+                    return {
+                        'statusCode': 409,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': str(e), 'missingChunk': e.chunk_index, 's3Key': s3_key, 'uploadId': upload_id})
+                    }
                 
-                return {
-                    'statusCode': 200,
-                    'headers': cors_headers,
-                    'body': json.dumps({
-                        'url': file_url,
-                        's3Key': s3_key,
-                        'fileName': file_name,
-                        'fileSize': len(assembled_data)
-                    })
-                }
-            else:
-                # Return partial response
+                print(f"Chunk {chunk_index + 1}/{total_chunks} accepted: {len(file_data)} bytes")
                 return {
                     'statusCode': 200,
                     'headers': cors_headers,
                     'body': json.dumps({
                         's3Key': s3_key,
+                        'uploadId': upload_id,
                         'chunkIndex': chunk_index,
                         'status': 'partial'
                     })
                 }
+            
+            # Последний чанк: загрузка последней части, проверка комплекта частей и сборка.
+            # Любой сбой на этом пути отменяет multipart-загрузку и чистит temp-chunks, чтобы не оставлять сирот
+            try:
+                upload_chunk(s3_client, bucket_name, s3_key, upload_id, layout, chunk_index, file_data)
+                parts = list_uploaded_parts(s3_client, bucket_name, s3_key, upload_id)
+                expected_parts = chunk_part(layout, chunk_index)[0]
+                received_parts = {p['PartNumber'] for p in parts}
+                for part_number in range(1, expected_parts + 1):
+                    if part_number not in received_parts:
+                        raise ChunkMissing((part_number - 1) * layout['chunksPerPart'])
+                
+                s3_client.complete_multipart_upload(
+                    Bucket=bucket_name,
+                    Key=s3_key,
+                    UploadId=upload_id,
+                    MultipartUpload={'Parts': [{'PartNumber': p['PartNumber'], 'ETag': p['ETag']} for p in parts]}
+                )
+            except Exception as e:
+                print(f"Chunked upload failed, aborting {upload_id}: {e}")
+                try:
+                    s3_client.abort_multipart_upload(Bucket=bucket_name, Key=s3_key, UploadId=upload_id)
+                finally:
+                    delete_staged_chunks(s3_client, bucket_name, s3_key)
+                if isinstance(e, ChunkMissing):
+                    return {
+                        'statusCode': 409,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': f'{e}, upload aborted', 'missingChunk': e.chunk_index, 'restart': True})
+                    }
+                raise
+            
+            try:
+                delete_staged_chunks(s3_client, bucket_name, s3_key)
+            except Exception as e:
+                # Файл уже собран: сбой очистки temp-chunks на результат не влияет, только логируем
+                print(f"Staged chunks cleanup failed for {s3_key}: {e}")
+            
+            file_size = sum(p['Size'] for p in parts)
+            file_url = f"https://storage.yandexcloud.net/{bucket_name}/{s3_key}"
+            print(f"Chunked upload complete: {file_url}, {len(parts)} parts, size: {file_size} bytes")
+            
+            return {
+                'statusCode': 200,
+                'headers': cors_headers,
+                'body': json.dumps({
+                    'url': file_url,
+                    's3Key': s3_key,
+                    'fileName': file_name,
+                    'fileSize': file_size
+                })
+            }
         
         # Single file upload (no chunking)
         file_ext = file_name.split('.')[-1] if '.' in file_name else ''
@@ -461,7 +880,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         s3_client.put_object(
             Bucket=bucket_name,
             Key=s3_key,
-            Body=file_data,
+            Body=body_stream(file_data),
             ContentType=upload_content_type
         )
         
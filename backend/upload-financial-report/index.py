@@ -1,110 +1,233 @@
 import json
 import os
 import psycopg2
-from typing import Dict, Any, List
-import openpyxl
-from io import BytesIO
+from typing import Dict, Any
 import base64
+import urllib.request
+import uuid
+import select
+import hashlib
+import time
+from datetime import datetime
+import boto3
 
-def normalize_string(s: str) -> str:
-    """Нормализует строку для сравнения: убирает пробелы, спецсимволы, приводит к lowercase"""
-    if not s:
-        return ""
-    s = s.strip().lower()
-    s = s.replace('«', '').replace('»', '').replace('"', '').replace('"', '')
-    s = s.replace('(', '').replace(')', '').replace('[', '').replace(']', '')
-    s = ' '.join(s.split())
-    return s
+LONG_POLL_SECONDS = 25
+# Запас до таймаута функции, чтобы long-poll успел ответить сам
+LONG_POLL_MARGIN_SECONDS = 3
+PROGRESS_CHANNEL = 'financial_job_progress'
 
-def load_all_releases(cursor) -> Dict[str, tuple]:
+JOB_PROGRESS_SELECT = """
+    SELECT j.id, j.period, j.filename, COALESCE(p.status, j.status),
+           COALESCE(p.total_rows, j.total_rows), COALESCE(p.processed_rows, j.processed_rows),
+           COALESCE(p.matched_count, j.matched_count), j.error_message,
+           j.created_at, j.started_at, j.completed_at,
+           COALESCE(p.total_chunks, j.total_chunks), COALESCE(p.completed_chunks, j.completed_chunks),
+           COALESCE(p.version, 0), j.duplicate_rows
+    FROM financial_upload_jobs j
+    LEFT JOIN financial_job_progress p ON p.job_id = j.id
+"""
+
+def parse_long_poll_params(params: dict, context: Any):
     """
-    Загружает все релизы из БД один раз.
-    Возвращает словарь: {normalized_key: (user_id, release_id, artist_name)}
+    since и wait из query string. wait ограничен LONG_POLL_SECONDS и оставшимся временем вызова функции.
+    ValueError — некорректные параметры (ответ 400)
     """
-    cursor.execute("""
-        SELECT r.id, r.artist_id, r.artist_name, r.release_name
-        FROM releases r
-    """)
-    
-    releases_map = {}
-    for row in cursor.fetchall():
-        release_id, artist_id, artist_name, release_name = row
-        
-        normalized_artist = normalize_string(artist_name or "")
-        normalized_album = normalize_string(release_name or "")
-        
-        if normalized_artist and normalized_album:
-            key = f"{normalized_artist}||{normalized_album}"
-            releases_map[key] = (artist_id, release_id, artist_name)
+    try:
+        since = int(params['since'])
+        wait_seconds = float(params.get('wait') or LONG_POLL_SECONDS)
+    except (TypeError, ValueError):
+        raise ValueError('since must be an integer and wait a number of seconds')
+    if since < 0 or wait_seconds != wait_seconds:
+        raise ValueError('since must be an integer and wait a number of seconds')
     
-    print(f"[INIT] Loaded {len(releases_map)} releases into memory")
-    return releases_map
+    limit = LONG_POLL_SECONDS
+    remaining_ms = getattr(context, 'get_remaining_time_in_millis', None)
+    if callable(remaining_ms):
+        limit = min(limit, remaining_ms() / 1000 - LONG_POLL_MARGIN_SECONDS)
+    return since, min(max(wait_seconds, 0), max(limit, 0))
 
-def match_report_to_releases(artist_name: str, album_name: str, releases_map: Dict[str, tuple], debug_mode: bool = False) -> tuple:
+def job_row_to_dict(row) -> dict:
+    processed_rows = row[5] or 0
+    matched_count = row[6] or 0
+    return {
+        'id': row[0],
+        'period': row[1],
+        'filename': row[2],
+        'status': row[3],
+        'total_rows': row[4],
+        'processed_rows': processed_rows,
+        'matched_count': matched_count,
+        'unmatched_count': processed_rows - matched_count,
+        'error_message': row[7],
+        'created_at': row[8].isoformat() if row[8] else None,
+        'started_at': row[9].isoformat() if row[9] else None,
+        'completed_at': row[10].isoformat() if row[10] else None,
+        'total_chunks': row[11],
+        'completed_chunks': row[12],
+        'progress': round((row[12] / row[11] * 100) if row[11] and row[11] > 0 else 0, 1),
+        'version': row[13],
+        'duplicate_rows': row[14] or 0
+    }
+
+def wait_for_progress(conn, cursor, user_id: str, since: int, wait_seconds: float):
     """
-    Ищет совпадение в загруженном словаре релизов.
-    Возвращает (user_id, release_id) или (None, None)
+    Long-poll: возвращает задачи пользователя, изменившиеся после версии since.
+    Если изменений нет — ждёт NOTIFY от воркера (не дольше wait_seconds), без повторных опросов таблицы.
+    Возвращает (задачи, последняя версия); при таймауте задач нет, версия остаётся since
     """
-    normalized_artist = normalize_string(artist_name)
-    normalized_album = normalize_string(album_name)
-    
-    if not normalized_artist or not normalized_album:
-        return (None, None)
-    
-    key = f"{normalized_artist}||{normalized_album}"
-    
-    if debug_mode:
-        print(f"[MATCH] Looking for key: '{key}'")
+    cursor.execute(f"LISTEN {PROGRESS_CHANNEL}")
+    deadline = time.monotonic() + wait_seconds
     
-    if key in releases_map:
-        user_id, release_id, _ = releases_map[key]
-        if debug_mode:
-            print(f"[MATCH] ✅ FOUND! user_id={user_id}, release_id={release_id}")
-        return (user_id, release_id)
-    
-    if debug_mode:
-        print(f"[MATCH] ❌ NOT FOUND")
-    return (None, None)
+    while True:
+        cursor.execute(f"""
+            {JOB_PROGRESS_SELECT}
+            WHERE p.uploaded_by = %s AND p.version > %s
+            ORDER BY p.version
+        """, (user_id, since))
+        jobs = [job_row_to_dict(row) for row in cursor.fetchall()]
+        if jobs:
+            return jobs, max(job['version'] for job in jobs)
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return [], since
+        
+        if select.select([conn], [], [], remaining) == ([], [], []):
+            return [], since
+        conn.poll()
+        conn.notifies.clear()
 
-def count_file_rows(file_bytes: bytes) -> int:
-    """Подсчитывает количество строк в Excel файле"""
-    workbook = openpyxl.load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
-    sheet = workbook.active
-    total_rows = 0
-    for row in sheet.iter_rows(min_row=2, values_only=True):
-        if row and len(row) >= 14 and row[6]:
-            total_rows += 1
-    return total_rows
+_s3_client = None
 
-def create_job_chunks(job_id: int, total_rows: int, chunk_size: int, cursor, conn):
-    """Создаёт чанки для обработки файла"""
-    total_chunks = (total_rows + chunk_size - 1) // chunk_size
-    
-    for chunk_num in range(total_chunks):
-        start_row = chunk_num * chunk_size + 2
-        end_row = min((chunk_num + 1) * chunk_size + 1, total_rows + 1)
-        
-        cursor.execute("""
-            INSERT INTO job_chunks 
-            (job_id, chunk_number, start_row, end_row, status)
-            VALUES (%s, %s, %s, %s, 'pending')
-        """, (job_id, chunk_num, start_row, end_row))
+def get_s3_client():
+    """S3-клиент создаётся один раз на экземпляр функции"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url='https://storage.yandexcloud.net',
+            aws_access_key_id=os.environ.get('YC_S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('YC_S3_SECRET_ACCESS_KEY'),
+            region_name='ru-central1'
+        )
+    return _s3_client
+
+def file_sha256(file_bytes: bytes) -> str:
+    """SHA-256 файла блоками по 1 МБ, без копирования буфера"""
+    digest = hashlib.sha256()
+    view = memoryview(file_bytes)
+    for offset in range(0, len(view), 1 << 20):
+        digest.update(view[offset:offset + (1 << 20)])
+    return digest.hexdigest()
+
+def duplicate_response(job_id) -> Dict[str, Any]:
+    return {
+        'statusCode': 409,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Этот файл уже был загружен', 'job_id': job_id}, ensure_ascii=False)
+    }
+
+# Клиент может сослаться только на файлы из этих папок бакета; после планирования воркер удаляет
+# лишь файлы, сохранённые самим обработчиком (file_owned), а не переданные через fileKey
+ALLOWED_FILE_KEY_PREFIXES = ('financial-reports/', 'uploads/')
+
+def is_allowed_file_key(file_key) -> bool:
+    return (
+        isinstance(file_key, str)
+        and file_key.startswith(ALLOWED_FILE_KEY_PREFIXES)
+        and '..' not in file_key.split('/')
+        and '//' not in file_key
+    )
+
+def delete_report_file(file_key: str):
+    try:
+        get_s3_client().delete_object(Bucket=os.environ.get('YC_S3_BUCKET_NAME'), Key=file_key)
+    except Exception as e:
+        print(f"[UPLOAD] Failed to delete {file_key}: {e}")
+
+def store_report_file(file_bytes: bytes, filename: str) -> str:
+    """Кладёт файл отчёта в бакет, в БД хранится только ключ"""
+    file_ext = filename.split('.')[-1] if '.' in filename else 'xlsx'
+    s3_key = f"financial-reports/{datetime.now().strftime('%Y/%m/%d')}/{uuid.uuid4()}.{file_ext}"
     
+    get_s3_client().put_object(
+        Bucket=os.environ.get('YC_S3_BUCKET_NAME'),
+        Key=s3_key,
+        Body=file_bytes,
+        ContentType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    print(f"[UPLOAD] Stored {len(file_bytes)} bytes as {s3_key}")
+    return s3_key
+
+REVIEW_PAGE_SIZE = 100
+REVIEW_ACTIONS = ('confirm-matches', 'reject-matches')
+APPROVE_HISTORY_ACTION = 'approve-rematch-history'
+
+def is_director(cursor, user_id) -> bool:
+    cursor.execute("SELECT role FROM users WHERE id = %s", (user_id,))
+    user = cursor.fetchone()
+    return bool(user) and user[0] == 'director'
+
+def list_review_rows(cursor, after_id: int) -> list:
+    """Строки с неточным совпадением (needs_review), ожидающие решения администратора, по возрастанию id"""
     cursor.execute("""
-        UPDATE financial_upload_jobs
-        SET total_chunks = %s, chunk_size = %s
-        WHERE id = %s
-    """, (total_chunks, chunk_size, job_id))
-    
-    conn.commit()
-    print(f"[UPLOAD] Created {total_chunks} chunks for job {job_id}")
-    return total_chunks
+        SELECT f.id, f.period, f.artist_name, f.album_name, f.amount, f.user_id, f.release_id,
+               f.match_confidence, r.artist_name, r.release_name
+        FROM financial_reports f
+        LEFT JOIN releases r ON r.id = f.release_id
+        WHERE f.status = 'needs_review' AND f.id > %s
+        ORDER BY f.id
+        LIMIT %s
+    """, (after_id, REVIEW_PAGE_SIZE))
+    return [
+        {
+            'id': row[0],
+            'period': row[1],
+            'artist_name': row[2],
+            'album_name': row[3],
+            'amount': float(row[4]),
+            'suggested_user_id': row[5],
+            'suggested_release_id': row[6],
+            'match_confidence': row[7],
+            'release_artist_name': row[8],
+            'release_name': row[9]
+        }
+        for row in cursor.fetchall()
+    ]
+
+def apply_review_decision(cursor, action: str, ids: list) -> int:
+    """
+    confirm-matches — строки переходят в confirmed, воркер начислит их задачей kind='review';
+    reject-matches — подсказка снимается, строка снова ждёт релиза по match_key
+    """
+    if action == 'confirm-matches':
+        cursor.execute("""
+            UPDATE financial_reports SET status = 'confirmed'
+            WHERE id = ANY(%s) AND status = 'needs_review'
+        """, (ids,))
+    else:
+        cursor.execute("""
+            UPDATE financial_reports
+            SET status = 'pending', user_id = NULL, release_id = NULL, match_confidence = NULL
+            WHERE id = ANY(%s) AND status = 'needs_review'
+        """, (ids,))
+    return cursor.rowcount
+
+def trigger_worker():
+    """Будит воркер обработки, не дожидаясь ответа — планирование идёт уже в нём"""
+    worker_url = os.environ.get('WORKER_URL')
+    if not worker_url:
+        return
+    try:
+        urllib.request.urlopen(urllib.request.Request(worker_url, method='GET'), timeout=1)
+    except Exception as e:
+        print(f"[UPLOAD] Worker trigger sent: {str(e)}")
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Business: Загрузка финансового отчёта (асинхронная)
-    Args: event с httpMethod, body (base64 Excel file), queryStringParameters (period, adminUserId)
-    Returns: HTTP 202 - файл принят в обработку
+    Args: event с httpMethod, queryStringParameters GET (since, wait — long-poll прогресса; review, after — строки на проверку), body POST (base64 Excel file или fileKey уже загруженного в бакет файла, period, adminUserId; либо action=confirm-matches/reject-matches, ids; либо action=approve-rematch-history)
+    Returns: HTTP 202 - файл принят в обработку, 409 - этот файл уже загружен, 200 - решение по строкам на проверку
     """
     method = event.get('httpMethod', 'GET')
     
@@ -132,39 +255,69 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps({'error': 'X-User-Id required'})
                 }
             
+            params = event.get('queryStringParameters') or {}
+            
+            if params.get('review'):
+                try:
+                    after_id = int(params.get('after') or 0)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'after must be an integer'})
+                    }
+                
+                conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+                cursor = conn.cursor()
+                try:
+                    if not is_director(cursor, user_id):
+                        return {
+                            'statusCode': 403,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Access denied'})
+                        }
+                    rows = list_review_rows(cursor, after_id)
+                finally:
+                    cursor.close()
+                    conn.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'rows': rows,
+                        'next_after': rows[-1]['id'] if len(rows) == REVIEW_PAGE_SIZE else None
+                    }, ensure_ascii=False)
+                }
+            
+            long_poll = params.get('since') is not None
+            if long_poll:
+                try:
+                    since, wait_seconds = parse_long_poll_params(params, context)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': str(e)})
+                    }
+            
             dsn = os.environ.get('DATABASE_URL')
             conn = psycopg2.connect(dsn)
+            conn.autocommit = True
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT id, period, filename, status, total_rows, processed_rows, 
-                       matched_count, unmatched_count, error_message, 
-                       created_at, started_at, completed_at, total_chunks, completed_chunks
-                FROM financial_upload_jobs
-                WHERE uploaded_by = %s
-                ORDER BY created_at DESC
-                LIMIT 20
-            """, (user_id,))
-            
-            jobs = []
-            for row in cursor.fetchall():
-                jobs.append({
-                    'id': row[0],
-                    'period': row[1],
-                    'filename': row[2],
-                    'status': row[3],
-                    'total_rows': row[4],
-                    'processed_rows': row[5],
-                    'matched_count': row[6],
-                    'unmatched_count': row[7],
-                    'error_message': row[8],
-                    'created_at': row[9].isoformat() if row[9] else None,
-                    'started_at': row[10].isoformat() if row[10] else None,
-                    'completed_at': row[11].isoformat() if row[11] else None,
-                    'total_chunks': row[12],
-                    'completed_chunks': row[13],
-                    'progress': round((row[13] / row[12] * 100) if row[12] and row[12] > 0 else 0, 1)
-                })
+            if long_poll:
+                jobs, version = wait_for_progress(conn, cursor, user_id, since, wait_seconds)
+            else:
+                cursor.execute(f"""
+                    {JOB_PROGRESS_SELECT}
+                    WHERE j.uploaded_by = %s
+                    ORDER BY j.created_at DESC
+                    LIMIT 20
+                """, (user_id,))
+                jobs = [job_row_to_dict(row) for row in cursor.fetchall()]
+                cursor.execute("SELECT COALESCE(MAX(version), 0) FROM financial_job_progress WHERE uploaded_by = %s", (user_id,))
+                version = cursor.fetchone()[0]
             
             cursor.close()
             conn.close()
@@ -172,7 +325,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'jobs': jobs})
+                'body': json.dumps({'jobs': jobs, 'version': version})
             }
             
         except Exception as e:
@@ -186,46 +339,174 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         conn = None
         cursor = None
         job_id = None
+        stored_file_key = None
+        job_committed = False
         
         try:
             body_data = json.loads(event.get('body', '{}'))
+            
+            action = body_data.get('action')
+            if action == APPROVE_HISTORY_ACTION:
+                headers = event.get('headers', {})
+                reviewer_id = headers.get('X-User-Id') or headers.get('x-user-id')
+                if not reviewer_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'X-User-Id required'})
+                    }
+                
+                conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+                cursor = conn.cursor()
+                if not is_director(cursor, reviewer_id):
+                    cursor.close()
+                    conn.close()
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Access denied'})
+                    }
+                # Разовое изменение балансов за прошлые периоды: воркер проходит историческое окно только после этого
+                cursor.execute("""
+                    UPDATE release_rematch_state
+                    SET history_approved_at = NOW(), history_approved_by = %s, updated_at = NOW()
+                    WHERE id = 1 AND history_approved_at IS NULL AND history_cursor < history_through
+                    RETURNING history_through - history_cursor
+                """, (reviewer_id,))
+                approved = cursor.fetchone()
+                conn.commit()
+                cursor.close()
+                conn.close()
+                
+                if approved:
+                    print(f"[REMATCH] Historic rematch of {approved[0]} release changes approved by user {reviewer_id}")
+                    trigger_worker()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True, 'approved': approved is not None})
+                }
+            
+            if action in REVIEW_ACTIONS:
+                headers = event.get('headers', {})
+                reviewer_id = headers.get('X-User-Id') or headers.get('x-user-id')
+                ids = body_data.get('ids')
+                if not reviewer_id:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'X-User-Id required'})
+                    }
+                if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'ids must be a non-empty list of integers'})
+                    }
+                
+                conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+                cursor = conn.cursor()
+                if not is_director(cursor, reviewer_id):
+                    cursor.close()
+                    conn.close()
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Access denied'})
+                    }
+                updated = apply_review_decision(cursor, action, ids)
+                conn.commit()
+                cursor.close()
+                conn.close()
+                
+                print(f"[REVIEW] {action}: {updated} rows by user {reviewer_id}")
+                if action == 'confirm-matches' and updated:
+                    trigger_worker()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True, 'updated': updated})
+                }
+            
             file_base64 = body_data.get('file')
+            file_key = body_data.get('fileKey')
             period = body_data.get('period')
             admin_user_id = body_data.get('adminUserId')
             filename = body_data.get('filename', 'report.xlsx')
             
-            if not file_base64 or not period or not admin_user_id:
+            if not (file_base64 or file_key) or not period or not admin_user_id:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Missing required fields: file (or fileKey), period, adminUserId'})
+                }
+            
+            if file_key and not is_allowed_file_key(file_key):
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing required fields: file, period, adminUserId'})
+                    'body': json.dumps({'error': f'fileKey must be inside {", ".join(ALLOWED_FILE_KEY_PREFIXES)}'})
                 }
             
-            file_bytes = base64.b64decode(file_base64)
+            content_sha256 = None
+            file_bytes = None
+            if not file_key:
+                file_bytes = base64.b64decode(file_base64)
+                content_sha256 = file_sha256(file_bytes)
             
             dsn = os.environ.get('DATABASE_URL')
             conn = psycopg2.connect(dsn)
             cursor = conn.cursor()
             
-            total_rows = count_file_rows(file_bytes)
-            print(f"[UPLOAD] File has {total_rows} rows")
+            if content_sha256:
+                cursor.execute("""
+                    SELECT id FROM financial_upload_jobs
+                    WHERE content_sha256 = %s AND status <> 'failed'
+                """, (content_sha256,))
+                duplicate = cursor.fetchone()
+                if duplicate:
+                    cursor.close()
+                    conn.close()
+                    print(f"[UPLOAD] Rejected duplicate of job {duplicate[0]}")
+                    return duplicate_response(duplicate[0])
+                
+                file_key = store_report_file(file_bytes, filename)
+                stored_file_key = file_key
             
             cursor.execute("""
                 INSERT INTO financial_upload_jobs 
-                (uploaded_by, period, filename, status, file_data, total_rows)
-                VALUES (%s, %s, %s, 'pending', %s, %s)
+                (uploaded_by, period, filename, status, file_key, chunk_size, content_sha256, file_owned)
+                VALUES (%s, %s, %s, 'pending', %s, %s, %s, %s)
+                ON CONFLICT (content_sha256) WHERE content_sha256 IS NOT NULL AND status <> 'failed'
+                DO NOTHING
                 RETURNING id
-            """, (admin_user_id, period, filename, psycopg2.Binary(file_bytes), total_rows))
-            job_id = cursor.fetchone()[0]
-            conn.commit()
+            """, (admin_user_id, period, filename, file_key, 1000, content_sha256, stored_file_key is not None))
+            inserted = cursor.fetchone()
             
-            chunk_size = 1000
-            total_chunks = create_job_chunks(job_id, total_rows, chunk_size, cursor, conn)
+            if inserted is None:
+                conn.rollback()
+                cursor.close()
+                conn.close()
+                if stored_file_key:
+                    delete_report_file(stored_file_key)
+                return duplicate_response(None)
+            job_id = inserted[0]
+            
+            cursor.execute("""
+                INSERT INTO financial_job_progress (job_id, uploaded_by, status)
+                VALUES (%s, %s, 'pending')
+            """, (job_id, admin_user_id))
+            cursor.execute("SELECT pg_notify(%s, %s)", (PROGRESS_CHANNEL, str(job_id)))
+            conn.commit()
+            job_committed = True
             
             cursor.close()
             conn.close()
             
-            print(f"[UPLOAD] Created job {job_id} with {total_chunks} chunks")
+            print(f"[UPLOAD] Created job {job_id} for {file_key}, planning deferred to worker")
+            trigger_worker()
             
             return {
                 'statusCode': 202,
@@ -233,10 +514,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({
                     'success': True,
                     'job_id': job_id,
-                    'message': f'File queued for processing ({total_chunks} chunks)',
-                    'period': period,
-                    'total_rows': total_rows,
-                    'total_chunks': total_chunks
+                    'message': 'File queued for processing',
+                    'period': period
                 })
             }
             
@@ -244,6 +523,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             error_msg = str(e)
             print(f"[ERROR] Upload failed: {error_msg}")
             
+            # Задача не записалась — загруженный нами файл больше никто не заберёт
+            if stored_file_key and not job_committed:
+                delete_report_file(stored_file_key)
+            
             if job_id and cursor and conn:
                 try:
                     cursor.execute("""
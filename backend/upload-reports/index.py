@@ -1,7 +1,7 @@
 '''
 Business: Upload and split artist streaming reports from CSV/Excel files
 Args: event with httpMethod, body (base64 encoded file), queryStringParameters
-Returns: HTTP response with split reports by artist
+Returns: HTTP response with split reports by artist; GET file_id returns CSV inline or, when large (or delivery=link), a temporary bucket link
 '''
 
 import json
@@ -9,9 +9,19 @@ import base64
 import csv
 import io
 import os
-from typing import Dict, Any, List
+import re
+from typing import Dict, Any, List, Optional
 import psycopg2
 from collections import defaultdict
+from itertools import chain, islice
+import hashlib
+import heapq
+import zlib
+import tempfile
+import uuid
+from datetime import datetime
+import boto3
+from botocore.config import Config
 
 try:
     import openpyxl
@@ -19,6 +29,411 @@ try:
 except ImportError:
     EXCEL_AVAILABLE = False
 
+PERFORMER_SAMPLE_ROWS = 200
+PERFORMER_FLUSH_ROWS = 2000
+MAX_BUFFERED_ROWS = 10000
+XLSX_HEADER_ROW = 34
+XLSX_DATA_START_ROW = 35
+UNKNOWN_PERFORMER = 'Без исполнителя'
+INLINE_DOWNLOAD_LIMIT = 3 * 1024 * 1024
+DOWNLOAD_LINK_TTL = 3600
+
+MULTIPART_PARAM_RE = re.compile(r';\s*([\w*-]+)="([^"]*)"|;\s*([\w*-]+)=([^;\s]+)')
+
+class MultipartPart:
+    """Часть multipart-тела: заголовки разобраны, data — срез memoryview исходного тела без копирования"""
+    __slots__ = ('name', 'filename', 'content_type', 'data')
+
+    def __init__(self, name: str, filename: Optional[str], content_type: Optional[str], data: memoryview):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.data = data
+
+    def text(self) -> str:
+        return str(self.data, 'utf-8')
+
+class MemoryviewReader(io.RawIOBase):
+    """Файловый объект поверх memoryview: читает срезами, сам буфер не копирует"""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), len(self.view) - self.position)
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+def multipart_boundary(content_type: str) -> bytes:
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        raise ValueError('multipart boundary not found')
+    return match.group(1).strip().encode('latin-1')
+
+def iter_multipart_parts(body: bytes, boundary: bytes):
+    """
+    Разбирает multipart/form-data поверх готового тела: поиск разделителей идёт по bytes,
+    а содержимое частей отдаётся срезами memoryview — тело не копируется ни целиком, ни по частям
+    """
+    view = memoryview(body)
+    delimiter = b'--' + boundary
+    position = body.find(delimiter)
+    if position < 0:
+        raise ValueError('multipart body has no boundary')
+    
+    while True:
+        position += len(delimiter)
+        if body[position:position + 2] == b'--':
+            return
+        headers_start = position + 2
+        headers_end = body.find(b'\r\n\r\n', headers_start)
+        if headers_end < 0:
+            raise ValueError('multipart part headers are not terminated')
+        data_start = headers_end + 4
+        data_end = body.find(b'\r\n' + delimiter, data_start)
+        if data_end < 0:
+            raise ValueError('multipart part is not terminated')
+        
+        disposition = {}
+        part_content_type = None
+        for line in str(body[headers_start:headers_end], 'utf-8', 'replace').split('\r\n'):
+            header, _, value = line.partition(':')
+            header = header.strip().lower()
+            if header == 'content-disposition':
+                for quoted_key, quoted_value, key, plain_value in MULTIPART_PARAM_RE.findall(value):
+                    disposition[(quoted_key or key).lower()] = quoted_value if quoted_key else plain_value
+            elif header == 'content-type':
+                part_content_type = value.strip()
+        
+        yield MultipartPart(disposition.get('name', ''), disposition.get('filename'), part_content_type, view[data_start:data_end])
+        position = data_end + 2
+
+def parse_multipart(body: bytes, content_type: str) -> Dict[str, MultipartPart]:
+    return {part.name: part for part in iter_multipart_parts(body, multipart_boundary(content_type))}
+
+def iter_report_rows(file_content, file_type: str):
+    """
+    Построчно отдаёт строки отчёта как dict по заголовкам, не собирая файл в список.
+    XLSX читается в режиме read_only (заголовок в строке 34, данные с 35-й), CSV — через csv.DictReader поверх потока.
+    file_content — байты или файловый объект
+    """
+    stream = io.BytesIO(file_content) if isinstance(file_content, bytes) else file_content
+    
+    if file_type == 'xlsx':
+        workbook = openpyxl.load_workbook(stream, read_only=True)
+        sheet = workbook.active
+        
+        header_row = next(sheet.iter_rows(min_row=XLSX_HEADER_ROW, max_row=XLSX_HEADER_ROW, values_only=True), ())
+        headers = [str(cell).strip() if cell is not None and str(cell).strip() else f'col_{i}' for i, cell in enumerate(header_row)]
+        print(f"DEBUG: Found headers at row {XLSX_HEADER_ROW}: {headers[:5]}... total {len(headers)} columns")
+        
+        for row_cells in sheet.iter_rows(min_row=XLSX_DATA_START_ROW, values_only=True):
+            if any(cell is not None for cell in row_cells):
+                yield {header: row_cells[i] if i < len(row_cells) else None for i, header in enumerate(headers)}
+        workbook.close()
+        return
+    
+    for row in csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline='')):
+        if any(v for v in row.values()):
+            yield row
+
+PERFORMER_COLUMN_NAMES = ['Исполнитель', 'исполнитель', 'Performer', 'performer', 'Artist', 'artist', 'Артист', 'артист']
+EMPTY_MARKERS = ('none', 'null', '')
+DISTINCT_SKETCH_SIZE = 256
+
+class DistinctSketch:
+    """
+    Оценка числа различных значений по k минимальным хэшам (KMV).
+    Пока различных значений меньше k — счёт точный; память не больше k хэшей на колонку
+    """
+
+    def __init__(self, k: int = DISTINCT_SKETCH_SIZE):
+        self.k = k
+        self.heap = []
+        self.members = set()
+
+    def add(self, value: str):
+        h = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        if h in self.members:
+            return
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, -h)
+            self.members.add(h)
+        elif h < -self.heap[0]:
+            self.members.discard(-heapq.heappushpop(self.heap, -h))
+            self.members.add(h)
+
+    def estimate(self) -> float:
+        if len(self.heap) < self.k:
+            return float(len(self.heap))
+        return (self.k - 1) / (-self.heap[0] / 2 ** 64)
+
+class ColumnProfile:
+    """Статистика колонки по выборке строк"""
+    __slots__ = ('seen', 'non_empty', 'numeric', 'total_length', 'distinct')
+
+    def __init__(self):
+        self.seen = 0
+        self.non_empty = 0
+        self.numeric = 0
+        self.total_length = 0
+        self.distinct = DistinctSketch()
+
+    def add(self, value):
+        self.seen += 1
+        if value is None:
+            return
+        text = str(value).strip()
+        if text.lower() in EMPTY_MARKERS:
+            return
+        
+        self.non_empty += 1
+        self.total_length += len(text)
+        self.distinct.add(text)
+        if text.startswith('=') or is_number(text):
+            self.numeric += 1
+
+    @property
+    def null_ratio(self) -> float:
+        return 1 - self.non_empty / self.seen if self.seen else 1.0
+
+    @property
+    def numeric_ratio(self) -> float:
+        return self.numeric / self.non_empty if self.non_empty else 0.0
+
+    @property
+    def unique_ratio(self) -> float:
+        return min(self.distinct.estimate() / self.non_empty, 1.0) if self.non_empty else 0.0
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_length / self.non_empty if self.non_empty else 0.0
+
+def is_number(text: str) -> bool:
+    try:
+        float(text.replace(',', ''))
+        return True
+    except ValueError:
+        return False
+
+def profile_columns(rows: List[dict], columns: List[str]) -> Dict[str, ColumnProfile]:
+    """Один проход по выборке: для каждой колонки доля пустых и числовых значений, оценка уникальных, средняя длина"""
+    profiles = {column: ColumnProfile() for column in columns}
+    for row in rows:
+        for column, profile in profiles.items():
+            profile.add(row.get(column))
+    return profiles
+
+def detect_performer_columns(sample: List[dict]) -> List[str]:
+    """Колонки исполнителя: по названию, иначе по профилю колонок в первых строках"""
+    if not sample:
+        return []
+    
+    all_columns = list(sample[0].keys())
+    print(f"DEBUG: All columns ({len(all_columns)}): {all_columns}")
+    
+    performer_columns = [name for name in PERFORMER_COLUMN_NAMES if name in sample[0]]
+    if performer_columns:
+        print(f"DEBUG: Using columns for performers: {performer_columns}")
+        return performer_columns
+    
+    print(f"DEBUG: Column name not found, analyzing data patterns...")
+    
+    candidates = []
+    for col_name, profile in profile_columns(sample, all_columns).items():
+        if profile.non_empty < 50 or profile.numeric_ratio > 0.7:
+            continue
+        
+        if profile.unique_ratio > 0.3 and 5 < profile.avg_length < 150:
+            candidates.append((col_name, profile.unique_ratio))
+            print(f"DEBUG: Candidate {col_name}: ~{profile.distinct.estimate():.0f} unique / {profile.non_empty} non-empty = {profile.unique_ratio:.2%}, avg_len={profile.avg_length:.0f}, numeric={profile.numeric_ratio:.0%}, null={profile.null_ratio:.0%}")
+    
+    performer_columns = [name for name, _ in sorted(candidates, key=lambda c: c[1], reverse=True)[:2]]
+    if performer_columns:
+        print(f"DEBUG: Auto-detected performer columns: {performer_columns}")
+    return performer_columns
+
+def header_signature(file_type: str, headers: List[str]) -> str:
+    """Подпись формата дистрибьютора: тип файла и точный список заголовков"""
+    return hashlib.sha256('\x1f'.join([file_type, *headers]).encode('utf-8')).hexdigest()
+
+def cached_performer_columns(signature: str, cursor):
+    cursor.execute("""
+        UPDATE t_p35759334_music_label_portal.report_layout_cache
+        SET hits = hits + 1, last_used_at = NOW()
+        WHERE header_signature = %s
+        RETURNING performer_columns
+    """, (signature,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def remember_performer_columns(signature: str, performer_columns: List[str], cursor):
+    cursor.execute("""
+        INSERT INTO t_p35759334_music_label_portal.report_layout_cache (header_signature, performer_columns)
+        VALUES (%s, %s)
+        ON CONFLICT (header_signature) DO UPDATE
+        SET performer_columns = EXCLUDED.performer_columns, last_used_at = NOW()
+    """, (signature, json.dumps(performer_columns, ensure_ascii=False)))
+
+def performer_name(row: dict, performer_columns: List[str]) -> str:
+    performers = []
+    for col in performer_columns:
+        value = str(row.get(col, '')).strip()
+        if value and value.lower() not in ['none', 'null', '']:
+            performers.append(value)
+    
+    performer = ' & '.join(performers).strip()
+    return performer or UNKNOWN_PERFORMER
+
+def encode_row_segment(columns: List[str], rows: List[dict]) -> bytes:
+    """Порция строк в колоночном виде: JSON-список значений по каждой колонке, сжатый zlib"""
+    column_values = [[row.get(column) for row in rows] for column in columns]
+    return zlib.compress(json.dumps(column_values, ensure_ascii=False, default=str).encode('utf-8'), 6)
+
+def decode_row_segment(columns: List[str], segment: bytes):
+    column_values = json.loads(zlib.decompress(segment))
+    for values in zip(*column_values):
+        yield dict(zip(columns, values))
+
+class PerformerFileWriter:
+    """
+    Раскладывает строки по файлам исполнителей порциями.
+    У каждого исполнителя свой буфер; он сбрасывается сжатым колоночным сегментом в artist_report_segments,
+    когда набирает PERFORMER_FLUSH_ROWS строк, а если в буферах всех исполнителей больше MAX_BUFFERED_ROWS — сбрасываются все.
+    Так в памяти никогда не лежит больше одной порции строк, сколько бы строк ни было в файле
+    """
+
+    def __init__(self, uploaded_report_id: int, cursor):
+        self.uploaded_report_id = uploaded_report_id
+        self.cursor = cursor
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.files = {}
+        self.columns = {}
+        self.segments = {}
+
+    def add(self, performer: str, row: dict):
+        buffer = self.buffers[performer]
+        buffer.append(row)
+        self.buffered += 1
+        
+        if len(buffer) >= PERFORMER_FLUSH_ROWS:
+            self.flush(performer)
+        elif self.buffered >= MAX_BUFFERED_ROWS:
+            self.flush_all()
+
+    def flush(self, performer: str):
+        rows = self.buffers.pop(performer, None)
+        if not rows:
+            return
+        self.buffered -= len(rows)
+        
+        if performer not in self.files:
+            columns = [column for column in rows[0].keys() if column is not None]
+            self.cursor.execute("""
+                INSERT INTO t_p35759334_music_label_portal.artist_report_files 
+                (uploaded_report_id, artist_username, artist_full_name, columns, rows_count, deduction_percent)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (self.uploaded_report_id, performer, performer, json.dumps(columns, ensure_ascii=False), 0, 0))
+            
+            self.files[performer] = {
+                'id': self.cursor.fetchone()[0],
+                'artist_username': performer,
+                'artist_full_name': performer,
+                'rows_count': 0
+            }
+            self.columns[performer] = columns
+            self.segments[performer] = 0
+        
+        file_info = self.files[performer]
+        self.cursor.execute("""
+            INSERT INTO t_p35759334_music_label_portal.artist_report_segments
+            (file_id, segment_no, row_count, data)
+            VALUES (%s, %s, %s, %s)
+        """, (file_info['id'], self.segments[performer], len(rows),
+              psycopg2.Binary(encode_row_segment(self.columns[performer], rows))))
+        self.segments[performer] += 1
+        file_info['rows_count'] += len(rows)
+
+    def flush_all(self):
+        for performer in list(self.buffers):
+            self.flush(performer)
+
+    def close(self):
+        self.flush_all()
+        if self.files:
+            self.cursor.execute("""
+                UPDATE t_p35759334_music_label_portal.artist_report_files f
+                SET rows_count = c.rows_count
+                FROM unnest(%s::int[], %s::int[]) AS c(id, rows_count)
+                WHERE f.id = c.id
+            """, ([f['id'] for f in self.files.values()], [f['rows_count'] for f in self.files.values()]))
+
+def stream_report_file_rows(conn, file_id: int, columns: List[str]):
+    """Строки файла исполнителя по сегментам через серверный курсор: одновременно в памяти один сегмент"""
+    with conn.cursor(name=f'report_file_{file_id}') as segment_cursor:
+        segment_cursor.itersize = 1
+        segment_cursor.execute("""
+            SELECT data FROM t_p35759334_music_label_portal.artist_report_segments
+            WHERE file_id = %s
+            ORDER BY segment_no
+        """, (file_id,))
+        for (segment,) in segment_cursor:
+            yield from decode_row_segment(columns, bytes(segment))
+
+_s3_client = None
+
+def get_s3_client():
+    """S3-клиент для больших файлов исполнителей: собирается при первой выгрузке и живёт вместе с экземпляром функции"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            's3',
+            endpoint_url='https://storage.yandexcloud.net',
+            aws_access_key_id=os.environ.get('YC_S3_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('YC_S3_SECRET_ACCESS_KEY'),
+            region_name='ru-central1',
+            config=Config(retries={'max_attempts': 3, 'mode': 'standard'}, connect_timeout=5, read_timeout=60)
+        )
+    return _s3_client
+
+def upload_download(path: str, file_name: str) -> str:
+    """Кладёт большой CSV исполнителя в бакет и возвращает временную ссылку на скачивание"""
+    s3_client = get_s3_client()
+    bucket_name = os.environ.get('YC_S3_BUCKET_NAME')
+    s3_key = f"exports/{datetime.now().strftime('%Y/%m/%d')}/{uuid.uuid4()}/{file_name}"
+    
+    s3_client.upload_file(path, bucket_name, s3_key, ExtraArgs={'ContentType': 'text/csv; charset=utf-8'})
+    return s3_client.generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': bucket_name,
+            'Key': s3_key,
+            'ResponseContentDisposition': f'attachment; filename="{file_name}"'
+        },
+        ExpiresIn=DOWNLOAD_LINK_TTL
+    )
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -39,34 +454,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             content_type = event.get('headers', {}).get('content-type', event.get('headers', {}).get('Content-Type', ''))
             
             if 'multipart/form-data' in content_type:
-                import cgi
-                from io import BytesIO
-                
                 body = event.get('body', '')
                 if event.get('isBase64Encoded'):
                     body = base64.b64decode(body)
                 else:
                     body = body.encode('utf-8')
                 
-                environ = {
-                    'REQUEST_METHOD': 'POST',
-                    'CONTENT_TYPE': content_type,
-                    'CONTENT_LENGTH': len(body)
-                }
-                
-                form = cgi.FieldStorage(
-                    fp=BytesIO(body),
-                    environ=environ,
-                    keep_blank_values=True
-                )
+                form = parse_multipart(body, content_type)
                 
-                uploaded_by = form.getvalue('uploaded_by')
-                file_field = form['file']
-                file_name = file_field.filename
-                file_content = file_field.file.read()
+                uploaded_by = form['uploaded_by'].text() if 'uploaded_by' in form else None
+                file_field = form.get('file')
+                file_name = (file_field.filename if file_field else None) or 'report.csv'
                 file_type = 'xlsx' if file_name.endswith('.xlsx') else 'csv'
+                file_size = len(file_field.data) if file_field else 0
+                file_content = io.BufferedReader(MemoryviewReader(file_field.data)) if file_field else None
                 
-                if not file_content or not uploaded_by:
+                if not file_size or not uploaded_by:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -88,44 +491,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 file_content = base64.b64decode(file_content)
             
-            if file_type == 'xlsx':
-                if not EXCEL_AVAILABLE:
-                    return {
-                        'statusCode': 500,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Поддержка Excel не установлена'})
-                    }
-                
-                if isinstance(file_content, bytes):
-                    workbook = openpyxl.load_workbook(io.BytesIO(file_content))
-                else:
-                    decoded_bytes = base64.b64decode(file_content)
-                    workbook = openpyxl.load_workbook(io.BytesIO(decoded_bytes))
-                sheet = workbook.active
-                
-                header_row_index = 34
-                data_start_row = 35
-                
-                header_row = list(sheet.iter_rows(min_row=header_row_index, max_row=header_row_index, values_only=True))[0]
-                headers = [str(cell).strip() if cell is not None and str(cell).strip() else f'col_{i}' for i, cell in enumerate(header_row)]
-                
-                print(f"DEBUG: Found headers at row {header_row_index}: {headers[:5]}... total {len(headers)} columns")
-                print(f"DEBUG: Column W (index 22): {headers[22] if len(headers) > 22 else 'N/A'}")
-                
-                rows = []
-                for row_cells in sheet.iter_rows(min_row=data_start_row, values_only=True):
-                    if any(cell is not None for cell in row_cells):
-                        row_dict = {}
-                        for i, header in enumerate(headers):
-                            row_dict[header] = row_cells[i] if i < len(row_cells) else None
-                        rows.append(row_dict)
-            else:
-                if isinstance(file_content, bytes):
-                    decoded_content = file_content.decode('utf-8')
-                else:
-                    decoded_content = file_content
-                csv_reader = csv.DictReader(io.StringIO(decoded_content))
-                rows = [row for row in csv_reader if any(v for v in row.values())]
+            if file_type == 'xlsx' and not EXCEL_AVAILABLE:
+                return {
+                    'statusCode': 500,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Поддержка Excel не установлена'})
+                }
             
             dsn = os.environ.get('DATABASE_URL')
             if not dsn:
@@ -138,123 +509,46 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             conn = psycopg2.connect(dsn)
             cursor = conn.cursor()
             
+            rows = iter_report_rows(file_content, file_type)
+            sample = list(islice(rows, 1))
             performer_columns = []
-            possible_names = ['Исполнитель', 'исполнитель', 'Performer', 'performer', 'Artist', 'artist', 'Артист', 'артист']
             
-            print(f"DEBUG: Total rows parsed: {len(rows)}")
-            if rows:
-                all_columns = list(rows[0].keys())
-                print(f"DEBUG: All columns ({len(all_columns)}): {all_columns}")
-                
-                for name in possible_names:
-                    if name in rows[0]:
-                        performer_columns.append(name)
-                        print(f"DEBUG: Found performer column by name: {name}")
-                
-                if performer_columns:
-                    print(f"DEBUG: Using columns for performers: {performer_columns}")
+            if sample:
+                signature = header_signature(file_type, list(sample[0].keys()))
+                performer_columns = cached_performer_columns(signature, cursor)
                 
-                if not performer_columns:
-                    print(f"DEBUG: Column name not found, analyzing data patterns...")
-                    
-                    candidates = []
-                    
-                    for col_name in all_columns:
-                        values = [str(row.get(col_name, '')).strip() 
-                                 for row in rows[:200] 
-                                 if row.get(col_name) is not None]
-                        
-                        non_empty = [v for v in values if v and v.lower() not in ['none', 'null', '']]
-                        
-                        if len(non_empty) < 50:
-                            continue
-                        
-                        def is_numeric_or_formula(s):
-                            s_clean = s.strip()
-                            if s_clean.startswith('='):
-                                return True
-                            try:
-                                float(s_clean.replace(',', ''))
-                                return True
-                            except:
-                                return False
-                        
-                        numeric_count = sum(1 for v in non_empty if is_numeric_or_formula(v))
-                        numeric_ratio = numeric_count / len(non_empty) if non_empty else 0
-                        
-                        if numeric_ratio > 0.7:
-                            continue
-                        
-                        unique_count = len(set(non_empty))
-                        total_count = len(non_empty)
-                        unique_ratio = unique_count / total_count if total_count > 0 else 0
-                        
-                        avg_length = sum(len(v) for v in non_empty) / len(non_empty) if non_empty else 0
-                        
-                        if unique_ratio > 0.3 and avg_length > 5 and avg_length < 150:
-                            candidates.append((col_name, unique_ratio, unique_count, total_count))
-                            print(f"DEBUG: Candidate {col_name}: {unique_count} unique / {total_count} total = {unique_ratio:.2%}, avg_len={avg_length:.0f}, numeric={numeric_ratio:.0%}")
-                    
-                    if candidates:
-                        candidates.sort(key=lambda x: x[1], reverse=True)
-                        performer_columns = [c[0] for c in candidates[:2]]
-                        print(f"DEBUG: Auto-detected performer columns: {performer_columns}")
+                if performer_columns is not None:
+                    print(f"DEBUG: Known report layout, performer columns: {performer_columns}")
+                else:
+                    sample.extend(islice(rows, PERFORMER_SAMPLE_ROWS - 1))
+                    print(f"DEBUG: Sampled {len(sample)} rows for performer detection")
+                    performer_columns = detect_performer_columns(sample)
+                    if performer_columns:
+                        remember_performer_columns(signature, performer_columns, cursor)
             
             if not performer_columns:
                 print(f"DEBUG: Performer columns not found! All data will go to 'Без исполнителя'")
             
-            artist_data = defaultdict(list)
-            
-            for row in rows:
-                performers = []
-                
-                for col in performer_columns:
-                    value = str(row.get(col, '')).strip()
-                    if value and value.lower() not in ['none', 'null', '']:
-                        performers.append(value)
-                
-                performer = ' & '.join(performers) if performers else ''
-                performer = performer.strip()
-                
-                if performer:
-                    artist_data[performer].append(row)
-                else:
-                    artist_data['Без исполнителя'].append(row)
-            
-            print(f"DEBUG: Found {len(artist_data)} unique performers")
-            if len(artist_data) <= 20:
-                print(f"DEBUG: Performers list: {list(artist_data.keys())}")
-            else:
-                print(f"DEBUG: First 20 performers: {list(artist_data.keys())[:20]}")
-            
             cursor.execute(
                 "INSERT INTO t_p35759334_music_label_portal.uploaded_reports (file_name, uploaded_by, total_rows, processed) VALUES (%s, %s, %s, %s) RETURNING id",
-                (file_name, uploaded_by, len(rows), True)
+                (file_name, uploaded_by, 0, True)
             )
             uploaded_report_id = cursor.fetchone()[0]
             
-            created_files = []
-            for performer_name, performer_rows in artist_data.items():
-                cursor.execute("""
-                    INSERT INTO t_p35759334_music_label_portal.artist_report_files 
-                    (uploaded_report_id, artist_username, artist_full_name, data, deduction_percent)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                """, (
-                    uploaded_report_id,
-                    performer_name,
-                    performer_name,
-                    json.dumps(performer_rows),
-                    0
-                ))
-                
-                file_id = cursor.fetchone()[0]
-                created_files.append({
-                    'id': file_id,
-                    'artist_username': performer_name,
-                    'artist_full_name': performer_name,
-                    'rows_count': len(performer_rows)
-                })
+            writer = PerformerFileWriter(uploaded_report_id, cursor)
+            total_rows = 0
+            for row in chain(sample, rows):
+                writer.add(performer_name(row, performer_columns), row)
+                total_rows += 1
+            writer.close()
+            
+            cursor.execute(
+                "UPDATE t_p35759334_music_label_portal.uploaded_reports SET total_rows = %s WHERE id = %s",
+                (total_rows, uploaded_report_id)
+            )
+            
+            print(f"DEBUG: Found {len(writer.files)} unique performers in {total_rows} rows")
+            created_files = list(writer.files.values())
             
             conn.commit()
             cursor.close()
@@ -266,7 +560,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({
                     'success': True,
                     'uploaded_report_id': uploaded_report_id,
-                    'total_rows': len(rows),
+                    'total_rows': total_rows,
                     'artist_files': created_files
                 })
             }
@@ -291,39 +585,69 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             if file_id:
                 cursor.execute("""
                     SELECT id, artist_username, artist_full_name, deduction_percent, sent_to_artist_id, sent_at, 
-                           data
+                           columns, data IS NOT NULL
                     FROM t_p35759334_music_label_portal.artist_report_files
                     WHERE id = %s
                 """, (file_id,))
                 row = cursor.fetchone()
-                cursor.close()
-                conn.close()
                 
                 if not row:
+                    cursor.close()
+                    conn.close()
                     return {
                         'statusCode': 404,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                         'body': json.dumps({'error': 'Файл не найден'})
                     }
                 
-                full_data = row[6]
-                rows_count = len(full_data)
-                
-                csv_output = io.StringIO()
-                if full_data:
-                    headers = list(full_data[0].keys())
-                    writer = csv.DictWriter(csv_output, fieldnames=headers)
-                    writer.writeheader()
-                    writer.writerows(full_data)
+                columns, legacy_blob = row[6], row[7]
+                if legacy_blob:
+                    cursor.execute("""
+                        SELECT data FROM t_p35759334_music_label_portal.artist_report_files WHERE id = %s
+                    """, (file_id,))
+                    full_data = cursor.fetchone()[0]
+                    columns = list(full_data[0].keys()) if full_data else []
+                    file_rows = iter(full_data)
+                else:
+                    file_rows = stream_report_file_rows(conn, row[0], columns or [])
                 
-                csv_content = csv_output.getvalue()
+                # CSV пишется во временный файл построчно; небольшой отдаётся в ответе,
+                # большой (или при delivery=link) загружается в бакет и возвращается ссылкой
+                file_name = f"artist_{row[1]}.csv"
+                fd, path = tempfile.mkstemp(suffix='.csv', dir='/tmp')
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8', newline='') as csv_file:
+                        if columns:
+                            writer = csv.DictWriter(csv_file, fieldnames=columns)
+                            writer.writeheader()
+                            writer.writerows(file_rows)
+                    cursor.close()
+                    conn.close()
+                    
+                    size = os.path.getsize(path)
+                    if params.get('delivery') == 'link' or size > INLINE_DOWNLOAD_LIMIT:
+                        return {
+                            'statusCode': 200,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({
+                                'url': upload_download(path, file_name),
+                                'file_name': file_name,
+                                'size': size,
+                                'expires_in': DOWNLOAD_LINK_TTL
+                            }, ensure_ascii=False)
+                        }
+                    
+                    with open(path, encoding='utf-8') as csv_file:
+                        csv_content = csv_file.read()
+                finally:
+                    os.remove(path)
                 
                 return {
                     'statusCode': 200,
                     'headers': {
                         'Content-Type': 'text/csv',
                         'Access-Control-Allow-Origin': '*',
-                        'Content-Disposition': f'attachment; filename="artist_{row[1]}.csv"'
+                        'Content-Disposition': f'attachment; filename="{file_name}"'
                     },
                     'body': csv_content
                 }
@@ -345,7 +669,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 cursor.execute("""
                     SELECT id, artist_username, artist_full_name, deduction_percent, sent_to_artist_id, sent_at, 
-                           jsonb_array_length(data) as rows_count
+                           rows_count
                     FROM t_p35759334_music_label_portal.artist_report_files
                     WHERE uploaded_report_id = %s
                     ORDER BY artist_username
@@ -374,7 +698,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             else:
                 cursor.execute("""
                     SELECT arf.id, arf.artist_username, arf.artist_full_name, arf.deduction_percent, 
-                           arf.sent_to_artist_id, arf.sent_at, jsonb_array_length(arf.data) as rows_count,
+                           arf.sent_to_artist_id, arf.sent_at, arf.rows_count,
                            ur.file_name, ur.uploaded_at
                     FROM t_p35759334_music_label_portal.artist_report_files arf
                     JOIN t_p35759334_music_label_portal.uploaded_reports ur ON arf.uploaded_report_id = ur.id
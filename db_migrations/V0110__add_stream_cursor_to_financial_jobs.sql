@@ -0,0 +1,7 @@
+-- Позиция потокового чтения файла: номер последней обработанной строки
+ALTER TABLE financial_upload_jobs
+ADD COLUMN IF NOT EXISTS stream_cursor INTEGER DEFAULT 0;
+
+COMMENT ON COLUMN financial_upload_jobs.stream_cursor IS 'Номер последней строки файла, отданной в чанк (для продолжения без повторного чтения)';
+
+CREATE INDEX IF NOT EXISTS idx_job_chunks_pending_order ON job_chunks(job_id, chunk_number) WHERE status = 'pending';
@@ -0,0 +1,4 @@
+-- Колоночные сегменты чанков: артист, альбом и сумма, подготовленные один раз при загрузке
+ALTER TABLE job_chunks ADD COLUMN IF NOT EXISTS segment BYTEA;
+
+COMMENT ON COLUMN job_chunks.segment IS 'Сжатый колоночный сегмент строк чанка (artist, album, amount); NULL для старых задач, читающих file_data';
@@ -0,0 +1,9 @@
+-- Аренда чанков: воркер атомарно захватывает чанки и продлевает аренду (heartbeat)
+ALTER TABLE job_chunks
+ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(64),
+ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP;
+
+COMMENT ON COLUMN job_chunks.claimed_by IS 'ID воркера, который обрабатывает чанк';
+COMMENT ON COLUMN job_chunks.lease_expires_at IS 'Когда аренда истекает и чанк может забрать другой воркер';
+
+CREATE INDEX IF NOT EXISTS idx_job_chunks_processing_lease ON job_chunks(lease_expires_at) WHERE status = 'processing';
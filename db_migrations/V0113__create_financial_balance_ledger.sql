@@ -0,0 +1,14 @@
+-- Журнал начислений по задачам: суммы копятся по мере обработки чанков и применяются к балансам один раз
+CREATE TABLE IF NOT EXISTS financial_balance_ledger (
+    job_id INTEGER NOT NULL REFERENCES financial_upload_jobs(id),
+    user_id INTEGER NOT NULL,
+    amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    applied_at TIMESTAMP,
+    PRIMARY KEY (job_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_financial_balance_ledger_unapplied ON financial_balance_ledger(job_id) WHERE applied_at IS NULL;
+
+COMMENT ON TABLE financial_balance_ledger IS 'Начисления артистам по задачам загрузки финансовых отчётов';
+COMMENT ON COLUMN financial_balance_ledger.applied_at IS 'Когда сумма зачислена на users.balance; NULL — ещё не зачислена';
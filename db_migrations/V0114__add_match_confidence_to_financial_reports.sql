@@ -0,0 +1,4 @@
+-- Уверенность сопоставления строки отчёта с релизом
+ALTER TABLE financial_reports ADD COLUMN IF NOT EXISTS match_confidence REAL;
+
+COMMENT ON COLUMN financial_reports.match_confidence IS '1.0 — точное совпадение, 0.95 — по токенам/транслитерации, ниже — нечёткое; NULL если не найдено';
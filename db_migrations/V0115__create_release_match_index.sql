@@ -0,0 +1,26 @@
+-- Версионированный снимок нормализованных ключей релизов для сопоставления финансовых отчётов
+CREATE TABLE IF NOT EXISTS release_match_index (
+    id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    data_version BIGINT,
+    data BYTEA,
+    built_at TIMESTAMP
+);
+
+INSERT INTO release_match_index (id, version) VALUES (1, 1) ON CONFLICT (id) DO NOTHING;
+
+COMMENT ON TABLE release_match_index IS 'Снимок ключей сопоставления релизов; version растёт при каждом изменении releases';
+COMMENT ON COLUMN release_match_index.data_version IS 'Версия, для которой построен снимок data; если меньше version — снимок устарел';
+
+-- Любое изменение релизов делает снимок устаревшим
+CREATE OR REPLACE FUNCTION bump_release_match_index_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE release_match_index SET version = version + 1 WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_releases_match_index_version ON releases;
+CREATE TRIGGER trg_releases_match_index_version
+AFTER INSERT OR DELETE OR UPDATE OF artist_id, artist_name, release_name ON releases
+FOR EACH STATEMENT EXECUTE FUNCTION bump_release_match_index_version();
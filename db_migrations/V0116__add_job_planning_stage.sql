@@ -0,0 +1,19 @@
+-- Стадия планирования: подсчёт строк, проверка заголовка и нарезка чанков выполняются воркером, а не в запросе загрузки
+ALTER TABLE financial_upload_jobs
+ADD COLUMN IF NOT EXISTS column_layout JSONB,
+ADD COLUMN IF NOT EXISTS planned_at TIMESTAMP,
+ADD COLUMN IF NOT EXISTS planned_by VARCHAR(64),
+ADD COLUMN IF NOT EXISTS plan_lease_expires_at TIMESTAMP;
+
+COMMENT ON COLUMN financial_upload_jobs.column_layout IS 'Номера колонок артиста, альбома и суммы, определённые по заголовку';
+COMMENT ON COLUMN financial_upload_jobs.planned_at IS 'Когда все чанки задачи созданы; NULL — планирование ещё идёт';
+COMMENT ON COLUMN financial_upload_jobs.planned_by IS 'ID воркера, который планирует задачу';
+COMMENT ON COLUMN financial_upload_jobs.plan_lease_expires_at IS 'Когда аренда планирования истекает и задачу может продолжить другой воркер';
+
+-- Задачи, созданные до этой миграции, уже нарезаны на чанки при загрузке
+UPDATE financial_upload_jobs
+SET planned_at = created_at
+WHERE planned_at IS NULL
+  AND (total_chunks > 0 OR status <> 'pending');
+
+CREATE INDEX IF NOT EXISTS idx_financial_upload_jobs_unplanned ON financial_upload_jobs(id) WHERE planned_at IS NULL;
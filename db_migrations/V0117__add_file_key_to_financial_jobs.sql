@@ -0,0 +1,18 @@
+-- Файлы финансовых отчётов хранятся в бакете, в задаче только ключ объекта
+ALTER TABLE financial_upload_jobs
+ADD COLUMN IF NOT EXISTS file_key VARCHAR(512);
+
+COMMENT ON COLUMN financial_upload_jobs.file_key IS 'Ключ файла отчёта в S3-бакете; NULL для старых задач с file_data';
+COMMENT ON COLUMN financial_upload_jobs.file_data IS 'Устаревшее: файл отчёта в БД, только для задач до переноса в бакет';
+
+-- Файлы уже нарезанных задач больше не читаются — освобождаем место
+UPDATE financial_upload_jobs
+SET file_data = NULL
+WHERE file_data IS NOT NULL
+  AND planned_at IS NOT NULL
+  AND NOT EXISTS (
+      SELECT 1 FROM job_chunks
+      WHERE job_chunks.job_id = financial_upload_jobs.id
+        AND job_chunks.segment IS NULL
+        AND job_chunks.status <> 'completed'
+  );
@@ -0,0 +1,40 @@
+-- Сводка доходов артистов по периодам и релизам: дашборд читает итоги отсюда, а не суммирует все строки отчётов
+CREATE TABLE IF NOT EXISTS artist_earnings_rollup (
+    user_id INTEGER NOT NULL,
+    period VARCHAR(50) NOT NULL,
+    release_id INTEGER NOT NULL DEFAULT 0,
+    total_amount DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    rows_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, period, release_id)
+);
+
+COMMENT ON TABLE artist_earnings_rollup IS 'Итоги начислений артиста по периоду и релизу';
+COMMENT ON COLUMN artist_earnings_rollup.release_id IS 'ID релиза; 0 — строки без привязки к релизу';
+
+-- Журнал сводки по задачам: копится по чанкам и применяется к artist_earnings_rollup один раз при завершении задачи
+CREATE TABLE IF NOT EXISTS financial_rollup_ledger (
+    job_id INTEGER NOT NULL REFERENCES financial_upload_jobs(id),
+    user_id INTEGER NOT NULL,
+    release_id INTEGER NOT NULL DEFAULT 0,
+    amount DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    rows_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    applied_at TIMESTAMP,
+    PRIMARY KEY (job_id, user_id, release_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_financial_rollup_ledger_unapplied ON financial_rollup_ledger(job_id) WHERE applied_at IS NULL;
+
+COMMENT ON TABLE financial_rollup_ledger IS 'Суммы для artist_earnings_rollup по задачам загрузки';
+COMMENT ON COLUMN financial_rollup_ledger.applied_at IS 'Когда суммы перенесены в artist_earnings_rollup; NULL — ещё не перенесены';
+
+-- Заполняем сводку по уже загруженным отчётам (строки id <= 2 — тестовые, дашборд их не показывает)
+INSERT INTO artist_earnings_rollup (user_id, period, release_id, total_amount, rows_count)
+SELECT user_id, period, COALESCE(release_id, 0), SUM(amount), COUNT(*)
+FROM financial_reports
+WHERE status = 'matched'
+  AND user_id IS NOT NULL
+  AND id > 2
+GROUP BY user_id, period, COALESCE(release_id, 0)
+ON CONFLICT (user_id, period, release_id) DO NOTHING;
@@ -0,0 +1,3 @@
+-- Индекс для постраничной выдачи строк отчётов артиста по ключу (uploaded_at, id)
+CREATE INDEX IF NOT EXISTS idx_financial_reports_user_status_uploaded
+ON financial_reports(user_id, status, uploaded_at DESC, id DESC);
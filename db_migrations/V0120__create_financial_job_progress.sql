@@ -0,0 +1,27 @@
+-- Прогресс задач загрузки финансовых отчётов: обновляется на каждый чанк, version растёт монотонно для long-poll
+CREATE SEQUENCE IF NOT EXISTS financial_job_progress_version_seq;
+
+CREATE TABLE IF NOT EXISTS financial_job_progress (
+    job_id INTEGER PRIMARY KEY REFERENCES financial_upload_jobs(id),
+    uploaded_by INTEGER,
+    status VARCHAR(50),
+    total_rows INTEGER DEFAULT 0,
+    total_chunks INTEGER DEFAULT 0,
+    completed_chunks INTEGER DEFAULT 0,
+    processed_rows INTEGER DEFAULT 0,
+    matched_count INTEGER DEFAULT 0,
+    version BIGINT NOT NULL DEFAULT nextval('financial_job_progress_version_seq'),
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_financial_job_progress_user_version ON financial_job_progress(uploaded_by, version);
+
+COMMENT ON TABLE financial_job_progress IS 'Счётчики прогресса задач загрузки, обновляемые по мере обработки чанков';
+COMMENT ON COLUMN financial_job_progress.version IS 'Глобально возрастающая версия последнего изменения; клиент ждёт изменений с version больше известной';
+
+INSERT INTO financial_job_progress
+    (job_id, uploaded_by, status, total_rows, total_chunks, completed_chunks, processed_rows, matched_count)
+SELECT id, uploaded_by, status, COALESCE(total_rows, 0), COALESCE(total_chunks, 0),
+       COALESCE(completed_chunks, 0), COALESCE(processed_rows, 0), COALESCE(matched_count, 0)
+FROM financial_upload_jobs
+ON CONFLICT (job_id) DO NOTHING;
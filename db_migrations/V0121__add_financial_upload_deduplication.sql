@@ -0,0 +1,25 @@
+-- Защита от повторной загрузки: хэш всего файла и отпечатки строк по периодам
+ALTER TABLE financial_upload_jobs
+ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64),
+ADD COLUMN IF NOT EXISTS duplicate_rows INTEGER DEFAULT 0;
+
+COMMENT ON COLUMN financial_upload_jobs.content_sha256 IS 'SHA-256 файла отчёта; повторная загрузка того же файла отклоняется';
+COMMENT ON COLUMN financial_upload_jobs.duplicate_rows IS 'Строки, пропущенные как уже загруженные за этот период';
+
+-- Неудачные задачи не мешают загрузить файл заново
+CREATE UNIQUE INDEX IF NOT EXISTS idx_financial_upload_jobs_content_sha256
+ON financial_upload_jobs(content_sha256)
+WHERE content_sha256 IS NOT NULL AND status <> 'failed';
+
+CREATE TABLE IF NOT EXISTS financial_row_fingerprints (
+    period VARCHAR(50) NOT NULL,
+    fingerprint BYTEA NOT NULL,
+    job_id INTEGER NOT NULL REFERENCES financial_upload_jobs(id),
+    occurrences INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (period, fingerprint, job_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_financial_row_fingerprints_job ON financial_row_fingerprints(job_id);
+
+COMMENT ON TABLE financial_row_fingerprints IS 'Отпечатки строк загруженных отчётов (blake2b-128 по всем ячейкам) для поиска пересечений при повторной загрузке';
+COMMENT ON COLUMN financial_row_fingerprints.occurrences IS 'Сколько раз такая строка встретилась в файле задачи';
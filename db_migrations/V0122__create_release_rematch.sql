@@ -0,0 +1,65 @@
+-- Досопоставление ожидающих строк отчётов при создании или переименовании релизов
+
+-- Нормализованный ключ 'артист||альбом' (как normalize_string в process-financial-jobs) для строк без совпадения
+ALTER TABLE financial_reports
+ADD COLUMN IF NOT EXISTS match_key TEXT;
+
+COMMENT ON COLUMN financial_reports.match_key IS 'Нормализованный ключ артист||альбом ожидающей строки; по нему строка находится, когда появляется релиз';
+
+CREATE OR REPLACE FUNCTION financial_match_normalize(value TEXT) RETURNS TEXT AS $$
+    SELECT btrim(regexp_replace(translate(lower(btrim(COALESCE(value, ''))), '«»"()[]', ''), '\s+', ' ', 'g'))
+$$ LANGUAGE sql IMMUTABLE;
+
+UPDATE financial_reports
+SET match_key = financial_match_normalize(artist_name) || '||' || financial_match_normalize(album_name)
+WHERE status = 'pending'
+  AND match_key IS NULL
+  AND financial_match_normalize(artist_name) <> ''
+  AND financial_match_normalize(album_name) <> '';
+
+CREATE INDEX IF NOT EXISTS idx_financial_reports_pending_match_key
+ON financial_reports(match_key)
+WHERE status = 'pending';
+
+-- Журнал изменений релизов, влияющих на сопоставление
+CREATE TABLE IF NOT EXISTS release_changes (
+    id BIGSERIAL PRIMARY KEY,
+    release_id INTEGER NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE release_changes IS 'Созданные и переименованные релизы; воркер досопоставляет по ним ожидающие строки отчётов';
+
+CREATE OR REPLACE FUNCTION log_release_change() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO release_changes (release_id) VALUES (NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_releases_log_change ON releases;
+CREATE TRIGGER trg_releases_log_change
+AFTER INSERT OR UPDATE OF artist_id, artist_name, release_name ON releases
+FOR EACH ROW EXECUTE FUNCTION log_release_change();
+
+-- Отметка: до какого изменения досопоставление уже выполнено
+CREATE TABLE IF NOT EXISTS release_rematch_state (
+    id INTEGER PRIMARY KEY,
+    last_change_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO release_rematch_state (id, last_change_id) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+-- Релизы, созданные до этой миграции, тоже могли появиться уже после загрузки отчёта — проходим их один раз
+INSERT INTO release_changes (release_id)
+SELECT id FROM releases ORDER BY id;
+
+-- Досопоставление оформляется задачей kind='rematch', чтобы начисления шли через те же журналы и finalize_job
+ALTER TABLE financial_upload_jobs
+ADD COLUMN IF NOT EXISTS kind VARCHAR(20) NOT NULL DEFAULT 'upload';
+
+ALTER TABLE financial_upload_jobs
+ALTER COLUMN uploaded_by DROP NOT NULL;
+
+COMMENT ON COLUMN financial_upload_jobs.kind IS 'upload — загрузка файла, rematch — досопоставление после появления релизов';
@@ -0,0 +1,11 @@
+-- Кэш раскладки колонок отчётов дистрибьюторов: повторные загрузки того же формата пропускают автоопределение
+CREATE TABLE IF NOT EXISTS t_p35759334_music_label_portal.report_layout_cache (
+    header_signature CHAR(64) PRIMARY KEY,
+    performer_columns JSONB NOT NULL,
+    hits INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE t_p35759334_music_label_portal.report_layout_cache IS 'Найденные колонки исполнителя по подписи заголовков файла';
+COMMENT ON COLUMN t_p35759334_music_label_portal.report_layout_cache.header_signature IS 'SHA-256 от типа файла и списка заголовков';
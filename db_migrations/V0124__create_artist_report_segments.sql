@@ -0,0 +1,24 @@
+-- Файлы исполнителей хранятся сжатыми колоночными сегментами вместо одного JSONB-массива на файл
+ALTER TABLE t_p35759334_music_label_portal.artist_report_files
+    ADD COLUMN IF NOT EXISTS columns JSONB,
+    ADD COLUMN IF NOT EXISTS rows_count INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE t_p35759334_music_label_portal.artist_report_files
+    ALTER COLUMN data DROP NOT NULL;
+
+-- Число строк для старых файлов считаем один раз, чтобы списки больше не разворачивали data
+UPDATE t_p35759334_music_label_portal.artist_report_files
+SET rows_count = jsonb_array_length(data)
+WHERE data IS NOT NULL AND jsonb_typeof(data) = 'array';
+
+CREATE TABLE IF NOT EXISTS t_p35759334_music_label_portal.artist_report_segments (
+    file_id INTEGER NOT NULL REFERENCES t_p35759334_music_label_portal.artist_report_files(id),
+    segment_no INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    data BYTEA NOT NULL,
+    PRIMARY KEY (file_id, segment_no)
+);
+
+COMMENT ON COLUMN t_p35759334_music_label_portal.artist_report_files.columns IS 'Заголовки колонок файла в исходном порядке';
+COMMENT ON COLUMN t_p35759334_music_label_portal.artist_report_files.rows_count IS 'Число строк в файле исполнителя';
+COMMENT ON TABLE t_p35759334_music_label_portal.artist_report_segments IS 'Строки файлов исполнителей: zlib-сжатые JSON-списки значений по колонкам, по порциям';
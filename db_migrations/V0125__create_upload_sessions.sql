@@ -0,0 +1,29 @@
+-- Сессии S3 multipart-загрузок: манифест принятых частей для докачки после обрыва
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    upload_id VARCHAR(1024) PRIMARY KEY,
+    s3_key VARCHAR(1024) NOT NULL,
+    file_name VARCHAR(500),
+    content_type VARCHAR(255),
+    expected_size BIGINT,
+    part_size BIGINT,
+    status VARCHAR(20) NOT NULL DEFAULT 'active',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS upload_session_parts (
+    upload_id VARCHAR(1024) NOT NULL REFERENCES upload_sessions(upload_id),
+    part_number INTEGER NOT NULL,
+    etag VARCHAR(255) NOT NULL,
+    size BIGINT NOT NULL,
+    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (upload_id, part_number)
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_active_expires ON upload_sessions(expires_at) WHERE status = 'active';
+
+COMMENT ON TABLE upload_sessions IS 'Незавершённые и завершённые multipart-загрузки в S3 (upload-direct)';
+COMMENT ON COLUMN upload_sessions.part_size IS 'Размер части, по которому считаются недостающие части при докачке';
+COMMENT ON COLUMN upload_sessions.status IS 'active, completed или aborted';
+COMMENT ON TABLE upload_session_parts IS 'Принятые части загрузки с ETag; повторно отправленная часть перезаписывает строку';
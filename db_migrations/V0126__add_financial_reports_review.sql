@@ -0,0 +1,17 @@
+-- Неточные совпадения (по токенам и нечёткие) больше не начисляются сразу: строка ждёт подтверждения администратора
+
+COMMENT ON COLUMN financial_reports.status IS 'Статус: pending — нет совпадения, needs_review — неточное совпадение ждёт проверки (user_id/release_id — подсказка), confirmed — подтверждено, ждёт начисления воркером, matched — начислено, paid';
+
+-- Досопоставление по match_key переводит в matched и строки на проверке, если появился точный релиз
+CREATE INDEX IF NOT EXISTS idx_financial_reports_unmatched_match_key
+ON financial_reports(match_key)
+WHERE status IN ('pending', 'needs_review');
+
+DROP INDEX IF EXISTS idx_financial_reports_pending_match_key;
+
+-- Очередь проверки администратором и подтверждённые строки для воркера
+CREATE INDEX IF NOT EXISTS idx_financial_reports_review
+ON financial_reports(id)
+WHERE status IN ('needs_review', 'confirmed');
+
+COMMENT ON COLUMN financial_upload_jobs.kind IS 'upload — загрузка файла, rematch — досопоставление после появления релизов, review — начисление подтверждённых администратором строк';
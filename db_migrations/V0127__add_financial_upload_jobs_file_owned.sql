@@ -0,0 +1,11 @@
+-- Воркер удаляет файл задачи из бакета после планирования, только если его сохранил сам загрузчик
+
+ALTER TABLE financial_upload_jobs
+ADD COLUMN IF NOT EXISTS file_owned BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- content_sha256 считается только для файлов, присланных в теле запроса и сохранённых обработчиком
+UPDATE financial_upload_jobs
+SET file_owned = TRUE
+WHERE file_key IS NOT NULL AND content_sha256 IS NOT NULL;
+
+COMMENT ON COLUMN financial_upload_jobs.file_owned IS 'TRUE — file_key сохранён обработчиком загрузки и удаляется после планирования; FALSE — файл передан клиентом через fileKey и остаётся в бакете';
@@ -0,0 +1,17 @@
+-- match_key, посчитанный в V0122 функцией financial_match_normalize, расходится с normalize_string воркера:
+-- lower() зависит от локали БД (кириллица), а \s не покрывает неразрывные пробелы. Такие ключи сбрасываются,
+-- и воркер (backfill_match_keys) досчитывает их той же normalize_string, что используется при сопоставлении
+
+UPDATE financial_reports
+SET match_key = NULL
+WHERE status = 'pending'
+  AND match_key IS NOT NULL;
+
+DROP FUNCTION IF EXISTS financial_match_normalize(TEXT);
+
+-- Очередь досчёта ключей; после досчёта индекс пустой
+CREATE INDEX IF NOT EXISTS idx_financial_reports_match_key_backfill
+ON financial_reports(id)
+WHERE status = 'pending' AND match_key IS NULL;
+
+COMMENT ON COLUMN financial_reports.match_key IS 'Нормализованный ключ артист||альбом (normalize_string воркера) строки без точного совпадения; пустая строка — ключ не строится; NULL — ещё не посчитан';
@@ -0,0 +1,26 @@
+-- V0122 записал в release_changes все существующие релизы: первый проход досопоставления разом начислил бы
+-- исторические ожидающие строки за прошлые периоды. Эти изменения выносятся в отдельное окно, которое воркер
+-- проходит только после явного одобрения администратором (action=approve-rematch-history в upload-financial-report)
+
+ALTER TABLE release_rematch_state
+ADD COLUMN IF NOT EXISTS history_cursor BIGINT NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS history_through BIGINT NOT NULL DEFAULT 0,
+ADD COLUMN IF NOT EXISTS history_approved_at TIMESTAMP,
+ADD COLUMN IF NOT EXISTS history_approved_by INTEGER;
+
+-- Всё, что ещё не пройдено к моменту миграции, считается историей; обычный проход продолжается с новых изменений
+UPDATE release_rematch_state s
+SET history_cursor = s.last_change_id,
+    history_through = GREATEST(s.last_change_id, c.max_id),
+    last_change_id = GREATEST(s.last_change_id, c.max_id),
+    updated_at = NOW()
+FROM (SELECT COALESCE(MAX(id), 0) AS max_id FROM release_changes) c
+WHERE s.id = 1;
+
+COMMENT ON COLUMN release_rematch_state.history_cursor IS 'До какого изменения пройдено историческое окно (history_cursor, history_through]';
+COMMENT ON COLUMN release_rematch_state.history_through IS 'Последнее историческое изменение; окно разово меняет балансы за прошлые периоды';
+COMMENT ON COLUMN release_rematch_state.history_approved_at IS 'Когда администратор одобрил историческое досопоставление; NULL — окно не проходится';
+COMMENT ON COLUMN release_rematch_state.history_approved_by IS 'ID администратора, одобрившего историческое досопоставление';
+
+-- Задачи досопоставления и подтверждения создаёт воркер, а не пользователь (см. V0122)
+COMMENT ON COLUMN financial_upload_jobs.uploaded_by IS 'ID администратора, загрузившего отчёт; NULL у задач kind=rematch и kind=review, созданных воркером';
@@ -0,0 +1,13 @@
+-- Постраничная выдача строк отчётов идёт по ключу (uploaded_at, id): строки с NULL в uploaded_at
+-- не попадали под сравнение кортежей и ломали курсор. Дата загрузки таких строк неизвестна —
+-- ставим начало эпохи, чтобы они шли последними, и запрещаем NULL дальше
+
+UPDATE financial_reports
+SET uploaded_at = TIMESTAMP 'epoch'
+WHERE uploaded_at IS NULL;
+
+ALTER TABLE financial_reports
+ALTER COLUMN uploaded_at SET DEFAULT CURRENT_TIMESTAMP,
+ALTER COLUMN uploaded_at SET NOT NULL;
+
+COMMENT ON COLUMN financial_reports.uploaded_at IS 'Дата загрузки строки; 1970-01-01 — для старых строк, где дата не была записана';
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк нормализации строк финансового отчёта:
+построчный путь (как было в process_chunk) против пакетного (normalize_column / parse_amount_column).
+
+Запуск из корня репозитория (нужны зависимости backend/process-financial-jobs/requirements.txt):
+    python3 scripts/benchmark_financial_normalization.py [rows]
+"""
+
+import importlib.util
+import random
+import sys
+import time
+from pathlib import Path
+
+WORKER_PATH = Path(__file__).resolve().parent.parent / 'backend' / 'process-financial-jobs' / 'index.py'
+
+
+def load_worker():
+    spec = importlib.util.spec_from_file_location('process_financial_jobs', WORKER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_normalize_string(s: str) -> str:
+    if not s:
+        return ""
+    s = s.strip().lower()
+    s = s.replace('«', '').replace('»', '').replace('"', '').replace('"', '')
+    s = s.replace('(', '').replace(')', '').replace('[', '').replace(']', '')
+    s = ' '.join(s.split())
+    return s
+
+
+def legacy_path(rows):
+    """Построчно: str(), normalize_string, разбор суммы и сборка ключа — как до пакетной обработки"""
+    keys = []
+    amounts = []
+    for row in rows:
+        artist_name = str(row[6]) if row[6] else ""
+        album_name = str(row[8]) if row[8] else ""
+        amount_str = str(row[13]) if row[13] else "0"
+        try:
+            amount = float(amount_str.replace(',', '.').replace(' ', ''))
+        except (ValueError, AttributeError):
+            amount = 0.0
+        keys.append(f"{legacy_normalize_string(artist_name)}||{legacy_normalize_string(album_name)}")
+        amounts.append(amount)
+    return keys, amounts
+
+
+def batched_path(worker, rows):
+    """Пакетно: колонки собираются один раз, нормализация и разбор сумм идут по целым колонкам"""
+    artists = [str(row[6]) if row[6] else "" for row in rows]
+    albums = [str(row[8]) if row[8] else "" for row in rows]
+    amounts = worker.parse_amount_column([row[13] for row in rows])
+    keys = [f"{artist}||{album}" for artist, album in zip(worker.normalize_column(artists), worker.normalize_column(albums))]
+    return keys, amounts
+
+
+def synthetic_report(row_count: int):
+    random.seed(42)
+    artists = [f'Артист «{i}» feat. Гость {i % 7}' for i in range(2000)]
+    albums = [f'Альбом (Deluxe) [{i}]  Vol. {i % 5}' for i in range(3000)]
+    rows = []
+    for _ in range(row_count):
+        row = [None] * 14
+        row[6] = random.choice(artists)
+        row[8] = random.choice(albums)
+        row[13] = round(random.uniform(0, 50), 4)
+        rows.append(tuple(row))
+    return rows
+
+
+def measure(label: str, func, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<10} {best * 1000:8.1f} ms")
+    return best
+
+
+def main():
+    row_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    worker = load_worker()
+    rows = synthetic_report(row_count)
+
+    legacy_keys, legacy_amounts = legacy_path(rows)
+    batched_keys, batched_amounts = batched_path(worker, rows)
+    assert legacy_keys == batched_keys
+    assert legacy_amounts == list(batched_amounts)
+
+    print(f"Synthetic report: {row_count} rows")
+    legacy = measure('per-row', lambda: legacy_path(rows))
+    batched = measure('batched', lambda: batched_path(worker, rows))
+    print(f"Speedup: {legacy / batched:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк накладных расходов S3 на один запрос к upload-direct:
+новый boto3-клиент на каждый запрос (как было) против общего клиента get_s3_client().
+В обоих случаях POST-политика подписывается заново под точный ключ загрузки.
+
+Сеть не нужна: и сборка клиента, и подпись политики выполняются локально.
+Запуск из корня репозитория (нужны зависимости backend/upload-direct/requirements.txt):
+    python3 scripts/benchmark_s3_client.py [requests]
+"""
+
+import importlib.util
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import boto3
+
+UPLOAD_DIRECT_PATH = Path(__file__).resolve().parent.parent / 'backend' / 'upload-direct' / 'index.py'
+BUCKET = 'benchmark-bucket'
+MAX_SIZE = 100 * 1024 * 1024
+
+
+def load_upload_direct():
+    spec = importlib.util.spec_from_file_location('upload_direct', UPLOAD_DIRECT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def sign_upload(s3_client, content_type: str):
+    s3_key = f"uploads/2024/01/01/{uuid.uuid4()}.wav"
+    return s3_client.generate_presigned_post(
+        Bucket=BUCKET,
+        Key=s3_key,
+        Fields={'Content-Type': content_type},
+        Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, MAX_SIZE]],
+        ExpiresIn=3600
+    )
+
+
+def legacy_request(content_type: str):
+    """Как было: клиент собирается заново на каждый запрос"""
+    s3_client = boto3.client(
+        's3',
+        endpoint_url='https://storage.yandexcloud.net',
+        aws_access_key_id=os.environ['YC_S3_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['YC_S3_SECRET_ACCESS_KEY'],
+        region_name='ru-central1'
+    )
+    return sign_upload(s3_client, content_type)
+
+
+def shared_request(upload_direct, content_type: str):
+    """Как стало: общий клиент экземпляра функции"""
+    return sign_upload(upload_direct.get_s3_client(), content_type)
+
+
+def measure(label: str, func, requests: int) -> float:
+    started = time.perf_counter()
+    for i in range(requests):
+        func('audio/wav' if i % 2 else 'image/jpeg')
+    per_request = (time.perf_counter() - started) / requests
+    print(f"{label:<8} {per_request * 1000:8.3f} ms/request")
+    return per_request
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    os.environ.setdefault('YC_S3_ACCESS_KEY_ID', 'benchmark-key')
+    os.environ.setdefault('YC_S3_SECRET_ACCESS_KEY', 'benchmark-secret')
+    upload_direct = load_upload_direct()
+
+    print(f"{requests} presigned POST requests")
+    legacy = measure('before', legacy_request, requests)
+    shared = measure('after', lambda content_type: shared_request(upload_direct, content_type), requests)
+    print(f"Speedup: {legacy / shared:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -32,7 +32,9 @@ export default function ArtistFinance({ userId, userBalance, onRefreshData }: Ar
   const [showTopUp, setShowTopUp] = useState(false);
   const [reports, setReports] = useState<FinancialReport[]>([]);
   const [stats, setStats] = useState<ReportStats | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const minWithdrawal = 1500;
   const balance = userBalance || 0;
@@ -54,6 +56,7 @@ export default function ArtistFinance({ userId, userBalance, onRefreshData }: Ar
       const data = await response.json();
       setReports(data.reports || []);
       setStats(data.stats || null);
+      setNextCursor(data.next_cursor || null);
     } catch (error) {
       console.error('Error loading financial reports:', error);
     } finally {
@@ -61,6 +64,27 @@ export default function ArtistFinance({ userId, userBalance, onRefreshData }: Ar
     }
   };
 
+  const loadMoreReports = async () => {
+    if (!nextCursor) return;
+    try {
+      setLoadingMore(true);
+      const url = `${API_ENDPOINTS.ARTIST_FINANCIAL_REPORTS}?cursor=${encodeURIComponent(nextCursor)}`;
+      const response = await fetch(url, {
+        headers: { 'X-User-Id': userId.toString() }
+      });
+      
+      if (!response.ok) throw new Error('Failed to load reports');
+      
+      const data = await response.json();
+      setReports((prev) => [...prev, ...(data.reports || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (error) {
+      console.error('Error loading financial reports:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   return (
     <div className="space-y-4 md:space-y-6 animate-fadeIn">
       <div className="grid grid-cols-1 lg:grid-cols-3 gap-4">
@@ -249,6 +273,14 @@ export default function ArtistFinance({ userId, userBalance, onRefreshData }: Ar
                 ))}
               </tbody>
             </table>
+            {nextCursor && (
+              <div className="flex justify-center pt-4">
+                <Button variant="outline" onClick={loadMoreReports} disabled={loadingMore}>
+                  {loadingMore && <Icon name="Loader2" className="w-4 h-4 mr-2 animate-spin" />}
+                  Показать ещё
+                </Button>
+              </div>
+            )}
           </div>
         ) : (
           <div className="text-center py-12">
@@ -23,6 +23,7 @@ interface UploadJob {
   total_chunks?: number;
   completed_chunks?: number;
   progress?: number;
+  duplicate_rows?: number;
 }
 
 export default function FinancialReportsUpload({ userId }: FinancialReportsUploadProps) {
@@ -40,6 +41,8 @@ export default function FinancialReportsUpload({ userId }: FinancialReportsUploa
     '4 квартал 2024',
   ];
 
+  const [version, setVersion] = useState<number | null>(null);
+
   const loadJobs = async () => {
     try {
       const response = await fetch(API_ENDPOINTS.UPLOAD_FINANCIAL_REPORT, {
@@ -52,6 +55,7 @@ export default function FinancialReportsUpload({ userId }: FinancialReportsUploa
       const data = await response.json();
       if (data.jobs) {
         setJobs(data.jobs);
+        setVersion(data.version ?? 0);
       }
     } catch (err) {
       console.error('Failed to load jobs:', err);
@@ -61,16 +65,43 @@ export default function FinancialReportsUpload({ userId }: FinancialReportsUploa
   useEffect(() => {
     console.log('🔄 FinancialReportsUpload mounted');
     loadJobs();
-    
-    const interval = setInterval(() => {
-      const hasActiveJobs = jobs.some(j => j.status === 'pending' || j.status === 'processing');
-      if (hasActiveJobs) {
-        loadJobs();
+  }, []);
+
+  useEffect(() => {
+    const hasActiveJobs = jobs.some(j => j.status === 'pending' || j.status === 'processing');
+    if (version === null || !hasActiveJobs) return;
+
+    // Long-poll: сервер отвечает, только когда прогресс изменился (или по таймауту ~25 с)
+    const controller = new AbortController();
+    const waitForChanges = async () => {
+      try {
+        const response = await fetch(`${API_ENDPOINTS.UPLOAD_FINANCIAL_REPORT}?since=${version}&wait=25`, {
+          method: 'GET',
+          headers: {
+            'Content-Type': 'application/json',
+            'X-User-Id': userId.toString()
+          },
+          signal: controller.signal
+        });
+        const data = await response.json();
+        if (data.jobs && data.jobs.length > 0) {
+          const changed = new Map<number, UploadJob>(data.jobs.map((job: UploadJob) => [job.id, job]));
+          setJobs(prev => prev.map(job => changed.get(job.id) ?? job));
+          setVersion(data.version);
+        } else {
+          // Таймаут без изменений — сверяемся с полным списком на случай пропущенного обновления
+          loadJobs();
+        }
+      } catch (err) {
+        if (controller.signal.aborted) return;
+        console.error('Failed to wait for job progress:', err);
+        setTimeout(loadJobs, 3000);
       }
-    }, 3000);
-    
-    return () => clearInterval(interval);
-  }, [jobs]);
+    };
+
+    waitForChanges();
+    return () => controller.abort();
+  }, [version, jobs]);
 
   const handleFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     const file = e.target.files?.[0];
@@ -352,6 +383,12 @@ export default function FinancialReportsUpload({ userId }: FinancialReportsUploa
                         </div>
                       )}
 
+                      {job.duplicate_rows ? (
+                        <div className="mt-2 text-xs text-yellow-400">
+                          Пропущено строк, уже загруженных за период: {job.duplicate_rows}
+                        </div>
+                      ) : null}
+
                       {job.status === 'failed' && job.error_message && (
                         <div className="mt-2 text-xs text-red-400">
                           Ошибка: {job.error_message}
@@ -61,9 +61,10 @@ export async function uploadFile(file: File, onProgress?: UploadProgressCallback
     console.log(`[Upload] Uploading ${totalChunks} chunks...`);
     
     let s3Key = '';
+    let uploadId = '';
     let finalUrl = '';
     
-    // Загружаем chunks последовательно (бэкенд сохраняет в temp и собирает в конце)
+    // Загружаем chunks последовательно (бэкенд складывает их в S3 multipart по мере поступления)
     for (let i = 0; i < totalChunks; i++) {
       const start = i * chunkSize;
       const end = Math.min(start + chunkSize, file.size);
@@ -91,7 +92,8 @@ export async function uploadFile(file: File, onProgress?: UploadProgressCallback
           contentType,
           chunkIndex: i,
           totalChunks,
-          s3Key: i > 0 ? s3Key : undefined
+          s3Key: i > 0 ? s3Key : undefined,
+          uploadId: i > 0 ? uploadId : undefined
         })
       });
       
@@ -103,6 +105,7 @@ export async function uploadFile(file: File, onProgress?: UploadProgressCallback
       
       if (i === 0) {
         s3Key = result.s3Key;
+        uploadId = result.uploadId;
       }
       
       // Последний chunk - бэкенд вернёт финальный URL